@@ -2,14 +2,26 @@ import gitlab
 import yaml
 import csv
 import argparse
+import contextlib
+import io
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+
+# 身份缓存、REST 客户端与分支保护对账模块来自 zjugit-scripts 包（见 pyproject.toml）
+from identity_cache import IdentityCache
+from gitlab_client import GitLabClient
+from branch_protection import BranchProtectionReconciler, Protection, MISSING, UNCHANGED
 
 
 class Config:
     """全局配置管理器，单例模式"""
     _instance = None
     _config = None
+    _identity_cache = None
 
     def __new__(cls):
         if cls._instance is None:
@@ -56,6 +68,13 @@ class Config:
         """拼接上游仓库的完整导入URL"""
         return f"{self.gitlab_url}/{self.course_upstream}.git"
 
+    @property
+    def identity_cache(self):
+        """本地身份缓存，首次访问时打开"""
+        if self._identity_cache is None:
+            self._identity_cache = IdentityCache.from_settings(self._config.get('identity_cache'))
+        return self._identity_cache
+
     def get_protected_branches(self):
         """获取需要保护的分支列表"""
         return ['main'] + list(self.deadlines.keys())
@@ -65,6 +84,89 @@ class Config:
 config = Config()
 
 
+class UserDirectory:
+    """GitLab 用户目录：批量解析学号并在内存中维护 学号 -> 用户 的索引"""
+
+    def __init__(self, workers=8):
+        # 并发精确查询的线程数，与 python-gitlab 默认的连接池大小相适应
+        self.workers = workers
+        self._users = {}  # 学号（小写）-> 用户对象，None 表示用户不存在
+        self._lock = threading.Lock()
+
+    def resolve(self, gl, client, sids, workers=None):
+        """批量解析一组学号，返回实际发出的请求数
+
+        本地身份缓存未命中的学号通过 GraphQL 按用户名批量查询，每批 100 个；
+        批量查询失败或未返回的学号再按 username 精确查询，并发执行。
+        不使用按前缀的 search：它在全站范围内同时匹配姓名和邮箱，一个前缀可能翻过大量无关用户。
+        """
+        with self._lock:
+            pending = {sid.lower() for sid in sids} - self._users.keys()
+
+        # 本地身份缓存中已有的学号无需查询
+        for sid in list(pending):
+            user_id = config.identity_cache.get_user_id(sid)
+            if user_id is not None:
+                with self._lock:
+                    self._users[sid] = gl.users.get(user_id, lazy=True)
+                pending.discard(sid)
+        if not pending:
+            return 0
+
+        requests_sent = 0
+        try:
+            found, requests_sent = client.find_users(pending)
+        except Exception as e:
+            print(f"批量查询用户失败: {e}，将逐个查询")
+            found = {}
+        for sid, user_id in found.items():
+            if sid in pending:
+                self._store(sid, gl.users.get(user_id, lazy=True))
+                pending.discard(sid)
+        if not pending:
+            return requests_sent
+
+        def lookup(sid):
+            try:
+                self._lookup(gl, sid)
+            except Exception as e:
+                print(f"查询用户 {sid} 时出错: {e}")
+
+        with ThreadPoolExecutor(max_workers=workers or self.workers) as executor:
+            list(executor.map(lookup, sorted(pending)))
+        return requests_sent + len(pending)
+
+    def get(self, gl, sid):
+        """返回学号对应的用户，不存在时返回 None；索引与缓存均未命中时精确查询一次"""
+        key = sid.lower()
+        with self._lock:
+            if key in self._users:
+                return self._users[key]
+        user_id = config.identity_cache.get_user_id(key)
+        if user_id is not None:
+            user = gl.users.get(user_id, lazy=True)
+            with self._lock:
+                self._users[key] = user
+            return user
+        return self._lookup(gl, key)
+
+    def _lookup(self, gl, sid):
+        users = gl.users.list(username=sid)
+        user = users[0] if users else None
+        self._store(sid, user)
+        return user
+
+    def _store(self, sid, user):
+        with self._lock:
+            self._users[sid] = user
+        if user is not None:
+            config.identity_cache.set_user_id(sid, user.id)
+
+
+# 全局用户目录实例
+user_directory = UserDirectory()
+
+
 def get_or_create_subgroup(gl, parent_id, name, path, full_path):
     """获取或创建 GitLab 子组"""
     groups = gl.groups.list(search=path)
@@ -100,42 +202,42 @@ def get_teacher_list(data_dir, teacher=None):
                 if os.path.isdir(os.path.join(data_dir, d))]
 
 
-def create_student_repo(gl, teacher_obj, sid, name):
+def create_student_repo(gl, project_index, sid, name):
     """为单个学生创建仓库"""
-    repo_prefix = config.student_repo_prefix
     upstream_import_url = config.upstream_import_url
 
-    project_name = f"{repo_prefix}{sid}" if repo_prefix else sid
+    project_name = project_index.project_name(sid)
 
     try:
         # 检查项目是否已存在
-        existing_projects = gl.projects.list(search=project_name, owned=True)
-        project = None
-        for p in existing_projects:
-            if p.namespace['id'] == teacher_obj.id and p.name == project_name:
-                project = p
-                break
+        project = project_index.find(project_name)
 
         if project is None:
             # 创建新项目
             print(upstream_import_url)
             project = gl.projects.create({
                 'name': project_name,
-                'namespace_id': teacher_obj.id,
+                'namespace_id': project_index.group.id,
                 'visibility': 'private',
                 'import_url': upstream_import_url
             })
+            project_index.add(project)
             print(f"仓库 {project.path_with_namespace} 创建成功")
 
         # 添加学生为开发者
         try:
-            users = gl.users.list(username=sid)
             # 此时用户一定存在，因为在 init_student_repo 中已经检查过了
+            user = user_directory.get(gl, sid)
             project.members.create({
-                'user_id': users[0].id,
+                'user_id': user.id,
                 'access_level': gitlab.const.AccessLevel.DEVELOPER
             })
             print(f"已添加学生 {sid} 为开发者")
+        except gitlab.exceptions.GitlabCreateError as e:
+            if e.response_code == 404 and project_index.stale(project_name):
+                # 本地缓存中的项目已不存在，重新查找或创建
+                return create_student_repo(gl, project_index, sid, name)
+            print(f"添加成员失败: {e}")
         except Exception as e:
             print(f"添加成员失败: {e}")
 
@@ -162,14 +264,13 @@ def create_student_repo(gl, teacher_obj, sid, name):
         return None
 
 
-def init_student_repo(gl, teacher_obj, sid, name):
+def init_student_repo(gl, project_index, sid, name):
     """为单个学生初始化仓库"""
     print(f"处理学生: {name} ({sid})")
 
     # 首先检查用户在GitLab中是否存在
     try:
-        users = gl.users.list(username=sid)
-        if not users:
+        if user_directory.get(gl, sid) is None:
             print(f"✗ 用户 {sid}（{name}）在 GitLab 中不存在，跳过创建仓库")
             return False
         print(f"✓ 用户 {sid}（{name}）在 GitLab 中存在")
@@ -177,35 +278,25 @@ def init_student_repo(gl, teacher_obj, sid, name):
         print(f"查询用户 {sid}（{name}）时出错: {e}，跳过创建仓库")
         return False
 
-    project = create_student_repo(gl, teacher_obj, sid, name)
+    project = create_student_repo(gl, project_index, sid, name)
     return project is not None
 
 
-def repo_init_for_teacher(gl, teacher, term_obj):
-    """为单个教师初始化学生仓库"""
-    course_group = config.course_group
-    term = config.course_term
-    data_dir = 'data'
-
-    # 获取或创建教师子组
-    teacher_full_path = f"{course_group}/{term}/{teacher}"
-    teacher_obj = get_or_create_subgroup(
-        gl, term_obj.id, teacher, teacher, teacher_full_path)
-
-    # 读取学生名单
+def read_student_roster(teacher, data_dir='data'):
+    """读取教师的学生名单，返回 [(sid, name), ...]；名单缺失或格式错误时返回 None"""
     student_csv = os.path.join(data_dir, teacher, 'student.csv')
     if not os.path.exists(student_csv):
         print(f"未找到学生名单文件: {student_csv}，跳过")
-        return 0
+        return None
 
-    student_count = 0
-    with open(student_csv, newline='') as csvfile:
+    students = []
+    with open(student_csv, newline='', encoding='utf-8-sig') as csvfile:
         reader = csv.DictReader(csvfile)
 
         # 检查CSV文件是否有必要的列
         if reader.fieldnames is None:
             print(f"错误: CSV文件 {student_csv} 为空或没有标题行")
-            return 0
+            return None
 
         # 清理字段名，去除可能的BOM和空白字符
         fieldnames = [field.strip() for field in reader.fieldnames]
@@ -214,7 +305,7 @@ def repo_init_for_teacher(gl, teacher, term_obj):
             print(f"错误: CSV文件 {student_csv} 缺少必要的列 'id' 或 'name'")
             print(f"当前列名: {reader.fieldnames}")
             print(f"清理后列名: {fieldnames}")
-            return 0
+            return None
 
         for row in reader:
             # 处理可能带BOM的键名
@@ -226,134 +317,220 @@ def repo_init_for_teacher(gl, teacher, term_obj):
                 print(f"警告: 跳过空行或缺少id/name的行: {row}")
                 continue
 
-            sid = row[id_key].strip()
-            name = row[name_key].strip()
-
-            if init_student_repo(gl, teacher_obj, sid, name):
-                student_count += 1
+            students.append((row[id_key].strip(), row[name_key].strip()))
 
-    print(f"共处理 {student_count} 个学生")
-    return student_count
+    return students
 
 
-def repo_delete_for_teacher(gl, teacher):
-    """为单个教师删除所有学生仓库"""
-    course_group = config.course_group
-    term = config.course_term
-    repo_prefix = config.student_repo_prefix
-    data_dir = 'data'
+def get_teacher_group(gl, teacher, term_obj):
+    """获取或创建教师子组"""
+    teacher_full_path = f"{config.course_group}/{config.course_term}/{teacher}"
+    return get_or_create_subgroup(
+        gl, term_obj.id, teacher, teacher, teacher_full_path)
 
-    student_csv = os.path.join(data_dir, teacher, 'student.csv')
-    if not os.path.exists(student_csv):
-        print(f"未找到学生名单文件: {student_csv}，跳过")
-        return 0
 
-    deleted_count = 0
+class ProjectIndex:
+    """教师子组的项目索引
 
-    with open(student_csv, newline='', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
+    一次分页列出子组下的全部项目，按名称和路径索引，并写入本地身份缓存；
+    子组无法列出时退回本地身份缓存。
+    """
 
-        # 检查CSV文件是否有必要的列
-        if reader.fieldnames is None:
-            print(f"错误: CSV文件 {student_csv} 为空或没有标题行")
-            return 0
+    def __init__(self, gl, teacher, group=None):
+        self.teacher = teacher
+        self.group = group
+        self._gl = gl
+        self._projects = {}
+        self._lock = threading.Lock()
+        self._listed = False
+        # find() 中按本地缓存 ID 返回、尚未经过确认的项目
+        self._cached = set()
+        # 只有成功列出整个子组时，索引未命中才能直接判定项目不存在
+        self.complete = False
+
+    @classmethod
+    def load(cls, gl, teacher):
+        """为已有的教师子组建立索引，子组在首次需要列出项目时才获取"""
+        return cls(gl, teacher)
 
-        # 清理字段名，去除可能的BOM和空白字符
-        fieldnames = [field.strip() for field in reader.fieldnames]
+    @property
+    def group_path(self):
+        return f"{config.course_group}/{config.course_term}/{self.teacher}"
+
+    @staticmethod
+    def project_name(sid):
+        """学生仓库名称"""
+        return f"{config.student_repo_prefix}{sid}"
+
+    def repo_path(self, project_name):
+        """学生仓库的完整路径"""
+        return f"{self.group_path}/{project_name}"
+
+    def _ensure_listed(self):
+        """列出子组下的全部项目，只执行一次；子组不存在时退化为逐个查询"""
+        with self._lock:
+            if self._listed:
+                return
+            self._listed = True
+            if self.group is None:
+                try:
+                    self.group = self._gl.groups.get(self.group_path)
+                except gitlab.exceptions.GitlabGetError:
+                    print(f"未找到教师子组 {self.group_path}，将逐个查询学生仓库")
+                    return
+            try:
+                for project in self.group.projects.list(iterator=True, with_shared=False):
+                    self._add(project)
+                self.complete = True
+            except Exception as e:
+                print(f"列出子组 {self.group_path} 的项目失败: {e}，将逐个查询学生仓库")
+
+    def _add(self, project):
+        self._projects[project.name] = project
+        self._projects[project.path] = project
+        config.identity_cache.set_project(
+            self.repo_path(project.path), project.id, getattr(project, 'default_branch', None))
+
+    def add(self, project):
+        with self._lock:
+            self._add(project)
+
+    def remove(self, project_name):
+        with self._lock:
+            project = self._projects.pop(project_name, None)
+            if project is not None:
+                self._projects.pop(project.name, None)
+                self._projects.pop(project.path, None)
+        config.identity_cache.invalidate_project(self.repo_path(project_name))
+
+    def find(self, project_name):
+        """返回可直接操作的项目对象，不存在时返回 None
+
+        先一次列出子组建立索引，命中时返回 lazy 对象，不再发出 GET 请求；
+        子组无法完整列出时才使用本地缓存中的项目 ID，同样返回 lazy 对象。
+        缓存的项目可能已被删除或移走，由调用方在后续请求失败时调用 stale() 删除缓存条目。
+        """
+        self._ensure_listed()
+        project = self._projects.get(project_name)
+        if project is not None:
+            return self._gl.projects.get(project.id, lazy=True)
+        repo_path = self.repo_path(project_name)
+        if self.complete:
+            # 子组中已没有该项目，缓存中的记录失效
+            config.identity_cache.invalidate_project(repo_path)
+            return None
+        project_id = config.identity_cache.get_project_id(repo_path)
+        if project_id is not None:
+            with self._lock:
+                self._cached.add(project_name)
+            return self._gl.projects.get(project_id, lazy=True)
+        try:
+            project = self._gl.projects.get(repo_path)
+        except gitlab.exceptions.GitlabGetError:
+            return None
+        self.add(project)
+        return project
 
-        if 'id' not in fieldnames or 'name' not in fieldnames:
-            print(f"错误: CSV文件 {student_csv} 缺少必要的列 'id' 或 'name'")
-            print(f"当前列名: {reader.fieldnames}")
-            print(f"清理后列名: {fieldnames}")
-            return 0
+    def stale(self, project_name):
+        """find() 返回的缓存项目在后续请求中不存在时调用，删除缓存条目
 
-        for row in reader:
-            # 处理可能带BOM的键名
-            id_key = next((k for k in row.keys() if k.strip() == 'id'), None)
-            name_key = next(
-                (k for k in row.keys() if k.strip() == 'name'), None)
+        返回该项目是否来自本地缓存；为 True 时调用方可以重新 find()。
+        """
+        with self._lock:
+            cached = project_name in self._cached
+            self._cached.discard(project_name)
+        self.remove(project_name)
+        return cached
 
-            if not id_key or not name_key or not row.get(id_key) or not row.get(name_key):
-                print(f"警告: 跳过空行或缺少id/name的行: {row}")
-                continue
 
-            sid = row[id_key].strip()
-            name = row[name_key].strip()
+def repo_init_for_teacher(gl, teacher, term_obj):
+    """为单个教师初始化学生仓库"""
+    # 获取或创建教师子组，并索引其中已有的项目
+    project_index = ProjectIndex(gl, teacher, get_teacher_group(gl, teacher, term_obj))
 
-            # 构建仓库路径
-            repo_path = f"{course_group}/{term}/{teacher}/{repo_prefix}{sid}"
+    # 读取学生名单
+    students = read_student_roster(teacher)
+    if students is None:
+        return 0
 
-            try:
-                # 查找并删除学生项目
-                student_project = gl.projects.get(repo_path)
-                student_project.delete()
-                print(f"✓ 已删除仓库: {repo_path}")
-                deleted_count += 1
-            except gitlab.exceptions.GitlabGetError:
-                print(f"✗ 仓库不存在: {repo_path}")
-            except Exception as e:
-                print(f"✗ 删除仓库 {repo_path} 失败: {e}")
+    student_count = 0
+    for sid, name in students:
+        if init_student_repo(gl, project_index, sid, name):
+            student_count += 1
 
-    print(f"共删除 {deleted_count} 个仓库")
-    return deleted_count
+    print(f"共处理 {student_count} 个学生")
+    return student_count
 
 
-def student_check_for_teacher(gl, teacher):
-    """为单个教师检查学生在GitLab中的存在状态"""
-    data_dir = 'data'
+def delete_student_repo(gl, project_index, sid, name):
+    """删除单个学生的仓库"""
+    project_name = project_index.project_name(sid)
+    repo_path = project_index.repo_path(project_name)
 
-    student_csv = os.path.join(data_dir, teacher, 'student.csv')
-    if not os.path.exists(student_csv):
-        print(f"未找到学生名单文件: {student_csv}，跳过")
-        return []
+    try:
+        # 查找并删除学生项目
+        student_project = project_index.find(project_name)
+        if student_project is None:
+            print(f"✗ 仓库不存在: {repo_path}")
+            return False
+        try:
+            student_project.delete()
+        except gitlab.exceptions.GitlabDeleteError as e:
+            if e.response_code != 404:
+                raise
+            project_index.stale(project_name)
+            print(f"✗ 仓库不存在: {repo_path}")
+            return False
+        project_index.remove(project_name)
+        print(f"✓ 已删除仓库: {repo_path}")
+        return True
+    except Exception as e:
+        print(f"✗ 删除仓库 {repo_path} 失败: {e}")
+    return False
 
-    missing_students = []
-    found_students = []
 
-    with open(student_csv, newline='', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
+def repo_delete_for_teacher(gl, teacher):
+    """为单个教师删除所有学生仓库"""
+    students = read_student_roster(teacher)
+    if students is None:
+        return 0
 
-        # 检查CSV文件是否有必要的列
-        if reader.fieldnames is None:
-            print(f"错误: CSV文件 {student_csv} 为空或没有标题行")
-            return []
+    project_index = ProjectIndex.load(gl, teacher)
+    deleted_count = 0
+    for sid, name in students:
+        if delete_student_repo(gl, project_index, sid, name):
+            deleted_count += 1
 
-        # 清理字段名，去除可能的BOM和空白字符
-        fieldnames = [field.strip() for field in reader.fieldnames]
+    print(f"共删除 {deleted_count} 个仓库")
+    return deleted_count
 
-        if 'id' not in fieldnames or 'name' not in fieldnames:
-            print(f"错误: CSV文件 {student_csv} 缺少必要的列 'id' 或 'name'")
-            print(f"当前列名: {reader.fieldnames}")
-            print(f"清理后列名: {fieldnames}")
-            return []
 
-        for row in reader:
-            # 处理可能带BOM的键名
-            id_key = next((k for k in row.keys() if k.strip() == 'id'), None)
-            name_key = next(
-                (k for k in row.keys() if k.strip() == 'name'), None)
+def check_student(gl, teacher, sid, name):
+    """检查单个学生在GitLab中是否存在，不存在时返回学生信息，否则返回 None"""
+    try:
+        if user_directory.get(gl, sid) is not None:
+            print(f"✓ 找到用户: {sid}（{name}）")
+            return None
+        print(f"✗ 未找到用户: {sid}（{name}）")
+    except Exception as e:
+        print(f"查询用户 {sid}（{name}）时出错: {e}")
+    return {'sid': sid, 'name': name}
 
-            if not id_key or not name_key or not row.get(id_key) or not row.get(name_key):
-                print(f"警告: 跳过空行或缺少id/name的行: {row}")
-                continue
 
-            sid = row[id_key].strip()
-            name = row[name_key].strip()
+def student_check_for_teacher(gl, teacher):
+    """为单个教师检查学生在GitLab中的存在状态"""
+    students = read_student_roster(teacher)
+    if students is None:
+        return []
 
-            # 在GitLab中查询用户
-            try:
-                users = gl.users.list(username=sid)
-                if users:
-                    found_students.append({'sid': sid, 'name': name})
-                    print(f"✓ 找到用户: {sid}（{name}）")
-                else:
-                    missing_students.append({'sid': sid, 'name': name})
-                    print(f"✗ 未找到用户: {sid}（{name}）")
-            except Exception as e:
-                print(f"查询用户 {sid}（{name}）时出错: {e}")
-                missing_students.append({'sid': sid, 'name': name})
+    missing_students = []
+    for sid, name in students:
+        missing = check_student(gl, teacher, sid, name)
+        if missing:
+            missing_students.append(missing)
 
-    print(f"找到的学生: {len(found_students)} 人，未找到的学生: {len(missing_students)} 人")
+    found_count = len(students) - len(missing_students)
+    print(f"找到的学生: {found_count} 人，未找到的学生: {len(missing_students)} 人")
 
     if missing_students:
         print("未找到的学生列表:")
@@ -409,98 +586,85 @@ def is_lab_deadline_passed(lab_name):
         return False
 
 
-def close_lab_for_student(gl, lab_name, teacher, sid):
-    """为单个学生关闭实验分支的推送权限"""
-    course_group = config.course_group
-    term = config.course_term
-    repo_prefix = config.student_repo_prefix
-
-    # 查找学生项目
-    repo_path = f"{course_group}/{term}/{teacher}/{repo_prefix}{sid}"
-    try:
-        student_project = gl.projects.get(repo_path)
+def close_lab(gl, client, teacher_filter, lab_name, jobs=1):
+    """关闭所有学生实验分支的推送权限
 
-        # 检查实验分支是否存在
-        try:
-            branch = student_project.branches.get(lab_name)
-        except gitlab.exceptions.GitlabGetError:
-            print(f"学生 {sid} 的分支 {lab_name} 不存在，跳过")
-            return False
+    先批量读取整届学生该分支的保护规则，只对尚未设置为 NO_ACCESS 的分支发出修改请求，
+    因此中途失败后重跑几乎不产生额外请求。
+    """
+    teachers = get_teacher_list('data', teacher_filter)
+    print(f"处理教师: {teachers}")
 
-        # 更新分支保护设置，禁止推送
-        try:
-            # 先删除现有保护
+    # 先找到所有学生的仓库，再统一对账
+    plans = []
+    for teacher in teachers:
+        students = read_student_roster(teacher)
+        if students is None:
+            continue
+        project_index = ProjectIndex.load(gl, teacher)
+        entries = []
+        for sid, name in students:
+            project_name = project_index.project_name(sid)
             try:
-                protected_branch = student_project.protectedbranches.get(
-                    lab_name)
-                protected_branch.delete()
-            except gitlab.exceptions.GitlabGetError:
-                pass  # 分支可能没有保护
-
-            # 重新创建保护，设置为 NO_ACCESS
-            student_project.protectedbranches.create({
-                'name': lab_name,
-                'push_access_level': gitlab.const.AccessLevel.NO_ACCESS,
-                'merge_access_level': gitlab.const.AccessLevel.NO_ACCESS,
-                'allow_force_push': False
-            })
-            print(f"学生 {sid} 的分支 {lab_name} 推送权限已关闭")
-            return True
-
-        except Exception as e:
-            print(f"关闭学生 {sid} 分支 {lab_name} 推送权限失败: {e}")
-            return False
-
-    except Exception as e:
-        print(f"处理学生 {sid} 失败: {e}")
-        return False
-
-
-def lab_close_for_teacher(gl, teacher, lab_name):
-    """为单个教师的学生关闭实验分支推送权限"""
-    data_dir = 'data'
-
-    student_csv = os.path.join(data_dir, teacher, 'student.csv')
-    if not os.path.exists(student_csv):
-        print(f"未找到学生名单: {student_csv}")
-        return 0
-
-    student_count = 0
-    with open(student_csv, newline='', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-
-        # 检查CSV文件是否有必要的列
-        if reader.fieldnames is None:
-            print(f"错误: CSV文件 {student_csv} 为空或没有标题行")
-            return 0
-
-        # 清理字段名，去除可能的BOM和空白字符
-        fieldnames = [field.strip() for field in reader.fieldnames]
-
-        if 'id' not in fieldnames or 'name' not in fieldnames:
-            print(f"错误: CSV文件 {student_csv} 缺少必要的列 'id' 或 'name'")
-            print(f"当前列名: {reader.fieldnames}")
-            print(f"清理后列名: {fieldnames}")
-            return 0
-
-        for row in reader:
-            # 处理可能带BOM的键名
-            id_key = next((k for k in row.keys() if k.strip() == 'id'), None)
-            name_key = next(
-                (k for k in row.keys() if k.strip() == 'name'), None)
-
-            if not id_key or not name_key or not row.get(id_key) or not row.get(name_key):
-                print(f"警告: 跳过空行或缺少id/name的行: {row}")
+                project = project_index.find(project_name)
+            except Exception as e:
+                entries.append((sid, None, f"处理学生 {sid} 失败: {e}"))
+                continue
+            if project is None:
+                entries.append((sid, None, f"学生 {sid} 的仓库 {project_index.repo_path(project_name)} 不存在，跳过"))
                 continue
+            entries.append((sid, str(project.id), None))
+        plans.append((teacher, project_index, entries))
 
-            sid = row[id_key].strip()
-            name = row[name_key].strip()
+    reconciler = BranchProtectionReconciler(
+        client, lab_name,
+        Protection.of(gitlab.const.AccessLevel.NO_ACCESS, gitlab.const.AccessLevel.NO_ACCESS),
+        workers=jobs, require_branch=True)
+    results, failures = reconciler.reconcile(
+        project_id for _, _, entries in plans for _, project_id, _ in entries if project_id is not None)
 
-            if close_lab_for_student(gl, lab_name, teacher, sid):
+    total_count = 0
+    for teacher, project_index, entries in plans:
+        print(f"\n--- 处理教师: {teacher} ---")
+        student_count = 0
+        for sid, project_id, message in entries:
+            if project_id is None:
+                print(message)
+            elif project_id in failures:
+                # 来自本地缓存的项目可能已被删除，删除缓存条目，重跑时重新查找
+                project_index.stale(project_index.project_name(sid))
+                print(f"关闭学生 {sid} 分支 {lab_name} 推送权限失败: {failures[project_id]}")
+            elif results[project_id] == MISSING:
+                print(f"学生 {sid} 的分支 {lab_name} 不存在，跳过")
+            else:
+                if results[project_id] == UNCHANGED:
+                    print(f"学生 {sid} 的分支 {lab_name} 推送权限已是关闭状态")
+                else:
+                    print(f"学生 {sid} 的分支 {lab_name} 推送权限已关闭")
                 student_count += 1
-
-    print(f"共处理 {student_count} 个学生")
-    return student_count
+        print(f"共处理 {student_count} 个学生")
+        total_count += student_count
+
+    return total_count
+
+
+def _accumulate_result(result, total_count, all_results):
+    """按照结果类型累加计数，返回新的总计数"""
+    if isinstance(result, bool):
+        total_count += int(result)
+    elif isinstance(result, int):
+        total_count += result
+    elif isinstance(result, list):
+        all_results.extend(result)
+        total_count += len(result)
+    elif isinstance(result, dict) and 'count' in result:
+        total_count += result['count']
+        if 'data' in result:
+            all_results.extend(result['data'])
+    elif isinstance(result, dict):
+        all_results.append(result)
+        total_count += 1
+    return total_count
 
 
 def execute_for_teachers(gl, teacher_filter, operation_func, *args, **kwargs):
@@ -527,24 +691,138 @@ def execute_for_teachers(gl, teacher_filter, operation_func, *args, **kwargs):
     for teacher in teachers:
         print(f"\n--- 处理教师: {teacher} ---")
         result = operation_func(gl, teacher, *args, **kwargs)
-
         # 根据结果类型处理计数
-        if isinstance(result, int):
-            total_count += result
-        elif isinstance(result, list):
-            all_results.extend(result)
-            total_count += len(result)
-        elif isinstance(result, dict) and 'count' in result:
-            total_count += result['count']
-            if 'data' in result:
-                all_results.extend(result['data'])
+        total_count = _accumulate_result(result, total_count, all_results)
 
     return total_count, all_results
 
 
+class ThreadLocalOutput:
+    """按线程缓冲 print 输出，使并发执行时每个学生的输出保持完整、不交错"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, func, *args, **kwargs):
+        """在当前线程中执行 func 并返回 (结果, 期间打印的输出)"""
+        buffer = io.StringIO()
+        self._local.buffer = buffer
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            print(f"执行出错: {e}")
+            result = None
+        finally:
+            self._local.buffer = None
+        return result, buffer.getvalue()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        stream = buffer if buffer is not None else self._stream
+        return stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+
+def execute_for_students(gl, teacher_filter, student_func, *args, jobs=1,
+                         setup_func=None, summary='共处理 {} 个学生'):
+    """
+    以学生为粒度、跨所有教师并发执行操作的执行器
+
+    所有教师的学生任务共用一个大小为 jobs 的线程池；每个学生的输出先缓冲，
+    再按教师、名单顺序依次打印，因此输出与逐个执行时一样有序、成组。
+
+    Args:
+        gl: GitLab 连接实例
+        teacher_filter: 教师过滤器，None 表示所有教师，字符串表示特定教师
+        student_func: 为每个学生执行的操作函数，调用方式为
+            student_func(gl, context, sid, name, *args)
+        *args: 传递给操作函数的额外参数
+        jobs: 并发线程数
+        setup_func: 每个教师的准备函数 setup_func(gl, teacher)，返回值作为
+            context 传给 student_func；为 None 时 context 为教师名
+        summary: 每个教师处理完成后打印的计数格式
+
+    Returns:
+        tuple: (总计数, 所有结果列表)，与 execute_for_teachers 一致
+    """
+    teachers = get_teacher_list('data', teacher_filter)
+    print(f"处理教师: {teachers}（并发数: {jobs}）")
+
+    # 先按教师读取名单并完成准备工作，再统一提交学生任务
+    plans = []
+    for teacher in teachers:
+        students = read_student_roster(teacher)
+        if students is None:
+            continue
+        context = setup_func(gl, teacher) if setup_func else teacher
+        plans.append((teacher, context, students))
+
+    total_count = 0
+    all_results = []
+
+    output = ThreadLocalOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            submitted = [
+                (teacher, [executor.submit(output.capture, student_func,
+                                           gl, context, sid, name, *args)
+                           for sid, name in students])
+                for teacher, context, students in plans
+            ]
+
+            # 按提交顺序等待并输出，保证每个教师的输出连续
+            for teacher, futures in submitted:
+                print(f"\n--- 处理教师: {teacher} ---")
+                teacher_count = 0
+                teacher_results = []
+                for future in futures:
+                    result, text = future.result()
+                    print(text, end='')
+                    teacher_count = _accumulate_result(
+                        result, teacher_count, teacher_results)
+                print(summary.format(teacher_count))
+                total_count += teacher_count
+                all_results.extend(teacher_results)
+    finally:
+        sys.stdout = output._stream
+
+    return total_count, all_results
+
+
+def preload_users(gl, client, teacher_filter, jobs=1):
+    """一次性读取所有相关教师的名单，并批量解析到用户目录中"""
+    sids = []
+    for teacher in get_teacher_list('data', teacher_filter):
+        # 名单的格式问题会在各教师实际处理时再报告，这里不重复输出
+        with contextlib.redirect_stdout(io.StringIO()):
+            students = read_student_roster(teacher)
+        if students:
+            sids.extend(sid for sid, _ in students)
+
+    # 指定 --jobs 时连接池大小与其一致，按 jobs 并发；否则使用默认的并发数
+    requests_sent = user_directory.resolve(gl, client, sids, workers=jobs if jobs > 1 else None)
+    print(f"已批量解析 {len(sids)} 个学生的 GitLab 用户（发出 {requests_sent} 个请求）")
+
+
+def run_operation(gl, args, teacher_func, student_func, *op_args,
+                  setup_func=None, summary='共处理 {} 个学生'):
+    """根据 --jobs 选择按教师顺序执行或按学生并发执行"""
+    if args.jobs > 1:
+        return execute_for_students(
+            gl, args.teacher, student_func, *op_args, jobs=args.jobs,
+            setup_func=setup_func, summary=summary)
+    return execute_for_teachers(gl, args.teacher, teacher_func, *op_args)
+
+
 def main():
     parser = argparse.ArgumentParser(description='ZJU OS GitLab 自动化管理脚本')
     parser.add_argument('-t', '--teacher', type=str, help='指定教师名称（默认：所有教师）')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='并发处理学生的线程数（默认：1，即逐个处理）')
     parser.add_argument('-v', '--verbose',
                         action='store_true', help='启用详细输出和调试信息')
 
@@ -565,29 +843,52 @@ def main():
     lab_close_parser.add_argument(
         'lab', nargs='?', help='实验名称（如: lab1, lab2）。如果不提供，将自动关闭所有已过期的实验')
 
+    # cache-clear 子命令
+    cache_clear_parser = subparsers.add_parser('cache-clear', help='清空本地身份缓存')
+    cache_clear_parser.add_argument(
+        'kind', nargs='?', choices=['users', 'projects'], help='只清空用户或项目缓存（默认：全部）')
+
     args = parser.parse_args()
 
     if not args.subcommand:
         parser.print_help()
         return
 
+    if args.jobs < 1:
+        parser.error('--jobs 必须为正整数')
+
     # 加载全局配置
     config.load()
 
+    if args.subcommand == 'cache-clear':
+        config.identity_cache.clear(args.kind)
+        print(f"已清空本地身份缓存: {config.identity_cache.path}")
+        return
+
     # 连接 GitLab
     gl = gitlab.Gitlab(url=config.gitlab_url,
                        private_token=config.gitlab_token)
+    if args.jobs > 1:
+        # 连接池大小与并发数一致，避免线程之间争抢连接
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=args.jobs)
+        gl.session.mount('https://', adapter)
+        gl.session.mount('http://', adapter)
     gl.auth()
     if args.verbose:
         gl.enable_debug()
 
+    # 批量查询（GraphQL、分支保护对账）通过共享的 REST 客户端进行
+    client = GitLabClient(f"{config.gitlab_url.rstrip('/')}/api/v4", config.gitlab_token, pool_size=args.jobs)
+
     # 执行对应的子命令
     if args.subcommand == 'student-check':
         # 查询学生信息
         print(f"开始查询学生信息...")
+        preload_users(gl, client, args.teacher, args.jobs)
 
-        total_missing, all_missing_students = execute_for_teachers(
-            gl, args.teacher, student_check_for_teacher)
+        total_missing, all_missing_students = run_operation(
+            gl, args, student_check_for_teacher, check_student,
+            summary='未找到的学生: {} 人')
 
         print(f"\n=== 查询完成 ===")
         print(f"总共无法查询到的学生: {total_missing} 人")
@@ -607,9 +908,16 @@ def main():
 
         # 确保组织结构存在
         course_group_obj, term_obj = ensure_group_hierarchy(gl)
+        preload_users(gl, client, args.teacher, args.jobs)
 
-        total_students, _ = execute_for_teachers(
-            gl, args.teacher, repo_init_for_teacher, term_obj)
+        if args.jobs > 1:
+            total_students, _ = execute_for_students(
+                gl, args.teacher, init_student_repo, jobs=args.jobs,
+                setup_func=lambda gl, teacher: ProjectIndex(
+                    gl, teacher, get_teacher_group(gl, teacher, term_obj)))
+        else:
+            total_students, _ = execute_for_teachers(
+                gl, args.teacher, repo_init_for_teacher, term_obj)
 
         print(f"\n仓库初始化完成！共处理 {total_students} 个学生")
 
@@ -618,13 +926,14 @@ def main():
         print(f"开始删除学生仓库...")
         print("警告: 这将永久删除所有学生仓库，请确认此操作！")
 
-        total_deleted, _ = execute_for_teachers(
-            gl, args.teacher, repo_delete_for_teacher)
+        total_deleted, _ = run_operation(
+            gl, args, repo_delete_for_teacher, delete_student_repo,
+            setup_func=ProjectIndex.load, summary='共删除 {} 个仓库')
 
         print(f"\n仓库删除完成！共删除 {total_deleted} 个仓库")
 
     elif args.subcommand == 'lab-close':
-        # 关闭实验提交
+        # 关闭实验提交，分支保护的读取与修改通过共享的 REST 客户端批量进行
         lab_name = args.lab
 
         if lab_name:
@@ -636,8 +945,7 @@ def main():
                 print(f"实验 {lab_name} 的 DDL 尚未超过，无法关闭")
                 return
 
-            total_students, _ = execute_for_teachers(
-                gl, args.teacher, lab_close_for_teacher, lab_name)
+            total_students = close_lab(gl, client, args.teacher, lab_name, args.jobs)
 
             print(f"\n实验 {lab_name} 关闭完成！共处理 {total_students} 个学生")
         else:
@@ -655,8 +963,7 @@ def main():
             total_students = 0
             for expired_lab in expired_labs:
                 print(f"\n--- 处理过期实验: {expired_lab} ---")
-                lab_total, _ = execute_for_teachers(
-                    gl, args.teacher, lab_close_for_teacher, expired_lab)
+                lab_total = close_lab(gl, client, args.teacher, expired_lab, args.jobs)
                 total_students += lab_total
 
             print(f"\n所有过期实验关闭完成！共处理 {total_students} 个学生操作")
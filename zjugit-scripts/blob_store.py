@@ -0,0 +1,89 @@
+"""按内容寻址的学生源码存储
+
+文件内容以 git blob id 为键保存在 objects/ 下，各实验分支之间相同的文件只保存一份；
+每个 (学生, 分支) 的 manifest 记录 commit 与 路径 -> blob id，查重时由 manifest 通过硬链接生成文件视图。
+
+    root/
+        objects/ab/cdef...        文件内容，只读
+        manifests/<branch>/<key>.json
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+
+def git_blob_id(content: bytes) -> str:
+    """与 git hash-object 相同的 blob id"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class BlobStore:
+    """可在多线程中共享：对象先写入临时文件再原子替换，同一对象并发写入的结果相同"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        (self.root / "manifests").mkdir(parents=True, exist_ok=True)
+
+    def path(self, blob_id: str) -> Path:
+        return self.root / "objects" / blob_id[:2] / blob_id[2:]
+
+    def has(self, blob_id: str) -> bool:
+        return self.path(blob_id).exists()
+
+    def put(self, blob_id: str, content: bytes) -> None:
+        """保存文件内容，内容与 blob id 不符时报错"""
+        assert git_blob_id(content) == blob_id, f"Blob {blob_id} does not match its content"
+        path = self.path(blob_id)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp_path.write_bytes(content)
+            # 视图与对象共用 inode，设为只读避免通过视图修改存储
+            tmp_path.chmod(0o444)
+            tmp_path.replace(path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    # manifest
+
+    def manifest_path(self, branch: str, key: str) -> Path:
+        return self.root / "manifests" / branch / f"{key}.json"
+
+    def get_manifest(self, branch: str, key: str) -> dict | None:
+        """返回 {"project_id", "commit_id", "files": {路径: blob id}}，不存在时返回 None"""
+        path = self.manifest_path(branch, key)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+    def set_manifest(self, branch: str, key: str, project_id, commit_id: str, files: dict[str, str]) -> None:
+        """files 中的 blob 必须已经保存"""
+        missing = [blob_id for blob_id in files.values() if not self.has(blob_id)]
+        assert not missing, f"Blobs missing from the store: {missing[:3]}"
+        path = self.manifest_path(branch, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(
+            {"project_id": str(project_id), "commit_id": commit_id, "files": files},
+            ensure_ascii=False, indent=2))
+        tmp_path.replace(path)
+
+    def materialize(self, files: dict[str, str], output_dir: Path, separator="_") -> None:
+        """在 output_dir 下用硬链接生成文件视图，文件名与 plagiarism.py 解压时相同（路径以 separator 连接）
+
+        存储与 output_dir 不在同一文件系统时退回复制。
+        """
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for rel_path, blob_id in files.items():
+            dest_path = output_dir / rel_path.replace("/", separator).replace("\\", separator)
+            assert not dest_path.exists(), f"目标文件 {dest_path} 已存在，源文件: {rel_path}"
+            try:
+                os.link(self.path(blob_id), dest_path)
+            except OSError:
+                shutil.copyfile(self.path(blob_id), dest_path)
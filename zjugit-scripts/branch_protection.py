@@ -0,0 +1,195 @@
+"""分支保护规则的批量对账
+
+set_ddl.py 与 lab-close（zjugit-script/main.py）关闭实验分支时，先批量读取整届学生仓库中该分支的保护状态
+（GraphQL 每次查询一批项目，失败时回退到 REST 逐个查询），与期望的规则比较后只发出必要的请求：
+
+    未保护                          -> 创建保护
+    只有 allow_force_push 不同      -> PATCH 修改
+    push / merge 权限不同           -> 解除保护后重新创建（社区版不能修改已有规则的权限）
+    与期望一致                      -> 不发请求
+
+中途失败后重跑，只会处理尚未完成的仓库。
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import NamedTuple
+from gitlab_client import DEFAULT_WORKERS
+
+NO_ACCESS = 0
+
+# 对账结果
+CREATED = "created"
+UPDATED = "updated"
+REPLACED = "replaced"
+UNCHANGED = "unchanged"
+MISSING = "missing"  # 分支不存在，只在 require_branch 时出现
+
+PROTECTION_QUERY = """
+query($ids: [ID!], $first: Int, $branch: String!) {
+  projects(ids: $ids, first: $first) {
+    nodes {
+      id
+      repository { branchNames(searchPattern: $branch, offset: 0, limit: 1) }
+      branchRules(first: 100) {
+        nodes {
+          name
+          branchProtection {
+            allowForcePush
+            pushAccessLevels { nodes { accessLevel } }
+            mergeAccessLevels { nodes { accessLevel } }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class Protection(NamedTuple):
+    """分支保护规则，只比较各项权限的级别"""
+    push_access_levels: tuple[int, ...]
+    merge_access_levels: tuple[int, ...]
+    allow_force_push: bool = False
+
+    @classmethod
+    def of(cls, push_access_level: int, merge_access_level: int, allow_force_push: bool = False) -> 'Protection':
+        return cls((push_access_level,), (merge_access_level,), allow_force_push)
+
+    @classmethod
+    def from_rest(cls, data: dict) -> 'Protection':
+        return cls(
+            tuple(sorted(level['access_level'] for level in data.get('push_access_levels') or [])),
+            tuple(sorted(level['access_level'] for level in data.get('merge_access_levels') or [])),
+            bool(data.get('allow_force_push')),
+        )
+
+    @classmethod
+    def from_graphql(cls, data: dict) -> 'Protection':
+        return cls(
+            tuple(sorted(level['accessLevel'] for level in data['pushAccessLevels']['nodes'])),
+            tuple(sorted(level['accessLevel'] for level in data['mergeAccessLevels']['nodes'])),
+            bool(data.get('allowForcePush')),
+        )
+
+
+def plan(current: Protection | None, desired: Protection) -> str:
+    """从当前规则变为期望规则所需的操作"""
+    if current is None:
+        return CREATED
+    if current == desired:
+        return UNCHANGED
+    if current._replace(allow_force_push=desired.allow_force_push) == desired:
+        return UPDATED
+    return REPLACED
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class BranchProtectionReconciler:
+    """把一组项目中 branch 的保护规则对齐到 desired，读取与修改都并发执行"""
+
+    def __init__(self, client, branch: str, desired: Protection, workers: int = DEFAULT_WORKERS,
+                 batch_size: int = 20, require_branch: bool = False):
+        self.client = client
+        self.branch = branch
+        self.desired = desired
+        self.workers = workers
+        self.batch_size = batch_size
+        # 为 True 时分支不存在的项目不创建保护，结果为 MISSING
+        self.require_branch = require_branch
+
+    # 读取
+
+    def read(self, project_ids: list[str]) -> dict[str, tuple[bool, Protection | None]]:
+        """返回 project_id -> (分支是否存在, 当前规则)，未保护时规则为 None；读取失败的项目不出现在结果中"""
+        try:
+            states = self._read_graphql(project_ids)
+        except Exception as e:
+            print(f"Failed to read branch protection via GraphQL, falling back to REST for this batch: {e}")
+            states = {}
+        for project_id in project_ids:
+            if project_id in states:
+                continue
+            try:
+                states[project_id] = self._read_rest(project_id)
+            except Exception as e:
+                print(f"Failed to read branch protection of project {project_id}: {e}")
+        return states
+
+    def _read_graphql(self, project_ids):
+        data = self.client.graphql(PROTECTION_QUERY, {
+            "ids": [f"gid://gitlab/Project/{project_id}" for project_id in project_ids],
+            "first": len(project_ids),
+            "branch": self.branch,
+        })
+        states = {}
+        for node in data["projects"]["nodes"]:
+            branch_names = (node.get("repository") or {}).get("branchNames")
+            if branch_names is None:
+                # 空仓库等情况，交给 REST 判断
+                continue
+            rule = next((rule for rule in node["branchRules"]["nodes"]
+                         if rule["name"] == self.branch and rule.get("branchProtection")), None)
+            project_id = node["id"].rsplit("/", 1)[-1]
+            states[project_id] = (self.branch in branch_names,
+                                  Protection.from_graphql(rule["branchProtection"]) if rule else None)
+        return states
+
+    def _read_rest(self, project_id):
+        exists = not self.require_branch or self.client.get_branch(project_id, self.branch) is not None
+        current = self.client.get_protected_branch(project_id, self.branch)
+        return exists, Protection.from_rest(current) if current is not None else None
+
+    # 修改
+
+    def apply(self, project_id: str, action: str) -> str:
+        if action == UPDATED:
+            self.client.update_protected_branch(project_id, self.branch, allow_force_push=self.desired.allow_force_push)
+            return action
+        if action == REPLACED:
+            self.client.unprotect_branch(project_id, self.branch)
+        self.client.protect_branch(
+            project_id, self.branch,
+            push_access_level=self.desired.push_access_levels[0],
+            merge_access_level=self.desired.merge_access_levels[0],
+            allow_force_push=self.desired.allow_force_push,
+        )
+        return action
+
+    def reconcile(self, project_ids) -> tuple[dict[str, str], dict[str, str]]:
+        """对账一组项目，返回 (project_id -> 结果, project_id -> 错误信息)
+
+        project_ids 可以是边获取边产出的迭代器，每凑满一批就开始读取。
+        """
+        results = {}
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            reads = {executor.submit(self.read, batch): batch
+                     for batch in batched((str(project_id) for project_id in project_ids), self.batch_size)}
+            changes = {}
+            for future in as_completed(reads):
+                states = future.result()
+                for project_id in reads[future]:
+                    if project_id not in states:
+                        failures[project_id] = "Failed to read branch protection"
+                        continue
+                    exists, current = states[project_id]
+                    if self.require_branch and not exists:
+                        results[project_id] = MISSING
+                        continue
+                    action = plan(current, self.desired)
+                    if action == UNCHANGED:
+                        results[project_id] = action
+                    else:
+                        changes[executor.submit(self.apply, project_id, action)] = project_id
+            for future in as_completed(changes):
+                try:
+                    results[changes[future]] = future.result()
+                except Exception as e:
+                    failures[changes[future]] = str(e)
+        return results, failures
@@ -1,9 +1,10 @@
-import requests
 from tqdm import tqdm
 from pathlib import Path
 from argparse import ArgumentParser
 import yaml
 from addict import Dict
+from identity_cache import IdentityCache
+from gitlab_client import GitLabClient
 
 parser = ArgumentParser()
 parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
@@ -12,20 +13,10 @@ args = parser.parse_args()
 with open(args.config, "r") as f:
     config = Dict(yaml.safe_load(f))
 
-url = config.gitlab.url
-private_token = config.gitlab.token
-
-headers = {
-    'PRIVATE-TOKEN': private_token
-}
-
-# 查找用户
-def find_user(username):
-    response = requests.get(f"{url}/users?username={username}", headers=headers)
-    assert response.status_code == 200, f"Failed to fetch user {username}: {response.status_code}, {response.text}"
-    assert len(response.json()) > 0, f"User {username} not found."
-    return response.json()[0]  # 返回用户信息
+# 逐个创建仓库，单个连接即可
+client = GitLabClient.from_config(config, pool_size=1)
 
+identity_cache = IdentityCache.from_settings(config.identity_cache)
 
 # 创建项目(通过fork)
 # def create_project(username):
@@ -46,33 +37,26 @@ def create_project(username, group_id):
         'visibility': 'private',
         'import_url': config.repo.import_url
     }
-    response = requests.post(f"{url}/projects", headers=headers, data=data)
-    assert response.status_code == 201, f"Failed to create project for {username}: {response.status_code}, {response.text}"
-    return response.json()['id']
+    project = client.create_project(data)
+    identity_cache.set_project(project['path_with_namespace'], project['id'], project.get('default_branch'))
+    return project['id']
 
 # 设置保护分支
 def set_protected_branch(project_id, branch_pattern):
-    data = {
-        'name': branch_pattern,
-        'push_access_level': 30,  # Developer
-        'merge_access_level': 30,  # Developer
-    }
-    response = requests.post(f"{url}/projects/{project_id}/protected_branches", headers=headers, data=data)
-    assert response.status_code == 201, f"Failed to set protected branch {branch_pattern} for project {project_id}: {response.status_code}, {response.text}"
+    client.protect_branch(
+        project_id, branch_pattern,
+        push_access_level=30,  # Developer
+        merge_access_level=30,  # Developer
+    )
 
 
 # 添加用户到项目
-def add_user_to_project(project_id, username):    
-    data = {
-        'username': username,
-        'access_level': 30  # Developer
-    }
-    response = requests.post(f"{url}/projects/{project_id}/members", headers=headers, data=data)
-    assert response.status_code == 201, f"Failed to add user {username} to project {project_id}: {response.status_code}, {response.text}"
+def add_user_to_project(project_id, username):
+    client.add_project_member(project_id, username, access_level=30)  # Developer
 
 def create_repo(group_id, username):
     # find user
-    # find_user(username)
+    # client.find_user(username)
 
     # create project
     project_id = create_project(username, group_id)
@@ -114,8 +98,10 @@ for class_file in classes:
             continue
         # print(f"Creating repo for {username}")
         try:
-            user = find_user(username)
-            user_id = user['id']
+            user_id = identity_cache.get_user_id(username)
+            if user_id is None:
+                user_id = client.find_user(username)['id']
+                identity_cache.set_user_id(username, user_id)
         except Exception as e:
             results.append(f"{username},{name},Failed,Failed")
             failed += 1
@@ -0,0 +1,398 @@
+"""本地 winnowing 指纹查重
+
+把 C/C++ 源码切分为词法单元（标识符、数字、字符串统一替换，忽略注释与预处理行），
+对 k 个词法单元组成的 k-gram 计算哈希，用 winnowing 在每个窗口中选出最小哈希作为指纹，
+再通过倒排索引统计每对提交共享的指纹数，输出按相似度排序的提交对。
+
+既可以在 plagiarism.py 中作为 MOSS / JPlag 之前的预筛选，也可以离线单独使用：
+
+    python fingerprint.py data/plagiarism/lab1/files --base path-to-template --top 50 -o pairs.csv
+
+root 下的每个子目录视为一份提交。往届仓库可以用 --index / --corpus 建立持久索引，
+只在第一次及新增仓库时计算指纹，之后每次只需把本学期的提交与索引比较：
+
+    python fingerprint.py data/plagiarism/lab1/files --index data/plagiarism/previous.sqlite3 --corpus path-to-previous-repos
+"""
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+import csv
+import hashlib
+import itertools
+import os
+import re
+import sqlite3
+import time
+from argparse import ArgumentParser
+
+DEFAULT_EXTENSIONS = ["cpp", "hpp", "cc", "c", "h"]
+
+# k-gram 的词法单元数与 winnowing 窗口大小：长度不少于 k + window - 1 的相同片段一定会被发现
+DEFAULT_K = 12
+DEFAULT_WINDOW = 8
+
+# 与 plagiarism.py 中 moss.setIgnoreLimit(20) 一致：出现在超过这么多份提交中的指纹视为公共代码
+DEFAULT_IGNORE_LIMIT = 20
+
+# 共享指纹少于这个数的提交对不输出，避免极短的提交因比例高排在前面
+DEFAULT_MIN_SHARED = 5
+
+TOKEN_RE = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<preprocessor>^[ \t]*\#(?:\\\n|[^\n])*)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<number>\.?\d[\w.']*)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<operator>::|->\*?|\.\*|\+\+|--|<<=|>>=|<=>|<<|>>|&&|\|\||[-+*/%&|^!=<>]=?|[{}()\[\];,.?:~])
+""", re.S | re.M | re.X)
+
+KEYWORDS = frozenset("""
+    alignas alignof asm auto bool break case catch char char8_t char16_t char32_t class const
+    consteval constexpr constinit const_cast continue co_await co_return co_yield decltype default
+    delete do double dynamic_cast else enum explicit export extern false float for friend goto if
+    inline int long mutable namespace new noexcept nullptr operator private protected public
+    register reinterpret_cast requires return short signed sizeof static static_assert static_cast
+    struct switch template this thread_local throw true try typedef typeid typename union unsigned
+    using virtual void volatile wchar_t while
+""".split())
+
+
+class Match(NamedTuple):
+    """一对提交的比对结果，ratio 为共享指纹占各自指纹数的比例"""
+    first: str
+    second: str
+    shared: int
+    first_ratio: float
+    second_ratio: float
+
+    @property
+    def similarity(self) -> float:
+        return max(self.first_ratio, self.second_ratio)
+
+
+def tokenize(source: str) -> list[str]:
+    """切分源码，关键字与运算符保留原样，其余标识符、数字、字符串分别替换为 V、N、S"""
+    tokens = []
+    for match in TOKEN_RE.finditer(source):
+        kind = match.lastgroup
+        if kind in ("comment", "preprocessor"):
+            continue
+        if kind == "name":
+            text = match.group()
+            tokens.append(text if text in KEYWORDS else "V")
+        elif kind == "number":
+            tokens.append("N")
+        elif kind == "string":
+            tokens.append("S")
+        else:
+            tokens.append(match.group())
+    return tokens
+
+
+def kgram_hashes(tokens: list[str], k: int = DEFAULT_K) -> list[int]:
+    """每个 k-gram 的 64 位有符号哈希（不使用 hash()，保证跨进程稳定；有符号以便存入 SQLite）"""
+    return [
+        int.from_bytes(hashlib.blake2b(" ".join(tokens[i:i + k]).encode(), digest_size=8).digest(), "big", signed=True)
+        for i in range(len(tokens) - k + 1)
+    ]
+
+
+def winnow(hashes: list[int], window: int = DEFAULT_WINDOW) -> set[int]:
+    """robust winnowing：每个窗口取最小哈希（并列时取最右），同一位置只记录一次"""
+    if len(hashes) <= window:
+        return {min(hashes)} if hashes else set()
+    fingerprints = set()
+    selected = -1
+    for start in range(len(hashes) - window + 1):
+        if selected < start:
+            # 上次选中的位置已移出窗口，重新扫描整个窗口
+            selected = start
+            for i in range(start + 1, start + window):
+                if hashes[i] <= hashes[selected]:
+                    selected = i
+        elif hashes[start + window - 1] <= hashes[selected]:
+            selected = start + window - 1
+        else:
+            continue
+        fingerprints.add(hashes[selected])
+    return fingerprints
+
+
+def fingerprint_source(source: str, k: int = DEFAULT_K, window: int = DEFAULT_WINDOW) -> set[int]:
+    return winnow(kgram_hashes(tokenize(source), k), window)
+
+
+def fingerprint_file(path, k: int = DEFAULT_K, window: int = DEFAULT_WINDOW) -> set[int]:
+    return fingerprint_source(Path(path).read_text(errors="replace"), k, window)
+
+
+def source_files(directory, extensions=DEFAULT_EXTENSIONS, skip_keywords=()) -> list[Path]:
+    """与 plagiarism.py 的 collect_source_files 相同，按扩展名递归收集源文件，跳过路径含 skip_keywords 的文件"""
+    files = []
+    for ext in extensions:
+        files.extend(
+            path for path in Path(directory).rglob(f"*.{ext}")
+            if path.is_file() and not any(keyword in str(path.relative_to(directory)) for keyword in skip_keywords)
+        )
+    return sorted(files)
+
+
+def fingerprint_directory(directory, extensions=DEFAULT_EXTENSIONS,
+                          k: int = DEFAULT_K, window: int = DEFAULT_WINDOW) -> set[int]:
+    """一份提交的指纹：目录下所有源文件指纹的并集"""
+    fingerprints = set()
+    for path in source_files(directory, extensions):
+        fingerprints |= fingerprint_file(path, k, window)
+    return fingerprints
+
+
+def _fingerprint_submission(args):
+    name, directory, extensions, k, window = args
+    return name, fingerprint_directory(directory, extensions, k, window)
+
+
+def fingerprint_submissions(root, extensions=DEFAULT_EXTENSIONS, k: int = DEFAULT_K,
+                            window: int = DEFAULT_WINDOW, workers: int | None = None) -> dict[str, set[int]]:
+    """在进程池中计算 root 下每个子目录（一份提交）的指纹"""
+    directories = sorted(path for path in Path(root).iterdir() if path.is_dir())
+    tasks = [(directory.name, directory, extensions, k, window) for directory in directories]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(_fingerprint_submission, tasks, chunksize=4))
+
+
+def rank_pairs(submissions: dict[str, set[int]], base: set[int] = frozenset(),
+               ignore_limit: int = DEFAULT_IGNORE_LIMIT, min_shared: int = DEFAULT_MIN_SHARED) -> list[Match]:
+    """用倒排索引统计每对提交共享的指纹，按相似度从高到低排序
+
+    模板代码（base）中的指纹与出现在超过 ignore_limit 份提交中的指纹不参与比较。
+    """
+    index = defaultdict(list)
+    for name, fingerprints in submissions.items():
+        for fingerprint in fingerprints - base:
+            index[fingerprint].append(name)
+
+    shared = Counter()
+    for names in index.values():
+        if len(names) < 2 or len(names) > ignore_limit:
+            continue
+        for pair in itertools.combinations(sorted(names), 2):
+            shared[pair] += 1
+
+    sizes = {name: len(fingerprints - base) for name, fingerprints in submissions.items()}
+    matches = [
+        Match(first, second, count, count / sizes[first], count / sizes[second])
+        for (first, second), count in shared.items()
+        if count >= min_shared
+    ]
+    matches.sort(key=lambda match: (match.similarity, match.shared), reverse=True)
+    return matches
+
+
+def write_matches(matches: list[Match], path) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["first", "second", "shared", "first_ratio", "second_ratio"])
+        for match in matches:
+            writer.writerow([match.first, match.second, match.shared,
+                             f"{match.first_ratio:.4f}", f"{match.second_ratio:.4f}"])
+
+
+# 索引中往届仓库名的前缀，用于和本学期的提交区分
+PREVIOUS_PREFIX = "previous/"
+
+
+def _index_repository(args):
+    """计算一个往届仓库的指纹以及每个源文件的 sha256"""
+    name, directory, extensions, skip_keywords, k, window = args
+    fingerprints = set()
+    files = []
+    for path in source_files(directory, extensions, skip_keywords):
+        content = path.read_bytes()
+        fingerprints |= fingerprint_source(content.decode(errors="replace"), k, window)
+        files.append((hashlib.sha256(content).hexdigest(), str(path.relative_to(directory))))
+    return name, fingerprints, files
+
+
+def repository_signature(directory, extensions=DEFAULT_EXTENSIONS, skip_keywords=()) -> str:
+    """由源文件的路径、大小与修改时间得到的签名，仓库内容变化时签名随之变化"""
+    digest = hashlib.sha256()
+    for path in source_files(directory, extensions, skip_keywords):
+        stat = path.stat()
+        digest.update(f"{path.relative_to(directory)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+class FingerprintIndex:
+    """往届仓库的持久指纹与文件内容哈希索引
+
+    每个往届仓库只在第一次出现或内容变化时计算一次指纹；k、window、扩展名、跳过的关键字变化时整个索引重建。
+    """
+
+    def __init__(self, path, extensions=DEFAULT_EXTENSIONS, k: int = DEFAULT_K, window: int = DEFAULT_WINDOW,
+                 skip_keywords=()):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.extensions = list(extensions)
+        self.skip_keywords = list(skip_keywords)
+        self.k = k
+        self.window = window
+        self._db = sqlite3.connect(self.path)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS repos ("
+                " name TEXT PRIMARY KEY,"
+                " signature TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS fingerprints (hash INTEGER NOT NULL, repo TEXT NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS fingerprints_repo ON fingerprints (repo)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " sha256 TEXT NOT NULL,"
+                " repo TEXT NOT NULL,"
+                " path TEXT NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_repo ON files (repo)")
+            settings = (f"k={k} window={window} exts={','.join(sorted(self.extensions))}"
+                        f" skip={','.join(sorted(self.skip_keywords))}")
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+            if row is None or row[0] != settings:
+                for table in ("repos", "fingerprints", "files"):
+                    self._db.execute(f"DELETE FROM {table}")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('settings', ?)", (settings,))
+
+    def _delete(self, name):
+        self._db.execute("DELETE FROM repos WHERE name = ?", (name,))
+        self._db.execute("DELETE FROM fingerprints WHERE repo = ?", (name,))
+        self._db.execute("DELETE FROM files WHERE repo = ?", (name,))
+
+    def update(self, corpus, workers: int | None = None) -> int:
+        """把 corpus 下的每个子目录（一个往届仓库）加入索引，返回重新计算的仓库数
+
+        已索引且签名未变的仓库直接跳过；corpus 中已不存在的仓库从索引中删除。
+        """
+        indexed = dict(self._db.execute("SELECT name, signature FROM repos"))
+        directories = {path.name: path for path in sorted(Path(corpus).iterdir()) if path.is_dir()}
+        signatures = {
+            name: repository_signature(directory, self.extensions, self.skip_keywords)
+            for name, directory in directories.items()
+        }
+        stale = [name for name, signature in signatures.items() if indexed.get(name) != signature]
+        with self._db:
+            for name in set(indexed) - set(directories):
+                self._delete(name)
+        if not stale:
+            return 0
+        tasks = [(name, directories[name], self.extensions, self.skip_keywords, self.k, self.window) for name in stale]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for name, fingerprints, files in executor.map(_index_repository, tasks):
+                with self._db:
+                    self._delete(name)
+                    self._db.executemany("INSERT INTO fingerprints (hash, repo) VALUES (?, ?)",
+                                         ((fingerprint, name) for fingerprint in fingerprints))
+                    self._db.executemany("INSERT INTO files (sha256, repo, path) VALUES (?, ?, ?)",
+                                         ((sha256, name, path) for sha256, path in files))
+                    self._db.execute("INSERT INTO repos (name, signature, updated_at) VALUES (?, ?, ?)",
+                                     (name, signatures[name], time.time()))
+        return len(stale)
+
+    def match(self, submissions: dict[str, set[int]], base: set[int] = frozenset(),
+              ignore_limit: int = DEFAULT_IGNORE_LIMIT, min_shared: int = DEFAULT_MIN_SHARED) -> list[Match]:
+        """本学期每份提交与每个往届仓库共享的指纹，往届仓库名带 PREVIOUS_PREFIX 前缀
+
+        某个指纹在本学期提交与往届仓库中总共出现超过 ignore_limit 次时视为公共代码。
+        """
+        index = defaultdict(list)
+        for fingerprint, repo in self._db.execute("SELECT hash, repo FROM fingerprints"):
+            if fingerprint not in base:
+                index[fingerprint].append(repo)
+        repo_sizes = Counter(repo for repos in index.values() for repo in repos)
+
+        current = Counter()
+        for fingerprints in submissions.values():
+            current.update(fingerprints - base)
+
+        shared = Counter()
+        for name, fingerprints in submissions.items():
+            for fingerprint in fingerprints - base:
+                repos = index.get(fingerprint)
+                if not repos or len(repos) + current[fingerprint] > ignore_limit:
+                    continue
+                for repo in repos:
+                    shared[name, repo] += 1
+
+        matches = []
+        for (name, repo), count in shared.items():
+            if count < min_shared:
+                continue
+            size = len(submissions[name] - base)
+            matches.append(Match(name, PREVIOUS_PREFIX + repo, count, count / size, count / repo_sizes[repo]))
+        return matches
+
+    def exact_copies(self, root, base_hashes: set[str] = frozenset()) -> list[tuple[str, str, str, str]]:
+        """本学期提交中与往届仓库文件内容完全相同的文件，返回 (提交, 文件, 往届仓库, 往届文件)
+
+        与模板文件相同（sha256 在 base_hashes 中）的文件不算。
+        """
+        copies = []
+        for directory in sorted(path for path in Path(root).iterdir() if path.is_dir()):
+            for path in source_files(directory, self.extensions):
+                sha256 = hashlib.sha256(path.read_bytes()).hexdigest()
+                if sha256 in base_hashes:
+                    continue
+                for repo, repo_path in self._db.execute("SELECT repo, path FROM files WHERE sha256 = ?", (sha256,)):
+                    copies.append((directory.name, str(path.relative_to(directory)), PREVIOUS_PREFIX + repo, repo_path))
+        return copies
+
+    def close(self):
+        self._db.close()
+
+
+def main():
+    parser = ArgumentParser(description="Rank submission pairs by shared winnowed fingerprints")
+    parser.add_argument("root", type=str, help="Directory with one sub-directory per submission")
+    parser.add_argument("--base", action="append", default=[], help="Template directory whose code is ignored (repeatable)")
+    parser.add_argument("--exts", type=str, default=",".join(DEFAULT_EXTENSIONS), help="Comma-separated source extensions")
+    parser.add_argument("-k", type=int, default=DEFAULT_K, help="Tokens per k-gram")
+    parser.add_argument("--window", "-w", type=int, default=DEFAULT_WINDOW, help="Winnowing window size")
+    parser.add_argument("--ignore-limit", type=int, default=DEFAULT_IGNORE_LIMIT, help="Ignore fingerprints shared by more submissions than this")
+    parser.add_argument("--min-shared", type=int, default=DEFAULT_MIN_SHARED, help="Drop pairs sharing fewer fingerprints than this")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--top", type=int, default=20, help="Number of pairs to print")
+    parser.add_argument("--output", "-o", type=str, help="Write all ranked pairs to this CSV file")
+    parser.add_argument("--index", type=str, help="Persistent fingerprint index of previous-term repositories")
+    parser.add_argument("--corpus", type=str, help="Directory of previous-term repositories to add to --index")
+    parser.add_argument("--skip", action="append", default=[], help="Skip previous-term files whose path contains this keyword (repeatable)")
+    parser.add_argument("--copies", type=str, help="Write files identical to a previous-term file to this CSV file (needs --index)")
+    args = parser.parse_args()
+
+    extensions = args.exts.split(",")
+    base = set()
+    for directory in args.base:
+        base |= fingerprint_directory(directory, extensions, args.k, args.window)
+    submissions = fingerprint_submissions(args.root, extensions, args.k, args.window, args.workers)
+    matches = rank_pairs(submissions, base, args.ignore_limit, args.min_shared)
+    if args.index:
+        index = FingerprintIndex(args.index, extensions, args.k, args.window, args.skip)
+        if args.corpus:
+            print(f"Indexed {index.update(args.corpus, args.workers)} previous-term repositories")
+        matches += index.match(submissions, base, args.ignore_limit, args.min_shared)
+        matches.sort(key=lambda match: (match.similarity, match.shared), reverse=True)
+        if args.copies:
+            with open(args.copies, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["submission", "file", "previous", "previous_file"])
+                base_hashes = {hashlib.sha256(path.read_bytes()).hexdigest()
+                               for directory in args.base for path in source_files(directory, extensions)}
+                writer.writerows(index.exact_copies(args.root, base_hashes))
+        index.close()
+    if args.output:
+        write_matches(matches, args.output)
+    for match in matches[:args.top]:
+        print(f"{match.similarity:6.1%} {match.shared:6d}  {match.first}  {match.second}")
+
+
+if __name__ == "__main__":
+    main()
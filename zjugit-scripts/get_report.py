@@ -1,67 +1,116 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import requests
+import json
+import threading
 from tqdm import tqdm
 from argparse import ArgumentParser
 import yaml
 from addict import Dict
+from identity_cache import IdentityCache, fill_roster_line
+from gitlab_client import GitLabClient, DEFAULT_WORKERS
+from mirror import MirrorManager
 
 parser = ArgumentParser()
 parser.add_argument("branch", type=str, help="The branch name to get reports from")
 parser.add_argument("teacher", type=str, nargs='?', default=None, help="The teacher's name to filter reports")
+parser.add_argument("--force", "-f", action="store_true", help="Download every report even if it has not changed")
+parser.add_argument("--mirror", action="store_true", help="Fetch local git mirrors first and read reports from them")
 parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
 args = parser.parse_args()
 
 with open(args.config, "r") as f:
     config = Dict(yaml.safe_load(f))
 
-GITLAB_URL = config.gitlab.url
-PRIVATE_TOKEN = config.gitlab.token
-
 BRANCH = args.branch
 TEACHER = args.teacher
 
-# 获取仓库分支的最新 commit id
-def get_latest_commit_id(project_id, branch):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/branches/{branch}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get branch information: {response.status_code}"
-    branch_info = response.json()
-    return branch_info['commit']['id']
-
-def get_file_info(project_id, file_path, ref):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/files/{requests.utils.quote(file_path, safe='')}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    params = {"ref": ref}
-    
-    response = requests.get(url, headers=headers, params=params)
-    assert response.status_code == 200, f"Failed to get file information: {response.status_code}"
-    return response.json()
-
-def get_raw_file(project_id, file_path, ref, save_path: Path):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/files/{requests.utils.quote(file_path, safe='')}/raw"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    params = {"ref": ref}
-    
-    response = requests.get(url, headers=headers, params=params)
-    assert response.status_code == 200, f"Failed to get file information: {response.status_code}"
-    
+identity_cache = IdentityCache.from_settings(config.identity_cache)
+
+client = GitLabClient.from_config(config, pool_size=DEFAULT_WORKERS)
+mirror = MirrorManager.from_config(config) if args.mirror else None
+mirror_failures = {}
+
+class ReportManifest:
+    """记录每个学生已下载报告的 blob id 与 ETag，报告未变化时跳过下载"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = json.loads(path.read_text()) if path.exists() else {}
+
+    def get(self, username):
+        with self._lock:
+            return self.entries.get(username)
+
+    def update(self, username, project_id, blob_id, etag=None):
+        with self._lock:
+            self.entries[username] = {"project_id": str(project_id), "blob_id": blob_id, "etag": etag}
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.entries, ensure_ascii=False, indent=2))
+            tmp.replace(self.path)
+
+
+manifest = ReportManifest(Path(config.data_root).resolve() / "reports" / BRANCH / "manifest.json")
+downloaded = 0
+unchanged = 0
+count_lock = threading.Lock()
+
+
+def count(changed):
+    global downloaded, unchanged
+    with count_lock:
+        if changed:
+            downloaded += 1
+        else:
+            unchanged += 1
+
+
+def is_unchanged(username, project_id, blob_id, save_path: Path):
+    entry = manifest.get(username)
+    return (not args.force and blob_id is not None and save_path.exists() and entry is not None
+            and entry["project_id"] == str(project_id) and entry["blob_id"] == blob_id)
+
+
+def get_mirror_report(username, project_id, file_path, save_path: Path):
+    directory, file_name = file_path.rsplit("/", 1)
+    blob_id = next((item["id"] for item in mirror.list_tree(username, BRANCH, directory)
+                    if item["name"] == file_name and item["type"] == "blob"), None)
+    assert blob_id is not None, f"File {file_path} not found"
+    if is_unchanged(username, project_id, blob_id, save_path):
+        return False
+    content = mirror.read_blob(username, blob_id)
     save_path.parent.mkdir(exist_ok=True, parents=True)
     with open(save_path, "wb") as f:
-        f.write(response.content)
+        f.write(content)
+    manifest.update(username, project_id, blob_id)
+    return True
+
 
 def get_report(username, name, user_id, project_id):
-    commit_id = get_latest_commit_id(project_id, BRANCH)
-    get_raw_file(project_id, f'reports/{BRANCH}.pdf', commit_id, output_root / f"{username}-{name}.pdf")
+    """下载学生的报告，返回是否下载；blob id 与上次相同时跳过"""
+    file_path = f'reports/{BRANCH}.pdf'
+    save_path = output_root / f"{username}-{name}.pdf"
+    if mirror is not None and username not in mirror_failures:
+        return get_mirror_report(username, project_id, file_path, save_path)
+    # 一次 HEAD 请求即可得到报告的 blob id 与所在 commit，不必再单独获取分支 head
+    info = client.head_file(project_id, file_path, BRANCH)
+    assert info is not None, f"File {file_path} not found"
+    if is_unchanged(username, project_id, info['blob_id'], save_path):
+        return False
+    entry = manifest.get(username)
+    # 响应中没有 blob id 时退回 ETag 条件请求
+    etag = entry["etag"] if entry and save_path.exists() and not args.force else None
+    changed, etag = client.download_raw_file(project_id, file_path, info['commit_id'] or BRANCH, save_path, etag)
+    manifest.update(username, project_id, info['blob_id'], etag)
+    return changed
 
 def process_student(username, name, user_id, project_id):
     if project_id == "Failed":
         # return
         print(f"Project not found for {username} {name}")
     try:
-        get_report(username, name, user_id, project_id)
+        count(get_report(username, name, user_id, project_id))
     except Exception as e:
         # return
         print(f"Failed to get report for {username}: {e}")
@@ -79,8 +128,18 @@ for class_file in classes:
     with class_file.open() as f:
         lines = f.readlines()
     total = len(lines)
-    with ThreadPoolExecutor() as executor:
-        future_to_index = {executor.submit(process_student, *line.strip().split(",")): i for i, line in enumerate(lines)}
+    rows = [fill_roster_line(identity_cache, line, f"{config.repo.group}/{teacher}") for line in lines]
+    if mirror is not None:
+        # 镜像更新失败的学生回退到 REST
+        mirror_failures = mirror.update_all(
+            [(row[0], f"{config.repo.group}/{teacher}/cp-{row[0]}", row[3]) for row in rows if row[3] != "Failed"],
+            config.mirror.workers or DEFAULT_WORKERS)
+        for username, error in mirror_failures.items():
+            print(f"Failed to update mirror of cp-{username}, using REST: {error}")
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor:
+        future_to_index = {executor.submit(process_student, *row): i for i, row in enumerate(rows)}
         for future in tqdm(as_completed(future_to_index), total=total):
             i = future_to_index[future]
-            future.result()
\ No newline at end of file
+            future.result()
+
+print(f"Downloaded {downloaded} reports, {unchanged} unchanged")
@@ -1,203 +1,392 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timedelta
 from pathlib import Path
-import requests
-import re
+import hashlib
 import tomllib
 from tqdm import tqdm
 from argparse import ArgumentParser
 import yaml
 from addict import Dict
+from identity_cache import IdentityCache, fill_roster_line
+from gitlab_client import GitLabClient
+from grading_cache import GradingCache
+from mirror import MirrorManager
+from scoring import TEST_MARKER, extract_score_from_trace, is_timeout, late_score
 
 parser = ArgumentParser()
 parser.add_argument("branch", type=str, help="The branch name to get scores from")
 parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
+parser.add_argument("--graphql", action="store_true", help="Batch-fetch branch heads, whitelisted files and pipelines via GraphQL")
+parser.add_argument("--graphql-batch", type=int, default=20, help="Number of projects per GraphQL query")
+parser.add_argument("--tree", action="store_true", help="Check whitelisted files with one repository tree request per project")
+parser.add_argument("--reference", action="append", default=[], help="Directory with reference copies of whitelisted files (used with --tree, repeatable)")
+parser.add_argument("--mirror", action="store_true", help="Fetch local git mirrors first and read branch heads and files from them")
+parser.add_argument("--refresh", action="store_true", help="Ignore cached results and regrade every student")
 args = parser.parse_args()
 
 with open(args.config, "r") as f:
     config = Dict(yaml.safe_load(f))
 
-GITLAB_URL = config.gitlab.url
-PRIVATE_TOKEN = config.gitlab.token
-
 BRANCH = args.branch
 DDL = config.ddl[BRANCH] # UTC+8
 
+identity_cache = IdentityCache.from_settings(config.identity_cache)
+grading_cache = GradingCache.from_settings(
+    config.grading_cache, Path(config.data_root).resolve() / "grading.sqlite3")
+
+MAX_WORKERS = 16
+client = GitLabClient.from_config(config, pool_size=MAX_WORKERS)
+
+mirror = MirrorManager.from_config(config) if args.mirror else None
+
 cpp_sha256 = config.sha256_whitelist.cpp
 ocaml_sha256 = config.sha256_whitelist.ocaml
 
 # 获取项目ID
 def get_project_id(project_path):
-    url = f"{GITLAB_URL}/projects/{requests.utils.quote(project_path, safe='')}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get project information: {response.status_code}"
-    project_info = response.json()
+    project_id = identity_cache.get_project_id(project_path)
+    if project_id is not None:
+        return project_id
+
+    project_info = client.get_project(project_path)
+    identity_cache.set_project(project_path, project_info['id'], project_info.get('default_branch'))
     return project_info['id']
 
+def git_blob_id(content):
+    """按 git 的方式计算文件内容的 blob id"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
 
-# 获取仓库分支的最新 commit id
-def get_latest_commit_id(project_id, branch):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/branches/{branch}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get branch information: {response.status_code}"
-    branch_info = response.json()
-    return branch_info['commit']['id']
 
+def seed_blob_hashes(directories):
+    """用参考目录中的白名单文件预先记录 blob id -> sha256
 
-# 获取某个提交关联的最新 Pipeline
-def get_latest_pipeline(project_id, commit_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/pipelines"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    params = {"sha": commit_id, "ref": BRANCH}
-    
-    response = requests.get(url, headers=headers, params=params)
-    assert response.status_code == 200 and response.json(), f"Failed to get pipelines: {response.status_code}"
-    pipeline_info = response.json()[0]  # 获取最新的pipeline
-    return pipeline_info['id'], pipeline_info['status'], pipeline_info['created_at']
+    白名单中同时列出了 CRLF 版本，这里一并记录换行符转换后的内容。
+    """
+    paths = set(cpp_sha256) | set(ocaml_sha256)
+    for directory in directories:
+        for file_path in paths:
+            reference = Path(directory) / file_path
+            if not reference.is_file():
+                continue
+            content = reference.read_bytes()
+            lf = content.replace(b"\r\n", b"\n")
+            for variant in {content, lf, lf.replace(b"\n", b"\r\n")}:
+                grading_cache.set_blob_sha256(git_blob_id(variant), hashlib.sha256(variant).hexdigest())
 
 
-# 获取 Pipeline 对应的 Jobs 状态
-def get_pipeline_jobs(project_id, pipeline_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/pipelines/{pipeline_id}/jobs"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get jobs information: {response.status_code}"
-    return response.json()
-
-# 获取指定 Job 的日志
-def get_job_trace(project_id, job_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/jobs/{job_id}/trace"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get job trace: {response.status_code}"
-    return response.text
-
-def retry_pipeline_job(project_id, job_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/jobs/{job_id}/retry"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.post(url, headers=headers)
-    assert response.status_code == 201, f"Failed to retry job: {response.status_code}"
-    return response.json()
+class TreeWhitelist:
+    """按目录获取提交的 tree，按 blob id 查出白名单文件的 sha256
 
-parse_error = 0
-def extract_score_from_trace(trace):
-    trace = trace.split("$ python3 sp25-tests/test.py $CI_COMMIT_REF_NAME .")[-1]
-    # print(trace)
+    每个白名单文件所在的目录只列出一次（通常只有根目录），子目录中的文件（如 sp25-tests/...）也能查到 blob id；
+    未见过的 blob 才单独请求 get_file_info，其 blob_id 与 content_sha256 会被记录下来。
+    """
 
-    assert f"Running {BRANCH} test..." in trace, "No test found"
-    
-    # ... Test score: 100.00 ...
-    score = re.search(r"Test score: (\d+\.\d+)", trace)
-    assert score, "No score found"
-    
-    if BRANCH == "lab0" and "Parse Error" in trace:
-        global parse_error
-        parse_error += 1
-    
-    return float(score.group(1))
-        
-def get_file_info(project_id, file_path, ref):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/files/{requests.utils.quote(file_path, safe='')}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    params = {"ref": ref}
-    
-    response = requests.get(url, headers=headers, params=params)
-    assert response.status_code == 200, f"Failed to get file information: {response.status_code}"
-    return response.json()
-
-def get_raw_file(project_id, file_path, ref):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/files/{requests.utils.quote(file_path, safe='')}/raw"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    params = {"ref": ref}
-
-    response = requests.get(url, headers=headers, params=params)
-    assert (
-        response.status_code == 200
-    ), f"Failed to get file information: {response.status_code}"
-    
-    return response.content
+    def __init__(self, project_id, commit_id):
+        self.project_id = project_id
+        self.commit_id = commit_id
+        self.blobs = {}
+        self.listed = set()
 
-use_accipit = 0
-use_qemu = 0
-def get_score(username, name, user_id, project_id):
-    commit_id = get_latest_commit_id(project_id, BRANCH)
-    # print(f"Latest push commit ID: {commit_id}, Latest push time: {push_time}")
-    
-    # check file
+    def blob_id(self, file_path):
+        directory = file_path.rsplit("/", 1)[0] if "/" in file_path else ""
+        if directory not in self.listed:
+            self.listed.add(directory)
+            for item in client.list_tree(self.project_id, self.commit_id, directory):
+                if item["type"] == "blob":
+                    self.blobs[item["path"]] = item["id"]
+        assert file_path in self.blobs, f"File {file_path} not found"
+        return self.blobs[file_path]
+
+    def file_sha256(self, file_path):
+        sha256 = grading_cache.get_blob_sha256(self.blob_id(file_path))
+        if sha256 is None:
+            file_info = client.get_file_info(self.project_id, file_path, self.commit_id)
+            sha256 = file_info["content_sha256"]
+            grading_cache.set_blob_sha256(file_info["blob_id"], sha256)
+        return sha256
+
+
+class RestSubmission:
+    """通过 REST 逐项获取学生在 BRANCH 上的提交信息"""
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.commit_id = client.get_latest_commit_id(project_id, BRANCH)
+        self.tree = None
+
+    def file_sha256(self, file_path):
+        if args.tree:
+            if self.tree is None:
+                self.tree = TreeWhitelist(self.project_id, self.commit_id)
+            return self.tree.file_sha256(file_path)
+        return client.get_file_info(self.project_id, file_path, BRANCH)["content_sha256"]
+
+    def read_file(self, file_path):
+        return client.get_raw_file(self.project_id, file_path, BRANCH)
+
+    def latest_pipeline(self):
+        return client.get_latest_pipeline(self.project_id, self.commit_id, BRANCH)
+
+    def pipeline_jobs(self, pipeline_id):
+        return client.get_pipeline_jobs(self.project_id, pipeline_id)
+
+    def cached_result(self):
+        """按分支 head 查找已结束的评分结果，命中时不再请求 Pipeline 与 Job 列表"""
+        return grading_cache.get_latest(self.project_id, BRANCH, self.commit_id)
+
+
+class MirrorSubmission(RestSubmission):
+    """分支 head 与文件从本地镜像读取，Pipeline 与 Job 仍通过 REST 获取"""
+
+    def __init__(self, project_id, username):
+        self.project_id = project_id
+        self.username = username
+        self.commit_id = mirror.resolve(username, BRANCH)
+
+    def read_file(self, file_path):
+        return mirror.read_file(self.username, self.commit_id, file_path)
+
+    def file_sha256(self, file_path):
+        return hashlib.sha256(self.read_file(file_path)).hexdigest()
+
+
+class GraphQLSubmission:
+    """由一次批量 GraphQL 查询预取的提交信息，接口与 RestSubmission 相同"""
+
+    def __init__(self, project_id, commit_id, blobs, pipeline, jobs):
+        self.project_id = project_id
+        self.commit_id = commit_id
+        self.blobs = blobs
+        self.pipeline = pipeline
+        self.jobs = jobs
+
+    def read_file(self, file_path):
+        assert file_path in self.blobs, f"File {file_path} not found"
+        return self.blobs[file_path]
+
+    def file_sha256(self, file_path):
+        return hashlib.sha256(self.read_file(file_path)).hexdigest()
+
+    def latest_pipeline(self):
+        return self.pipeline
+
+    def pipeline_jobs(self, pipeline_id):
+        return self.jobs
+
+    def cached_result(self):
+        """Pipeline 与 Job 已预取，同一提交上新建的 Pipeline 或重试的 Job 不复用结果"""
+        pipeline, job = latest_job(self)
+        return grading_cache.get(self.project_id, BRANCH, self.commit_id, pipeline['id'], job['id'])
+
+
+SUBMISSION_QUERY = """
+query($ids: [ID!], $ref: String!, $paths: [String!]!, $first: Int) {
+  projects(ids: $ids, first: $first) {
+    nodes {
+      id
+      repository {
+        tree(ref: $ref) { lastCommit { sha } }
+        blobs(ref: $ref, paths: $paths) { nodes { path rawTextBlob } }
+      }
+      pipelines(ref: $ref, first: 5) {
+        nodes {
+          id
+          sha
+          status
+          createdAt
+          jobs(retried: false) { nodes { id name } }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+def gid_to_id(gid):
+    # gid://gitlab/Ci::Pipeline/123 -> 123
+    return int(gid.rsplit("/", 1)[-1])
+
+
+def fetch_submissions_graphql(project_ids):
+    """用一次 GraphQL 查询批量获取一组项目的分支 head、白名单文件与最新 Pipeline
+
+    无法完整获取的项目（分支不存在、head 没有对应的 Pipeline 等）不出现在结果中，
+    由调用方回退到 REST 逐项获取，以保证与原有流程结果一致。
+    """
+    paths = sorted(set(cpp_sha256) | set(ocaml_sha256) | {"config.toml"})
+    data = client.graphql(SUBMISSION_QUERY, {
+        "ids": [f"gid://gitlab/Project/{project_id}" for project_id in project_ids],
+        "ref": BRANCH,
+        "paths": paths,
+        "first": len(project_ids),
+    })
+    submissions = {}
+    for node in data["projects"]["nodes"]:
+        repository = node.get("repository") or {}
+        last_commit = (repository.get("tree") or {}).get("lastCommit")
+        if not last_commit:
+            continue
+        commit_id = last_commit["sha"]
+        # 与 REST 的 pipelines?sha=<head>&ref=<branch> 一致：取 head 对应的最新 Pipeline
+        pipeline = next((p for p in node["pipelines"]["nodes"] if p["sha"] == commit_id), None)
+        if pipeline is None:
+            continue
+        jobs = sorted(
+            ({"id": gid_to_id(job["id"]), "name": job["name"]} for job in pipeline["jobs"]["nodes"]),
+            key=lambda job: job["id"], reverse=True)
+        blobs = {
+            blob["path"]: blob["rawTextBlob"].encode()
+            for blob in repository["blobs"]["nodes"]
+            if blob["rawTextBlob"] is not None
+        }
+        project_id = str(gid_to_id(node["id"]))
+        submissions[project_id] = GraphQLSubmission(project_id, commit_id, blobs, {
+            "id": gid_to_id(pipeline["id"]),
+            "status": pipeline["status"].lower(),
+            "created_at": pipeline["createdAt"],
+        }, jobs)
+    return submissions
+
+
+def prefetch_submissions(project_ids, executor):
+    """将项目分批并发执行 GraphQL 查询，返回 project_id -> GraphQLSubmission"""
+    batches = [project_ids[i:i + args.graphql_batch] for i in range(0, len(project_ids), args.graphql_batch)]
+    submissions = {}
+    for future in as_completed([executor.submit(fetch_submissions_graphql, batch) for batch in batches]):
+        try:
+            submissions.update(future.result())
+        except Exception as e:
+            print(f"GraphQL prefetch failed, falling back to REST for this batch: {e}")
+    return submissions
+
+
+prefetched = {}
+mirror_failures = {}
+
+# Pipeline 结束后结果不再变化，只缓存这些状态下的评分
+FINISHED_STATUSES = ('success', 'failed', 'canceled', 'skipped')
+
+
+def check_whitelist(submission, username, name, warnings):
+    """检查白名单文件，需要提示的信息追加到 warnings"""
     try:
-        gitlab_ci_sha256 = get_file_info(project_id, ".gitlab-ci.yml", BRANCH)['content_sha256']
+        gitlab_ci_sha256 = submission.file_sha256(".gitlab-ci.yml")
     except Exception as e:
-        print(f"Failed to get .gitlab-ci.yml for cp-{username} {name}: {e}")
+        warnings.append(f"Failed to get .gitlab-ci.yml for cp-{username} {name}: {e}")
     if gitlab_ci_sha256 in ocaml_sha256['.gitlab-ci.yml']:  # OCaml template
         for file_path, hashes in ocaml_sha256.items():
             if file_path == '.gitlab-ci.yml':
                 continue
             try:
-                file_info = get_file_info(project_id, file_path, BRANCH)
-                if file_info["content_sha256"] not in hashes:
-                    print(file_info["content_sha256"])
-                assert file_info, f"File {file_path} not found"
-                assert file_info["content_sha256"] in hashes, f"File {file_path} has been modified"
+                file_sha256 = submission.file_sha256(file_path)
+                if file_sha256 not in hashes:
+                    warnings.append(file_sha256)
+                assert file_sha256 in hashes, f"File {file_path} has been modified"
             except Exception as e:
-                print(f"Failed to check OCaml file {file_path} in cp-{username} {name}: {e}")
+                warnings.append(f"Failed to check OCaml file {file_path} in cp-{username} {name}: {e}")
     else:
         for file_path, hashes in cpp_sha256.items():
             if file_path == '.gitlab-ci.yml':
                 continue
             try:
-                file_info = get_file_info(project_id, file_path, BRANCH)
-                if file_info["content_sha256"] not in hashes:
-                    print(file_info["content_sha256"])
-                assert file_info, f"File {file_path} not found"
-                assert file_info["content_sha256"] in hashes, f"File {file_path} has been modified"
+                file_sha256 = submission.file_sha256(file_path)
+                if file_sha256 not in hashes:
+                    warnings.append(file_sha256)
+                assert file_sha256 in hashes, f"File {file_path} has been modified"
             except Exception as e:
-                print(f"Failed to check file {file_path} in cp-{username} {name}: {e}")
-    
+                warnings.append(f"Failed to check file {file_path} in cp-{username} {name}: {e}")
+
+
+def latest_job(submission):
+    """返回提交最新的 Pipeline 及其中用于评分的 Job"""
+    pipeline = submission.latest_pipeline()  # 获取最新的pipeline
+    assert pipeline['status'] != 'pending', "Pipeline is still pending"
+    # print(f"Pipeline ID: {pipeline['id']}, Pipeline Status: {pipeline['status']}")
+    jobs = submission.pipeline_jobs(pipeline['id'])
+    assert jobs, "No jobs found"
+    return pipeline, jobs[0]
+
+
+def grade(submission, pipeline, job, username, name, warnings):
+    """计算一次提交的成绩，返回可写入 GradingCache 的结果；检查中的提示信息追加到 warnings"""
+    flags = {}
+    check_whitelist(submission, username, name, warnings)
+
     if BRANCH == 'lab3':
         try:
-            config_file = get_raw_file(project_id, 'config.toml', BRANCH)
+            config_file = submission.read_file('config.toml')
             config = tomllib.loads(config_file.decode())
-            if config.get('use_accipit', False):
-                global use_accipit
-                use_accipit += 1
+            flags['use_accipit'] = bool(config.get('use_accipit', False))
         except Exception as e:
-            print(f"Failed to check config.toml in cp-{username} {name}: {e}")
+            warnings.append(f"Failed to check config.toml in cp-{username} {name}: {e}")
     if BRANCH in ['lab4', 'bonus1', 'bonus2']:
         try:
-            config_file = get_raw_file(project_id, 'config.toml', BRANCH)
+            config_file = submission.read_file('config.toml')
             config = tomllib.loads(config_file.decode())
-            if config.get('use_qemu', False):
-                global use_qemu
-                use_qemu += 1
+            flags['use_qemu'] = bool(config.get('use_qemu', False))
         except Exception as e:
-            print(f"Failed to check config.toml in cp-{username} {name}: {e}")
-            
-    pipeline_id, pipeline_status, pipeline_create_at = get_latest_pipeline(project_id, commit_id)
-    assert pipeline_status != 'pending', "Pipeline is still pending"
-    # print(f"Pipeline ID: {pipeline_id}, Pipeline Status: {pipeline_status}")
-    jobs = get_pipeline_jobs(project_id, pipeline_id)
-    assert jobs, "No jobs found"
-    job = jobs[0]
-    trace = get_job_trace(project_id, job["id"])
-    if "Timeout" in trace:
-        print(f"Timeout in job {job['name']} for {username} {name}")
+            warnings.append(f"Failed to check config.toml in cp-{username} {name}: {e}")
+
+    pipeline_id, pipeline_status, pipeline_create_at = pipeline['id'], pipeline['status'], pipeline['created_at']
+    trace = client.get_job_trace_tail(submission.project_id, job["id"], TEST_MARKER)
+    if TEST_MARKER not in trace and 'failure_reason' not in job:
+        # GraphQL 预取的 Job 没有 failure_reason，测试没有开始时单独获取
+        job = {**job, **client.get_job(submission.project_id, job["id"])}
+    if is_timeout(job, trace):
+        warnings.append(f"Timeout in job {job['name']} for {username} {name}")
     # print(extract_score_from_trace(trace))
-    score = extract_score_from_trace(trace)
-    submit_time = datetime.strptime(pipeline_create_at, "%Y-%m-%dT%H:%M:%S.%fZ")    # UTC, 2024-02-26T14:32:00.000Z
-    submit_time = submit_time + timedelta(hours=8)    # UTC+8
-    # 10% punishment for each day late
-    if submit_time > DDL:
-        days_late = (submit_time - DDL).days + 1
-        punish = max(0, 100 - days_late * 10)
-        return f"{score}*{punish}%"
-    return score
+    score = extract_score_from_trace(trace, BRANCH)
+    flags['parse_error'] = BRANCH == "lab0" and "Parse Error" in trace
+    return {
+        'pipeline_id': pipeline_id,
+        'job_id': job['id'],
+        'score': score,
+        'created_at': pipeline_create_at,
+        'warnings': warnings,
+        'flags': flags,
+        'finished': pipeline_status in FINISHED_STATUSES,
+    }
+
+
+use_accipit = 0
+use_qemu = 0
+parse_error = 0
+cache_hits = 0
+def get_score(username, name, user_id, project_id):
+    global use_accipit, use_qemu, parse_error, cache_hits
+    submission = prefetched.get(str(project_id))
+    if submission is None:
+        if mirror is not None and username not in mirror_failures:
+            submission = MirrorSubmission(project_id, username)
+        else:
+            submission = RestSubmission(project_id)
+    # print(f"Latest push commit ID: {commit_id}, Latest push time: {push_time}")
+    # 缓存只记录已结束的结果；未命中（新的提交、Pipeline 尚未结束）时才获取最新的 Pipeline 与 Job
+    result = None if args.refresh else submission.cached_result()
+    if result is not None:
+        cache_hits += 1
+        for message in result['warnings']:
+            print(message)
+    else:
+        pipeline, job = latest_job(submission)
+        warnings = []
+        try:
+            result = grade(submission, pipeline, job, username, name, warnings)
+        finally:
+            for message in warnings:
+                print(message)
+        if result['finished']:
+            grading_cache.set(project_id, BRANCH, submission.commit_id, result)
+
+    flags = result['flags']
+    if flags.get('use_accipit'):
+        use_accipit += 1
+    if flags.get('use_qemu'):
+        use_qemu += 1
+    if flags.get('parse_error'):
+        parse_error += 1
+
+    return late_score(result['score'], result['created_at'], DDL)
 
 def process_student(username, name, user_id, project_id):
     if project_id == "Failed":
@@ -208,6 +397,9 @@ def process_student(username, name, user_id, project_id):
     except Exception as e:
         return f"{username},{name},{user_id},{project_id},Failed"
         
+if args.reference:
+    seed_blob_hashes(args.reference)
+
 data_root = Path(config.data_root).resolve() / "repo"
 output_root = Path(config.data_root).resolve() / "score" / BRANCH
 output_root.mkdir(exist_ok=True, parents=True)
@@ -226,8 +418,18 @@ for class_file in classes:
     total = len(lines)
     failed = 0
     pass_count = 0
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        future_to_index = {executor.submit(process_student, *line.strip().split(",")): i for i, line in enumerate(lines)}
+    rows = [fill_roster_line(identity_cache, line, f"{config.repo.group}/{teacher}") for line in lines]
+    if mirror is not None:
+        # 镜像更新失败的学生回退到 REST
+        mirror_failures = mirror.update_all(
+            [(row[0], f"{config.repo.group}/{teacher}/cp-{row[0]}", row[3]) for row in rows if row[3] != "Failed"],
+            config.mirror.workers or MAX_WORKERS)
+        for username, error in mirror_failures.items():
+            print(f"Failed to update mirror of cp-{username}, using REST: {error}")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        if args.graphql:
+            prefetched = prefetch_submissions([row[3] for row in rows if row[3] != "Failed"], executor)
+        future_to_index = {executor.submit(process_student, *row): i for i, row in enumerate(rows)}
         results_indexed = {}
         for future in tqdm(as_completed(future_to_index), total=total):
             i = future_to_index[future]
@@ -249,6 +451,7 @@ for class_file in classes:
     
 print(f"All classes:")
 print(f"Total: {all_total}, Failed: {all_failed} ({all_failed/all_total:.2%}), Pass: {all_pass} ({all_pass/all_total:.2%})")
+print(f"Reused cached results: {cache_hits}")
 if BRANCH == 'lab0':
     print(f"Parse Error: {parse_error} ({parse_error/all_total:.2%})")
 if BRANCH == 'lab3':
@@ -0,0 +1,637 @@
+"""共享的 GitLab REST 客户端
+
+所有脚本通过同一个 requests.Session 访问 GitLab：连接池大小与线程池一致，
+保持长连接，避免每个请求重新握手；遇到 5xx 时按退避策略自动重试。
+所有请求都经过进程内共享的 RateLimiter，遇到 429 时全体暂停后重试。
+"""
+import os
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from pathlib import Path
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from http_cache import HttpCache
+
+# 与 ThreadPoolExecutor 的默认线程数一致
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# 429 由 RateLimiter 统一处理，这里只重试服务端错误
+RETRY_STATUS = (500, 502, 503, 504)
+
+# 连接错误、超时与 5xx 只对幂等请求重试，超时的 POST（创建项目、重试 Job 等）可能已经生效。
+# 这里用到的 PATCH 只设置字段的值，重复执行结果相同
+RETRY_METHODS = Retry.DEFAULT_ALLOWED_METHODS | {'PATCH'}
+# 会修改资源、需要使对应缓存失效的方法
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# GraphQL 只用于查询，POST 也可以安全地重试
+GRAPHQL_RETRY_METHODS = RETRY_METHODS | {'POST'}
+
+# 按用户名批量查询用户，每次最多查询 USERS_BATCH_SIZE 个
+USERS_QUERY = """
+query($usernames: [String!], $first: Int) {
+  users(usernames: $usernames, first: $first) {
+    nodes { id username }
+  }
+}
+"""
+USERS_BATCH_SIZE = 100
+
+# 流式下载文件时每次写入的字节数
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 读取 Job 日志末尾时首次请求的字节数，之后每次向前扩展一倍
+TRACE_CHUNK_SIZE = 64 * 1024
+# 日志中找不到标记时最多保留的末尾字节数
+TRACE_TAIL_LIMIT = 16 * 1024 * 1024
+
+
+def _parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """进程内所有线程共享的自适应限流器
+
+    - 令牌桶限制请求速率；响应带有 RateLimit-Remaining / RateLimit-Reset 时，
+      把速率调整为在窗口重置前刚好用完剩余额度
+    - 并发上限按“加性增、乘性减”调整：收到 429 时减半并按 Retry-After 全体暂停，
+      之后每连续成功一轮并发上限加一，直到 max_concurrency
+    """
+
+    def __init__(self, rate: float = 50.0, max_concurrency: int = DEFAULT_WORKERS,
+                 min_rate: float = 0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def configure(self, rate: float | None = None, max_concurrency: int | None = None) -> None:
+        with self._cond:
+            if rate is not None:
+                self.max_rate = self.rate = float(rate)
+            if max_concurrency is not None:
+                self.max_concurrency = self.concurrency = max(1, int(max_concurrency))
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        # 桶容量为一秒的请求量，避免空闲后突发过多请求
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """阻塞直到允许发出一个请求"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    timeout = self._paused_until - now
+                elif self._in_flight >= self.concurrency:
+                    timeout = None
+                elif self._tokens < 1:
+                    timeout = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+                self._cond.wait(timeout)
+
+    def release(self, response: requests.Response | None = None) -> float | None:
+        """请求结束后调用；收到 429 时返回应等待的秒数，否则返回 None"""
+        with self._cond:
+            self._in_flight -= 1
+            try:
+                if response is not None:
+                    return self._update(response)
+                return None
+            finally:
+                self._cond.notify_all()
+
+    def _update(self, response):
+        headers = response.headers
+        if response.status_code == 429:
+            retry_after = _parse_retry_after(headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = 1.0
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self.concurrency = max(1, self.concurrency // 2)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._successes = 0
+            return retry_after
+
+        remaining = headers.get('RateLimit-Remaining')
+        reset = headers.get('RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            try:
+                window = max(1.0, float(reset) - time.time())
+                self.rate = min(self.max_rate, max(self.min_rate, float(remaining) / window))
+            except ValueError:
+                pass
+        elif self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+        self._successes += 1
+        if self._successes >= self.concurrency:
+            self._successes = 0
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        return None
+
+
+# 进程内共享的限流器，所有 GitLabClient 默认使用它
+rate_limiter = RateLimiter()
+
+
+def quote_path(path: str) -> str:
+    """将项目路径或文件路径编码为 URL 中的单个路径段"""
+    return quote(str(path), safe='')
+
+
+class GitLabClient:
+    def __init__(self, url: str, token: str, pool_size: int = DEFAULT_WORKERS,
+                 max_retries: int = 5, backoff_factor: float = 0.5,
+                 limiter: RateLimiter | None = None, cache: HttpCache | None = None):
+        self.url = url.rstrip('/')
+        self.cache = cache
+        self.max_retries = max_retries
+        self.limiter = limiter or rate_limiter
+        self.session = requests.Session()
+        self.session.headers['PRIVATE-TOKEN'] = token
+        for prefix, methods in (('https://', RETRY_METHODS), ('http://', RETRY_METHODS),
+                                (self.graphql_url, GRAPHQL_RETRY_METHODS)):
+            retry = Retry(
+                total=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=RETRY_STATUS,
+                allowed_methods=methods,
+                # 否则 urllib3 会在各线程内按 Retry-After 自行重试 429，RateLimiter 看不到限流
+                respect_retry_after_header=False,
+                raise_on_status=False,
+            )
+            self.session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+
+    @classmethod
+    def from_config(cls, config, pool_size: int = DEFAULT_WORKERS) -> 'GitLabClient':
+        """创建客户端，并按 gitlab.rate_limit 配置（rate、max_concurrency）设置共享限流器
+
+        配置了 gitlab.http_cache 时，GET 响应经过本地缓存。
+        """
+        settings = config.gitlab.get('rate_limit') or {}
+        rate_limiter.configure(
+            rate=settings.get('rate'),
+            max_concurrency=settings.get('max_concurrency') or pool_size,
+        )
+        cache = None
+        if config.gitlab.get('http_cache'):
+            cache = HttpCache.from_settings(
+                config.gitlab.http_cache, Path(config.data_root).resolve() / "http_cache.sqlite3")
+        return cls(config.gitlab.url, config.gitlab.token, pool_size=pool_size, cache=cache)
+
+    def send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """经过共享限流器发出请求，429 时重新排队重试"""
+        for _ in range(self.max_retries + 1):
+            self.limiter.acquire()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            finally:
+                retry_after = self.limiter.release(response)
+            if retry_after is None:
+                break
+            # 限流器已让所有线程暂停 retry_after 秒，重新排队即可
+        return response
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        if self.cache is not None:
+            if method == 'GET' and not kwargs.get('stream'):
+                max_age = self.cache.max_age(path)
+                if max_age is not None:
+                    return self._cached_get(path, max_age, **kwargs)
+            elif method in WRITE_METHODS:
+                # 修改资源后其缓存失效；POST 只影响集合本身
+                self.cache.invalidate(path, recursive=method != 'POST')
+        return self.send(method, f"{self.url}{path}", **kwargs)
+
+    def _cached_get(self, path: str, max_age: float, **kwargs) -> requests.Response:
+        """新鲜的缓存直接返回；过期的缓存用 If-None-Match 重新验证，304 时返回缓存的响应"""
+        url = f"{self.url}{path}"
+        key = self.cache.key(url, kwargs.get('params'), self.session.headers['PRIVATE-TOKEN'],
+                             kwargs.get('headers'))
+        cached = self.cache.get(key)
+        if cached is not None and cached.age() < max_age:
+            return cached.to_response()
+        headers = dict(kwargs.pop('headers', None) or {})
+        if cached is not None and cached.etag:
+            headers['If-None-Match'] = cached.etag
+        response = self.send('GET', url, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            self.cache.revalidated(key)
+            return cached.to_response()
+        if response.status_code == 200:
+            self.cache.set(key, path, response)
+        return response
+
+    @property
+    def graphql_url(self) -> str:
+        """GraphQL 端点，由 REST 地址（.../api/v4）推出"""
+        base = self.url[:-len('/api/v4')] if self.url.endswith('/api/v4') else self.url
+        return f"{base}/api/graphql"
+
+    def graphql(self, query: str, variables: dict | None = None) -> dict:
+        """执行 GraphQL 查询并返回 data；没有 data 时抛出异常"""
+        response = self.send('POST', self.graphql_url, json={"query": query, "variables": variables or {}})
+        assert response.status_code == 200, f"GraphQL request failed: {response.status_code}, {response.text}"
+        result = response.json()
+        assert result.get("data"), f"GraphQL query failed: {result.get('errors')}"
+        return result["data"]
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def head(self, path: str, **kwargs) -> requests.Response:
+        return self.request('HEAD', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path: str, **kwargs) -> requests.Response:
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', path, **kwargs)
+
+    # 用户与项目
+
+    def find_user(self, username: str) -> dict:
+        response = self.get("/users", params={"username": username})
+        assert response.status_code == 200, f"Failed to fetch user {username}: {response.status_code}, {response.text}"
+        assert len(response.json()) > 0, f"User {username} not found."
+        return response.json()[0]
+
+    def find_users(self, usernames) -> tuple[dict[str, int], int]:
+        """用 GraphQL 按用户名批量查询用户 ID
+
+        返回 (用户名（小写）-> 用户 ID, 发出的请求数)；不存在的用户不出现在结果中。
+        """
+        usernames = sorted({username.lower() for username in usernames})
+        found = {}
+        batches = 0
+        for start in range(0, len(usernames), USERS_BATCH_SIZE):
+            batch = usernames[start:start + USERS_BATCH_SIZE]
+            data = self.graphql(USERS_QUERY, {"usernames": batch, "first": len(batch)})
+            batches += 1
+            for node in data["users"]["nodes"]:
+                found[node["username"].lower()] = int(node["id"].rsplit("/", 1)[-1])
+        return found, batches
+
+    def get_project(self, project: str | int) -> dict:
+        response = self.get(f"/projects/{quote_path(project)}")
+        assert response.status_code == 200, f"Failed to fetch project {project}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def create_project(self, data: dict) -> dict:
+        response = self.post("/projects", data=data)
+        assert response.status_code == 201, f"Failed to create project {data.get('name')}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def add_project_member(self, project_id: int | str, username: str, access_level: int) -> dict:
+        response = self.post(f"/projects/{project_id}/members",
+                             data={'username': username, 'access_level': access_level})
+        assert response.status_code == 201, f"Failed to add user {username} to project {project_id}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def iter_pages(self, path: str, params: dict | None = None, per_page: int = 100,
+                   workers: int = DEFAULT_WORKERS, keyset: dict | None = None) -> Iterator[dict]:
+        """逐个产出列表接口的所有条目，边获取边产出
+
+        第一页带有 X-Total-Pages 时，其余各页并发获取，按完成顺序产出；
+        项目过多时 GitLab 不返回总页数，此时若给出 keyset（如 {"order_by": "id", "sort": "asc"}）
+        则改用 keyset 分页（沿 Link 头翻页），否则按 X-Next-Page 逐页获取。
+        """
+        params = {**(params or {}), "per_page": per_page}
+        first_response = self.get(path, params={**params, "page": 1})
+        assert first_response.status_code == 200, f"Failed to list {path}: {first_response.status_code}, {first_response.text}"
+        first_page = first_response.json()
+        yield from first_page
+
+        total_pages = first_response.headers.get('X-Total-Pages')
+        if total_pages:
+            pages = range(2, int(total_pages) + 1)
+            if not pages:
+                return
+            with ThreadPoolExecutor(max_workers=min(workers, len(pages))) as executor:
+                futures = [executor.submit(self._get_page, path, {**params, "page": page}) for page in pages]
+                for future in as_completed(futures):
+                    yield from future.result()
+            return
+        if len(first_page) < per_page:
+            return
+
+        if keyset is not None:
+            response = self.get(path, params={**params, **keyset, "pagination": "keyset"})
+            if response.status_code == 200:
+                # keyset 分页从头开始，跳过第一页已经产出的条目
+                seen = {item['id'] for item in first_page}
+                while True:
+                    yield from (item for item in response.json() if item['id'] not in seen)
+                    next_url = response.links.get('next', {}).get('url')
+                    if not next_url:
+                        return
+                    response = self.send('GET', next_url)
+                    assert response.status_code == 200, f"Failed to list {path}: {response.status_code}, {response.text}"
+            # 不支持 keyset 分页的接口退回逐页获取
+
+        page, response, data = 1, first_response, first_page
+        while True:
+            next_page = response.headers.get('X-Next-Page')
+            if next_page is None:
+                # 没有 X-Next-Page 时，不满一页即为最后一页
+                if len(data) < per_page:
+                    return
+                next_page = page + 1
+            elif not next_page:
+                return
+            page = int(next_page)
+            response = self.get(path, params={**params, "page": page})
+            assert response.status_code == 200, f"Failed to list {path}: {response.status_code}, {response.text}"
+            data = response.json()
+            if not data:
+                return
+            yield from data
+
+    def _get_page(self, path: str, params: dict) -> list[dict]:
+        response = self.get(path, params=params)
+        assert response.status_code == 200, f"Failed to list {path}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def iter_group_projects(self, group_id: int | str, include_subgroups: bool = True,
+                            per_page: int = 100, workers: int = DEFAULT_WORKERS) -> Iterator[dict]:
+        """逐个产出 group（默认包括子 group）下的项目"""
+        return self.iter_pages(f"/groups/{quote_path(group_id)}/projects",
+                               {"include_subgroups": include_subgroups}, per_page=per_page, workers=workers,
+                               keyset={"order_by": "id", "sort": "asc"})
+
+    def list_group_projects(self, group_id: int | str, per_page: int = 100,
+                            include_subgroups: bool = False) -> list[dict]:
+        """获取 group 下的所有项目"""
+        return list(self.iter_group_projects(group_id, include_subgroups=include_subgroups, per_page=per_page))
+
+    # 分支保护
+
+    def get_protected_branch(self, project_id: int | str, branch: str) -> dict | None:
+        """返回分支保护规则，未保护时返回 None"""
+        response = self.get(f"/projects/{project_id}/protected_branches/{quote_path(branch)}")
+        if response.status_code == 404:
+            return None
+        assert response.status_code == 200, f"Failed to get protected branch {branch}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def protect_branch(self, project_id: int | str, branch: str,
+                       push_access_level: int, merge_access_level: int, **extra) -> dict:
+        response = self.post(f"/projects/{project_id}/protected_branches", json={
+            "name": branch,
+            "push_access_level": push_access_level,
+            "merge_access_level": merge_access_level,
+            **extra,
+        })
+        assert response.status_code == 201, f"Failed to protect branch {branch} for project {project_id}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def update_protected_branch(self, project_id: int | str, branch: str, **fields) -> dict:
+        """修改已有的分支保护规则，社区版只能修改 allow_force_push 等选项，不能修改各级权限"""
+        response = self.patch(f"/projects/{project_id}/protected_branches/{quote_path(branch)}", json=fields)
+        assert response.status_code == 200, f"Failed to update protected branch {branch} for project {project_id}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def unprotect_branch(self, project_id: int | str, branch: str) -> None:
+        response = self.delete(f"/projects/{project_id}/protected_branches/{quote_path(branch)}")
+        assert response.status_code == 204, f"Failed to unprotect branch {branch} for project {project_id}: {response.status_code}, {response.text}"
+
+    # 仓库
+
+    def get_branch(self, project_id: int | str, branch: str) -> dict | None:
+        """返回分支信息，分支不存在时返回 None"""
+        response = self.get(f"/projects/{project_id}/repository/branches/{quote_path(branch)}")
+        if response.status_code == 404:
+            return None
+        assert response.status_code == 200, f"Failed to get branch {branch}: {response.status_code}, {response.text}"
+        return response.json()
+
+    def get_latest_commit_id(self, project_id: int | str, branch: str) -> str:
+        """获取仓库分支的最新 commit id"""
+        response = self.get(f"/projects/{project_id}/repository/branches/{quote_path(branch)}")
+        assert response.status_code == 200, f"Failed to get branch information: {response.status_code}"
+        return response.json()['commit']['id']
+
+    def get_file_info(self, project_id: int | str, file_path: str, ref: str) -> dict:
+        response = self.get(f"/projects/{project_id}/repository/files/{quote_path(file_path)}",
+                            params={"ref": ref})
+        assert response.status_code == 200, f"Failed to get file information: {response.status_code}"
+        return response.json()
+
+    def head_file(self, project_id: int | str, file_path: str, ref: str) -> dict | None:
+        """用 HEAD 请求获取文件的 blob id、所在 commit 与 sha256，不下载内容；文件不存在时返回 None"""
+        response = self.head(f"/projects/{project_id}/repository/files/{quote_path(file_path)}",
+                             params={"ref": ref})
+        if response.status_code == 404:
+            return None
+        assert response.status_code == 200, f"Failed to get file information: {response.status_code}"
+        return {
+            'blob_id': response.headers.get('X-Gitlab-Blob-Id'),
+            'commit_id': response.headers.get('X-Gitlab-Commit-Id'),
+            'content_sha256': response.headers.get('X-Gitlab-Content-Sha256'),
+            'size': int(response.headers.get('X-Gitlab-Size') or 0),
+        }
+
+    def list_tree(self, project_id: int | str, ref: str, path: str = '',
+                  recursive: bool = False, per_page: int = 100) -> list[dict]:
+        """获取仓库目录树（条目包含 path、type 与 blob id），按 X-Next-Page 翻页"""
+        items = []
+        page = 1
+        while page:
+            params = {"ref": ref, "per_page": per_page, "page": page, "recursive": recursive}
+            if path:
+                params["path"] = path
+            response = self.get(f"/projects/{project_id}/repository/tree", params=params)
+            assert response.status_code == 200, f"Failed to get repository tree: {response.status_code}"
+            data = response.json()
+            items.extend(data)
+            if 'X-Next-Page' in response.headers:
+                next_page = response.headers['X-Next-Page']
+                page = int(next_page) if next_page else None
+            else:
+                page = page + 1 if len(data) == per_page else None
+        return items
+
+    def get_raw_file(self, project_id: int | str, file_path: str, ref: str) -> bytes:
+        response = self.get(f"/projects/{project_id}/repository/files/{quote_path(file_path)}/raw",
+                            params={"ref": ref})
+        assert response.status_code == 200, f"Failed to get file information: {response.status_code}"
+        return response.content
+
+    def download_raw_file(self, project_id: int | str, file_path: str, ref: str, save_path: Path,
+                          etag: str | None = None, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> tuple[bool, str | None]:
+        """分块流式下载文件到 save_path
+
+        带 etag 时发出 If-None-Match 条件请求，文件未变化（304）时不写入。
+        返回 (是否下载, 响应的 ETag)。
+        """
+        headers = {"If-None-Match": etag} if etag else {}
+        response = self.get(f"/projects/{project_id}/repository/files/{quote_path(file_path)}/raw",
+                            params={"ref": ref}, headers=headers, stream=True)
+        with response:
+            if response.status_code == 304:
+                return False, etag
+            assert response.status_code == 200, f"Failed to get file: {response.status_code}"
+            _save_stream(response, save_path, chunk_size)
+            return True, response.headers.get('ETag')
+
+    def get_raw_blob(self, project_id: int | str, blob_id: str) -> bytes:
+        """按 blob id 获取文件内容"""
+        response = self.get(f"/projects/{project_id}/repository/blobs/{blob_id}/raw")
+        assert response.status_code == 200, f"Failed to get blob: {response.status_code}"
+        return response.content
+
+    def download_archive(self, project_id: int | str, sha: str, save_path: Path,
+                         chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> None:
+        """分块流式下载仓库压缩包到 save_path，先写入临时文件，完成后再替换"""
+        response = self.get(f"/projects/{project_id}/repository/archive.zip", params={"sha": sha}, stream=True)
+        with response:
+            assert response.status_code == 200, f"Failed to get archive: {response.status_code}"
+            _save_stream(response, save_path, chunk_size)
+
+    # CI
+
+    def get_latest_pipeline(self, project_id: int | str, commit_id: str, ref: str) -> dict:
+        """获取某个提交关联的最新 Pipeline"""
+        response = self.get(f"/projects/{project_id}/pipelines", params={"sha": commit_id, "ref": ref})
+        assert response.status_code == 200 and response.json(), f"Failed to get pipelines: {response.status_code}"
+        return response.json()[0]
+
+    def get_pipeline(self, project_id: int | str, pipeline_id: int) -> dict:
+        response = self.get(f"/projects/{project_id}/pipelines/{pipeline_id}")
+        assert response.status_code == 200, f"Failed to get pipeline: {response.status_code}"
+        return response.json()
+
+    def get_pipeline_jobs(self, project_id: int | str, pipeline_id: int) -> list[dict]:
+        """获取 Pipeline 对应的 Jobs 状态"""
+        response = self.get(f"/projects/{project_id}/pipelines/{pipeline_id}/jobs")
+        assert response.status_code == 200, f"Failed to get jobs information: {response.status_code}"
+        return response.json()
+
+    def get_job(self, project_id: int | str, job_id: int) -> dict:
+        response = self.get(f"/projects/{project_id}/jobs/{job_id}")
+        assert response.status_code == 200, f"Failed to get job information: {response.status_code}"
+        return response.json()
+
+    def get_job_trace(self, project_id: int | str, job_id: int) -> str:
+        """获取指定 Job 的日志"""
+        response = self.get(f"/projects/{project_id}/jobs/{job_id}/trace")
+        assert response.status_code == 200, f"Failed to get job trace: {response.status_code}"
+        return response.text
+
+    def get_job_trace_tail(self, project_id: int | str, job_id: int, marker: str,
+                           chunk_size: int = TRACE_CHUNK_SIZE, limit: int = TRACE_TAIL_LIMIT) -> str:
+        """只获取 Job 日志中最后一次出现 marker 起到末尾的部分
+
+        先用 Range 请求日志末尾 chunk_size 字节，找不到 marker 时向前成倍扩展；
+        服务端不支持 Range 时改为分块流式读取，只在内存中保留需要的部分。
+        日志中没有 marker 时返回末尾最多 limit 字节。
+        """
+        path = f"/projects/{project_id}/jobs/{job_id}/trace"
+        needle = marker.encode()
+        # Range 针对的是传输编码后的字节，必须禁用压缩
+        headers = {'Accept-Encoding': 'identity'}
+        tail = b''
+        start = None  # 已获取部分在日志中的起始偏移
+        size = chunk_size
+        while True:
+            if start is None:
+                headers['Range'] = f"bytes=-{size}"
+            else:
+                headers['Range'] = f"bytes={max(0, start - size)}-{start - 1}"
+            response = self.get(path, headers=headers, stream=True)
+            if response.status_code == 416:
+                # 日志为空
+                response.close()
+                return tail.decode(errors='replace')
+            if response.status_code == 200:
+                return _read_trace_tail(response, needle, chunk_size, limit)
+            assert response.status_code == 206, f"Failed to get job trace: {response.status_code}"
+            # Content-Range: bytes <first>-<last>/<total>
+            start = int(response.headers['Content-Range'].split()[-1].split('-')[0])
+            tail = response.content + tail
+            index = tail.rfind(needle)
+            if index >= 0:
+                return tail[index:].decode(errors='replace')
+            if start == 0 or len(tail) >= limit:
+                return tail[-limit:].decode(errors='replace')
+            size = min(len(tail), limit - len(tail))
+
+    def list_runner_jobs(self, runner_id: int, status: str | None = None, per_page: int = 100) -> list[dict]:
+        """获取 Runner 上的全部 Job，各页并发获取
+
+        接口只返回已分配给 Runner 的 Job，status 可为 running、success、failed、canceled，排队中的 Job 不在其中。
+        """
+        return list(self.iter_pages(f"/runners/{runner_id}/jobs", params={"status": status} if status else None,
+                                    per_page=per_page))
+
+    def retry_job(self, project_id: int | str, job_id: int) -> dict:
+        response = self.post(f"/projects/{project_id}/jobs/{job_id}/retry")
+        assert response.status_code == 201, f"Failed to retry job: {response.status_code}"
+        return response.json()
+
+
+def _read_trace_tail(response: requests.Response, needle: bytes, chunk_size: int, limit: int) -> str:
+    """分块读取完整日志，只保留最后一次出现 needle 起的部分（没有 needle 时保留末尾 limit 字节）"""
+    buffer = bytearray()
+    found = False
+    with response:
+        for chunk in response.iter_content(chunk_size):
+            # 只在新数据及其与旧数据的衔接处查找
+            offset = max(0, len(buffer) - len(needle) + 1)
+            buffer += chunk
+            index = buffer.rfind(needle, offset)
+            if index >= 0:
+                del buffer[:index]
+                found = True
+            elif not found and len(buffer) > limit:
+                del buffer[:len(buffer) - limit]
+    return buffer.decode(errors='replace')
+
+
+def _save_stream(response: requests.Response, save_path: Path, chunk_size: int) -> None:
+    save_path = Path(save_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = save_path.with_name(save_path.name + ".part")
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+        tmp_path.replace(save_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,120 @@
+"""评分结果缓存
+
+以 (project_id, branch, commit_id, pipeline_id, job_id) 为键缓存 get_score.py 的评分结果：
+成绩、Pipeline 创建时间、白名单检查输出以及 use_accipit / use_qemu 等标记。
+只缓存 Pipeline 已结束的结果。重新运行时：
+- 已知最新的 Pipeline 与 Job（GraphQL 预取）时，五者都未变化才复用结果，同一提交上新建的 Pipeline 或重试的 Job 会重新评分；
+- 否则只按分支 head 查找（get_latest），命中时不再请求 Pipeline 与 Job 列表，retry_job.py 重跑 Job 时会使对应结果失效。
+迟交扣分按当前 ddl 重新计算。
+
+另外记录 git blob id -> 文件 sha256 的对应关系，白名单检查只需获取一次目录树。
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class GradingCache:
+    """评分结果缓存，可在多线程中共享"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " project_id INTEGER NOT NULL,"
+                " branch TEXT NOT NULL,"
+                " commit_id TEXT NOT NULL,"
+                " pipeline_id INTEGER NOT NULL,"
+                " job_id INTEGER NOT NULL,"
+                " score REAL NOT NULL,"
+                " created_at TEXT NOT NULL,"
+                " warnings TEXT NOT NULL,"
+                " flags TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (project_id, branch, commit_id, pipeline_id, job_id))")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " blob_id TEXT PRIMARY KEY,"
+                " sha256 TEXT NOT NULL)")
+
+    @classmethod
+    def from_settings(cls, settings, default_path):
+        """根据配置文件中的 grading_cache 段创建缓存，支持的键：path"""
+        settings = settings or {}
+        return cls(settings.get('path') or default_path)
+
+    def get(self, project_id, branch, commit_id, pipeline_id, job_id):
+        """返回该提交在这个 Pipeline 与 Job 上的评分结果，未命中时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT pipeline_id, job_id, score, created_at, warnings, flags FROM results"
+                " WHERE project_id = ? AND branch = ? AND commit_id = ? AND pipeline_id = ? AND job_id = ?",
+                (int(project_id), branch, commit_id, int(pipeline_id), int(job_id))).fetchone()
+        return self._result(row)
+
+    def get_latest(self, project_id, branch, commit_id):
+        """返回该提交在最新的 Pipeline 与 Job 上的评分结果，未命中时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT pipeline_id, job_id, score, created_at, warnings, flags FROM results"
+                " WHERE project_id = ? AND branch = ? AND commit_id = ?"
+                " ORDER BY pipeline_id DESC, job_id DESC LIMIT 1",
+                (int(project_id), branch, commit_id)).fetchone()
+        return self._result(row)
+
+    @staticmethod
+    def _result(row):
+        if row is None:
+            return None
+        return {
+            'pipeline_id': row[0],
+            'job_id': row[1],
+            'score': row[2],
+            'created_at': row[3],
+            'warnings': json.loads(row[4]),
+            'flags': json.loads(row[5]),
+        }
+
+    def set(self, project_id, branch, commit_id, result):
+        """记录评分结果，result 的键与 get() 的返回值相同"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results"
+                " (project_id, branch, commit_id, pipeline_id, job_id, score, created_at, warnings, flags, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (int(project_id), branch, commit_id, int(result['pipeline_id']), int(result['job_id']),
+                 float(result['score']), result['created_at'],
+                 json.dumps(result['warnings'], ensure_ascii=False), json.dumps(result['flags']),
+                 time.time()))
+
+    def invalidate(self, project_id, branch=None):
+        """删除项目（某个分支）的全部评分结果，例如重新运行 Job 之后"""
+        with self._lock, self._db:
+            if branch is None:
+                self._db.execute("DELETE FROM results WHERE project_id = ?", (int(project_id),))
+            else:
+                self._db.execute("DELETE FROM results WHERE project_id = ? AND branch = ?",
+                                 (int(project_id), branch))
+
+    # 文件内容
+
+    def get_blob_sha256(self, blob_id):
+        """返回 blob 内容的 sha256，未记录时返回 None"""
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM blobs WHERE blob_id = ?", (blob_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_blob_sha256(self, blob_id, sha256):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO blobs (blob_id, sha256) VALUES (?, ?)", (blob_id, sha256))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
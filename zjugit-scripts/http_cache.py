@@ -0,0 +1,164 @@
+"""GitLab GET 响应的本地缓存
+
+GitLabClient 的 GET 请求按路径匹配缓存策略：在 max_age 秒内直接使用缓存，不发请求；
+过期后带上 If-None-Match 重新验证，GitLab 返回 304 时继续使用缓存的响应。
+max_age 为 0 的路径每次都重新验证，只节省响应体的传输。
+同一路径上的 POST / PUT / PATCH / DELETE 会使其缓存失效，HEAD 不会。缓存总大小超过上限时按最近使用时间淘汰。
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# 路径正则 -> 不重新验证即可使用的秒数
+DEFAULT_POLICIES = {
+    r"^/users$": 24 * 60 * 60,                                # find_user
+    r"^/projects/[^/]+$": 60 * 60,                            # get_project
+    r"^/groups/[^/]+/projects$": 10 * 60,                     # list_group_projects
+    r"^/projects/[^/]+/repository/files/[^/]+$": 0,           # get_file_info
+    r"^/projects/[^/]+/repository/tree$": 0,                  # list_tree
+}
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# 响应体以解码后的内容保存，这些头不再适用
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'set-cookie', 'connection'}
+
+
+class CachedResponse:
+    def __init__(self, url, etag, headers, body, stored_at):
+        self.url = url
+        self.etag = etag
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+    def to_response(self) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = self.url
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = self.body
+        return response
+
+
+class HttpCache:
+    """可在多线程、多个脚本之间共享的响应缓存"""
+
+    def __init__(self, path, policies: dict[str, float] | None = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.policies = [(re.compile(pattern), max_age)
+                         for pattern, max_age in (DEFAULT_POLICIES if policies is None else policies).items()]
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " path TEXT NOT NULL,"
+                " url TEXT NOT NULL,"
+                " etag TEXT,"
+                " headers TEXT NOT NULL,"
+                " body BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " used_at REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_path ON responses (path)")
+
+    @classmethod
+    def from_settings(cls, settings, default_path):
+        """根据配置文件中的 gitlab.http_cache 段创建缓存，支持的键：path、max_size_mb、policies"""
+        settings = settings or {}
+        policies = settings.get('policies')
+        return cls(
+            settings.get('path') or default_path,
+            policies={**DEFAULT_POLICIES, **policies} if policies else None,
+            max_size=int((settings.get('max_size_mb') or DEFAULT_MAX_SIZE / 1024 / 1024) * 1024 * 1024),
+        )
+
+    def max_age(self, path: str) -> float | None:
+        """路径对应的缓存时间，不缓存的路径返回 None"""
+        for pattern, max_age in self.policies:
+            if pattern.search(path):
+                return max_age
+        return None
+
+    @staticmethod
+    def key(url: str, params, token: str, headers=None) -> str:
+        """请求的缓存键
+
+        不同令牌能看到的内容可能不同，令牌的摘要也是键的一部分；
+        调用方显式传入的请求头（Range、Accept 等）可能改变响应，也计入键中。
+        """
+        params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        headers = sorted((str(k).lower(), str(v)) for k, v in (headers or {}).items())
+        token_digest = hashlib.sha256(token.encode()).hexdigest()[:16]
+        return hashlib.sha256(json.dumps([url, params, headers, token_digest]).encode()).hexdigest()
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT url, etag, headers, body, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+        return CachedResponse(row[0], row[1], json.loads(row[2]), row[3], row[4])
+
+    def set(self, key: str, path: str, response: requests.Response) -> None:
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS}
+        body = response.content
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, path, url, etag, headers, body, size, stored_at, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, path, response.url, response.headers.get('ETag'), json.dumps(headers), body,
+                 len(body), now, now))
+            self._evict()
+
+    def revalidated(self, key: str) -> None:
+        """304 之后重新计时"""
+        with self._lock, self._db:
+            now = time.time()
+            self._db.execute("UPDATE responses SET stored_at = ?, used_at = ? WHERE key = ?", (now, now, key))
+
+    def invalidate(self, path: str, recursive: bool = True) -> None:
+        """删除该路径（recursive 时包括其下所有路径）的缓存"""
+        with self._lock, self._db:
+            if not recursive:
+                self._db.execute("DELETE FROM responses WHERE path = ?", (path,))
+                return
+            self._db.execute("DELETE FROM responses WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                             (path, path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"))
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+        # 从最久未使用的开始删除，直到不超过上限
+        freed = 0
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY used_at"):
+            if total - freed <= self.max_size:
+                break
+            stale.append((key,))
+            freed += size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,150 @@
+"""本地身份缓存
+
+在 SQLite 中缓存 学号 -> 用户 ID、仓库路径 -> 项目 ID 及默认分支，
+zjugit-script/main.py 与 zjugit-scripts 下的各脚本共用同一个数据库文件，
+学期内重复运行时几乎不必再向 GitLab 查询身份信息。
+
+数据库默认位于 zjugit-scripts/data/identity.sqlite3；配置中的相对路径也相对 zjugit-scripts 目录解析，
+因此两边无论从哪个目录运行、只要配置相同的 identity_cache.path 就会打开同一个文件。
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DAY = 24 * 60 * 60
+
+# 学号与用户 ID 的对应关系几乎不会变化，项目可能被删除重建，有效期短一些
+DEFAULT_USER_TTL = 30 * DAY
+DEFAULT_PROJECT_TTL = 7 * DAY
+
+# zjugit-script 以可编辑方式安装 zjugit-scripts 包，__file__ 仍指向本目录
+SHARED_ROOT = Path(__file__).resolve().parent
+DEFAULT_PATH = SHARED_ROOT / "data" / "identity.sqlite3"
+
+
+class IdentityCache:
+    """带有效期的身份缓存，可在多线程中共享"""
+
+    def __init__(self, path, user_ttl=DEFAULT_USER_TTL, project_ttl=DEFAULT_PROJECT_TTL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.user_ttl = user_ttl
+        self.project_ttl = project_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " username TEXT PRIMARY KEY,"
+                " user_id INTEGER NOT NULL,"
+                " updated_at REAL NOT NULL)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS projects ("
+                " path TEXT PRIMARY KEY,"
+                " project_id INTEGER NOT NULL,"
+                " default_branch TEXT,"
+                " updated_at REAL NOT NULL)")
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(projects)")]
+            if 'default_branch' not in columns:
+                self._db.execute("ALTER TABLE projects ADD COLUMN default_branch TEXT")
+
+    @classmethod
+    def from_settings(cls, settings):
+        """根据配置文件中的 identity_cache 段创建缓存
+
+        支持的键：path、user_ttl_days、project_ttl_days，均可省略。
+        path 省略时使用 DEFAULT_PATH，相对路径相对 SHARED_ROOT 解析。
+        """
+        settings = settings or {}
+        path = SHARED_ROOT / settings['path'] if settings.get('path') else DEFAULT_PATH
+        user_ttl = settings.get('user_ttl_days')
+        project_ttl = settings.get('project_ttl_days')
+        return cls(
+            path,
+            user_ttl=DEFAULT_USER_TTL if user_ttl is None else user_ttl * DAY,
+            project_ttl=DEFAULT_PROJECT_TTL if project_ttl is None else project_ttl * DAY,
+        )
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()
+
+    def _write(self, sql, params=()):
+        with self._lock, self._db:
+            self._db.execute(sql, params)
+
+    # 用户
+
+    def get_user_id(self, username):
+        """返回未过期的用户 ID，缓存未命中时返回 None"""
+        row = self._query(
+            "SELECT user_id FROM users WHERE username = ? AND updated_at > ?",
+            (username.lower(), time.time() - self.user_ttl))
+        return row[0] if row else None
+
+    def set_user_id(self, username, user_id):
+        self._write(
+            "INSERT OR REPLACE INTO users (username, user_id, updated_at) VALUES (?, ?, ?)",
+            (username.lower(), int(user_id), time.time()))
+
+    def invalidate_user(self, username):
+        self._write("DELETE FROM users WHERE username = ?", (username.lower(),))
+
+    # 项目
+
+    def get_project(self, path):
+        """返回未过期的 {'project_id', 'default_branch'}，缓存未命中时返回 None"""
+        row = self._query(
+            "SELECT project_id, default_branch FROM projects WHERE path = ? AND updated_at > ?",
+            (path, time.time() - self.project_ttl))
+        if row is None:
+            return None
+        return {'project_id': row[0], 'default_branch': row[1]}
+
+    def get_project_id(self, path):
+        project = self.get_project(path)
+        return project['project_id'] if project else None
+
+    def get_default_branch(self, path):
+        project = self.get_project(path)
+        return project['default_branch'] if project else None
+
+    def set_project(self, path, project_id, default_branch=None):
+        """记录项目 ID；未提供默认分支时保留已缓存的值"""
+        self._write(
+            "INSERT INTO projects (path, project_id, default_branch, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(path) DO UPDATE SET"
+            " project_id = excluded.project_id,"
+            " default_branch = COALESCE(excluded.default_branch, projects.default_branch),"
+            " updated_at = excluded.updated_at",
+            (path, int(project_id), default_branch, time.time()))
+
+    def invalidate_project(self, path):
+        self._write("DELETE FROM projects WHERE path = ?", (path,))
+
+    def clear(self, kind=None):
+        """清空缓存，kind 为 'users' 或 'projects' 时只清空对应的表"""
+        tables = [kind] if kind else ['users', 'projects']
+        for table in tables:
+            assert table in ('users', 'projects'), f"Unknown cache kind: {table}"
+            self._write(f"DELETE FROM {table}")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def fill_roster_line(cache, line, namespace):
+    """解析 data_root/repo/*.csv 中的一行，标记为 Failed 的 ID 尝试用缓存补全
+
+    namespace 为学生仓库所在的组路径，例如 f"{config.repo.group}/{teacher}"。
+    返回 [username, name, user_id, project_id]。
+    """
+    username, name, user_id, project_id = line.strip().split(",")
+    if user_id == "Failed":
+        user_id = str(cache.get_user_id(username) or "Failed")
+    if project_id == "Failed":
+        project_id = str(cache.get_project_id(f"{namespace}/cp-{username}") or "Failed")
+    return [username, name, user_id, project_id]
@@ -1,10 +1,11 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
 from tqdm import tqdm
 from pathlib import Path
 from argparse import ArgumentParser
 import yaml
 from addict import Dict
+from identity_cache import IdentityCache
+from gitlab_client import GitLabClient, DEFAULT_WORKERS
 
 parser = ArgumentParser()
 parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
@@ -13,34 +14,25 @@ args = parser.parse_args()
 with open(args.config, "r") as f:
     config = Dict(yaml.safe_load(f))
 
-url = config.gitlab.url
-private_token = config.gitlab.token
+client = GitLabClient.from_config(config, pool_size=DEFAULT_WORKERS)
 
-headers = {
-    'PRIVATE-TOKEN': private_token
-}
-
-# 查找用户
-def find_user(username):
-    response = requests.get(f"{url}/users?username={username}", headers=headers)
-    assert response.status_code == 200, f"Failed to fetch user {username}: {response.status_code}, {response.text}"
-    assert len(response.json()) > 0, f"User {username} not found."
-    return response.json()[0]  # 返回用户信息
-
-def find_project(project_path):
-    response = requests.get(f"{url}/projects/{project_path.replace('/', '%2F')}", headers=headers)
-    assert response.status_code == 200, f"Failed to fetch project {project_path}: {response.status_code}, {response.text}"
-    return response.json()
+identity_cache = IdentityCache.from_settings(config.identity_cache)
 
 def process_student(teacher, username, name):
     try:
-        user = find_user(username)
-        user_id = user["id"]
+        user_id = identity_cache.get_user_id(username)
+        if user_id is None:
+            user_id = client.find_user(username)["id"]
+            identity_cache.set_user_id(username, user_id)
     except Exception as e:
         return f"{username},{name},Failed,Failed"
     try:
-        project = find_project(f"{config.repo.group}/{teacher}/cp-{username}")
-        project_id = project["id"]
+        project_path = f"{config.repo.group}/{teacher}/cp-{username}"
+        project_id = identity_cache.get_project_id(project_path)
+        if project_id is None:
+            project = client.get_project(project_path)
+            project_id = project["id"]
+            identity_cache.set_project(project_path, project_id, project.get("default_branch"))
     except Exception as e:
         return f"{username},{name},{user_id},Failed"
     return f"{username},{name},{user_id},{project_id}"
@@ -59,7 +51,7 @@ for class_file in classes:
         lines = f.readlines()
     total = len(lines)
     failed = 0
-    with ThreadPoolExecutor() as executor:
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor:
         future_to_index = {executor.submit(process_student, teacher, *line.strip().split(",")): i for i, line in enumerate(lines)}
         results_indexed = {}
         for future in tqdm(as_completed(future_to_index), total=total):
@@ -0,0 +1,214 @@
+"""学生仓库的本地 git 镜像
+
+为 data_root/repo/*.csv 中的每个学生仓库维护一个裸仓库镜像（默认 --filter=blob:none 的部分克隆，
+文件内容在第一次读取时获取，read_blobs 把缺少的 blob 合并为一次 git fetch），之后每次只需并行执行增量 git fetch。
+get_score.py、get_report.py、plagiarism.py 使用 --mirror 时从镜像读取文件，不再逐个文件请求 REST API。
+
+    python mirror.py                  # 克隆或更新全部镜像
+    python mirror.py s1 s2            # 只更新这些学生
+
+镜像的远端地址由 mirror.remote 模板生成，可用 {url}（GitLab 根地址）、{path}（仓库路径）、
+{username}、{project_id}，例如用本地裸仓库代替 GitLab 测试时写作 /srv/remotes/{path}.git。
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import base64
+import os
+import shutil
+import subprocess
+from argparse import ArgumentParser
+import yaml
+from addict import Dict
+from identity_cache import IdentityCache, fill_roster_line
+from gitlab_client import DEFAULT_WORKERS
+
+DEFAULT_REMOTE = "{url}/{path}.git"
+DEFAULT_FILTER = "blob:none"
+
+# 只镜像分支，不需要 merge request 等其他引用
+FETCH_REFSPEC = "+refs/heads/*:refs/heads/*"
+
+
+class MirrorManager:
+    """镜像位于 root/cp-<username>.git，读取接口按 (学生, 分支或 commit, 路径) 访问，可在多线程中共享"""
+
+    def __init__(self, root, remote: str = DEFAULT_REMOTE, url: str = "", token: str | None = None,
+                 filter: str | None = DEFAULT_FILTER):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.remote = remote
+        self.url = url.rstrip("/")
+        self.filter = filter
+        # 令牌通过环境变量中的 git 配置传给 git，既不出现在 ps 可见的命令行中，也不写入镜像的配置
+        self.git_env = None
+        if token and remote.format(url=self.url, path="", username="", project_id="").startswith("http"):
+            credentials = base64.b64encode(f"oauth2:{token}".encode()).decode()
+            self.git_env = {
+                **os.environ,
+                "GIT_CONFIG_COUNT": "1",
+                "GIT_CONFIG_KEY_0": "http.extraHeader",
+                "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}",
+            }
+
+    @classmethod
+    def from_config(cls, config) -> 'MirrorManager':
+        """根据配置文件中的 mirror 段创建，支持的键：path、remote、filter"""
+        settings = config.mirror or {}
+        api_url = config.gitlab.url.rstrip("/")
+        url = api_url[:-len("/api/v4")] if api_url.endswith("/api/v4") else api_url
+        return cls(
+            settings.path or Path(config.data_root).resolve() / "mirror",
+            remote=settings.remote or DEFAULT_REMOTE,
+            url=url,
+            token=config.gitlab.token,
+            filter=settings.get("filter", DEFAULT_FILTER),
+        )
+
+    def git_dir(self, username: str) -> Path:
+        return self.root / f"cp-{username}.git"
+
+    def _git(self, *git_args, git_dir: Path | None = None, input: bytes | None = None) -> bytes:
+        cmd = ["git"]
+        if git_dir is not None:
+            cmd += ["--git-dir", str(git_dir)]
+        result = subprocess.run([*cmd, *git_args], input=input, capture_output=True, env=self.git_env)
+        assert result.returncode == 0, f"git {git_args[0]} failed: {result.stderr.decode(errors='replace').strip()}"
+        return result.stdout
+
+    # 更新
+
+    def update(self, username: str, path: str, project_id) -> str:
+        """克隆或增量更新一个学生的镜像，返回 "cloned" 或 "fetched" """
+        git_dir = self.git_dir(username)
+        if not (git_dir / "HEAD").exists():
+            remote = self.remote.format(url=self.url, path=path, username=username, project_id=project_id)
+            tmp_dir = git_dir.with_name(git_dir.name + ".tmp")
+            # 上次中断的克隆
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            clone_args = ["clone", "--bare", "--quiet", "--no-tags"]
+            if self.filter:
+                clone_args.append(f"--filter={self.filter}")
+            self._git(*clone_args, remote, str(tmp_dir))
+            tmp_dir.rename(git_dir)
+            return "cloned"
+        self._git("fetch", "--quiet", "--prune", "--no-tags", "origin", FETCH_REFSPEC, git_dir=git_dir)
+        return "fetched"
+
+    def update_all(self, students, workers: int = DEFAULT_WORKERS) -> dict[str, str]:
+        """并行更新 [(username, path, project_id)]，返回 username -> 错误信息"""
+        failures = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.update, *student): student[0] for student in students}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures[futures[future]] = str(e)
+        return failures
+
+    # 读取
+
+    def resolve(self, username: str, ref: str) -> str:
+        """分支名或 commit 对应的 commit id"""
+        output = self._git("rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}", git_dir=self.git_dir(username))
+        return output.decode().strip()
+
+    def read_file(self, username: str, ref: str, file_path: str) -> bytes:
+        """ref 下 file_path 的内容，部分克隆中缺少的内容由 git 按需获取"""
+        return self._git("cat-file", "blob", f"{ref}:{file_path}", git_dir=self.git_dir(username))
+
+    def read_blob(self, username: str, blob_id: str) -> bytes:
+        return self._git("cat-file", "blob", blob_id, git_dir=self.git_dir(username))
+
+    def read_blobs(self, username: str, ref: str, blob_ids) -> dict[str, bytes]:
+        """一次读取 ref 下的多个 blob，返回 blob id -> 内容
+
+        部分克隆中缺少的 blob 先用一次 git fetch 批量获取，不再由 git 逐个按需获取。
+        """
+        git_dir = self.git_dir(username)
+        blob_ids = sorted(set(blob_ids))
+        if not blob_ids:
+            return {}
+        if self.filter:
+            # --missing=print 列出缺少的对象而不触发按需获取
+            output = self._git("rev-list", "--objects", "--no-walk", "--missing=print", ref, git_dir=git_dir)
+            missing = {line[1:] for line in output.decode().splitlines() if line.startswith("?")}
+            missing.intersection_update(blob_ids)
+            if missing:
+                # 与 git 按需获取单个对象时的参数相同，只是一次请求全部缺少的 blob
+                self._git("-c", "fetch.negotiationAlgorithm=noop", "fetch", "--quiet", "--no-tags",
+                          "--no-write-fetch-head", "--recurse-submodules=no", f"--filter={self.filter}",
+                          "--stdin", "origin", git_dir=git_dir,
+                          input="".join(f"{object_id}\n" for object_id in sorted(missing)).encode())
+        output = self._git("cat-file", "--batch", git_dir=git_dir,
+                           input="".join(f"{blob_id}\n" for blob_id in blob_ids).encode())
+        blobs = {}
+        offset = 0
+        while offset < len(output):
+            header_end = output.index(b"\n", offset)
+            header = output[offset:header_end].decode().split()
+            assert len(header) == 3 and header[1] == "blob", f"Failed to read blob: {' '.join(header)}"
+            object_id, _, size = header
+            start = header_end + 1
+            blobs[object_id] = output[start:start + int(size)]
+            # 内容之后还有一个换行
+            offset = start + int(size) + 1
+        return blobs
+
+    def list_tree(self, username: str, ref: str, path: str = "", recursive: bool = False) -> list[dict]:
+        """与 GitLabClient.list_tree 相同格式的目录树（id、name、type、path、mode）"""
+        ls_args = ["ls-tree", "-z"]
+        if recursive:
+            ls_args.append("-r")
+        treeish = f"{ref}:{path}" if path else ref
+        output = self._git(*ls_args, treeish, git_dir=self.git_dir(username))
+        items = []
+        for entry in output.decode().split("\0"):
+            if not entry:
+                continue
+            meta, name = entry.split("\t", 1)
+            mode, type, object_id = meta.split()
+            full_path = f"{path.rstrip('/')}/{name}" if path else name
+            items.append({"id": object_id, "name": name.rsplit("/", 1)[-1], "type": type,
+                          "path": full_path, "mode": mode})
+        return items
+
+
+def load_students(config, identity_cache, usernames=()):
+    """读取 data_root/repo/*.csv，返回 [(username, path, project_id)]；没有仓库的学生被跳过"""
+    students = []
+    for class_file in sorted((Path(config.data_root).resolve() / "repo").glob("*.csv")):
+        teacher, group_id = class_file.stem.split("-")
+        namespace = f"{config.repo.group}/{teacher}"
+        with class_file.open() as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                username, name, user_id, project_id = fill_roster_line(identity_cache, line, namespace)
+                if project_id == "Failed" or (usernames and username not in usernames):
+                    continue
+                students.append((username, f"{namespace}/cp-{username}", project_id))
+    return students
+
+
+def main():
+    parser = ArgumentParser(description="Clone or incrementally fetch local mirrors of student repositories")
+    parser.add_argument("usernames", nargs="*", help="Only update these students")
+    parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
+    parser.add_argument("--workers", type=int, help="Number of parallel git processes (default: mirror.workers)")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = Dict(yaml.safe_load(f))
+    identity_cache = IdentityCache.from_settings(config.identity_cache)
+
+    mirror = MirrorManager.from_config(config)
+    students = load_students(config, identity_cache, set(args.usernames))
+    failures = mirror.update_all(students, args.workers or config.mirror.workers or DEFAULT_WORKERS)
+    for username, error in sorted(failures.items()):
+        print(f"Failed to update cp-{username}: {error}")
+    print(f"Updated {len(students) - len(failures)}/{len(students)} mirrors in {mirror.root}")
+
+
+if __name__ == "__main__":
+    main()
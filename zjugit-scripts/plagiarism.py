@@ -1,32 +1,47 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import csv
+import hashlib
+import json
 import os
 from pathlib import Path
 import shutil
 import subprocess
 import sys
-import requests
 import re
+import threading
+import time
 import zipfile
 from tqdm import tqdm
 import mosspy
 from argparse import ArgumentParser
 import yaml
 from addict import Dict
+from identity_cache import IdentityCache, fill_roster_line
+from gitlab_client import GitLabClient, DEFAULT_WORKERS
+from blob_store import BlobStore
+from mirror import MirrorManager
+from fingerprint import PREVIOUS_PREFIX
+
+# 流水线的各个阶段，--from-stage 从其中之一开始，之前的阶段使用检查点中的结果
+STAGES = ["fetch", "extract", "filter", "fingerprint", "compare"]
 
 parser = ArgumentParser()
 parser.add_argument("branch", type=str, help="The branch name to process")
-parser.add_argument("--download", "-d", action="store_true", help="Download repositories from GitLab")
+parser.add_argument("--download", "-d", action="store_true", help="Download repositories from GitLab (same as --from-stage fetch)")
+parser.add_argument("--from-stage", choices=STAGES, help="Rerun the pipeline from this stage, reusing the checkpoints of earlier stages (default: resume after the last finished stage)")
+parser.add_argument("--force", "-f", action="store_true", help="Download every repository even if its branch head has not moved")
+parser.add_argument("--prefilter", type=int, metavar="N", help="Rank pairs with fingerprint.py first and only send submissions from the top N pairs to MOSS/JPlag")
+parser.add_argument("--previous-index", action="store_true", help="Compare against previous-term repos through the persistent fingerprint index instead of copying and uploading them")
+parser.add_argument("--keep-duplicates", action="store_true", help="Upload template copies, files shared by more than the MOSS ignore limit of submissions and repeated files within a submission as well")
+parser.add_argument("--store", action="store_true", help="Download only new blobs into the content-addressed store shared by all branches instead of whole archives")
+parser.add_argument("--mirror", action="store_true", help="Fetch local git mirrors first and read sources from them instead of downloading archives")
 parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
 args = parser.parse_args()
 
 with open(args.config, "r") as f:
     config = Dict(yaml.safe_load(f))
 
-GITLAB_URL = config.gitlab.url
-PRIVATE_TOKEN = config.gitlab.token
-
 MOSS_USER_ID = config.moss_id
-moss = mosspy.Moss(MOSS_USER_ID, "cc")
 
 BRANCH = args.branch
 
@@ -34,34 +49,49 @@ teacher2name = config.teacher2name
 
 exts = ["cpp", "hpp", "cc", "c", "h"]
 
+# 出现在超过这么多份提交中的代码段 MOSS 会忽略；同一内容的文件超过这个份数时视为公共代码，不再上传
+MOSS_IGNORE_LIMIT = 20
+
 data_root = Path(config.data_root).resolve() / "repo"
 output_root = Path(config.data_root).resolve() / "plagiarism" / BRANCH
 output_root.mkdir(exist_ok=True, parents=True)
 
+identity_cache = IdentityCache.from_settings(config.identity_cache)
 
-# 获取仓库分支的最新 commit id
-def get_latest_commit_id(project_id, branch):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/branches/{branch}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
+client = GitLabClient.from_config(config, pool_size=DEFAULT_WORKERS)
 
-    response = requests.get(url, headers=headers)
-    assert (
-        response.status_code == 200
-    ), f"Failed to get branch information: {response.status_code}"
-    branch_info = response.json()
-    return branch_info["commit"]["id"]
 
+class DownloadManifest:
+    """记录每个学生上次下载时的 (project_id, branch, commit_id)，分支 head 未变化时跳过下载"""
 
-def get_archive(project_id, commit_id, save_path: Path):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/archive.zip"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    params = {"sha": commit_id}
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = json.loads(path.read_text()) if path.exists() else {}
+
+    def unchanged(self, key, project_id, commit_id):
+        with self._lock:
+            entry = self.entries.get(key)
+        return entry == {"project_id": str(project_id), "branch": BRANCH, "commit_id": commit_id}
+
+    def update(self, key, project_id, commit_id):
+        with self._lock:
+            self.entries[key] = {"project_id": str(project_id), "branch": BRANCH, "commit_id": commit_id}
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.entries, ensure_ascii=False, indent=2))
+            tmp.replace(self.path)
 
-    response = requests.get(url, headers=headers, params=params)
-    assert response.status_code == 200, f"Failed to get archive: {response.status_code}"
-    save_path.parent.mkdir(exist_ok=True, parents=True)
-    with open(save_path, "wb") as f:
-        f.write(response.content)
+
+manifest = DownloadManifest(output_root / "manifest.json")
+mirror = MirrorManager.from_config(config) if args.mirror else None
+mirror_failures = {}
+blob_store = None
+if args.store:
+    blob_store = BlobStore(config.plagiarism.store_path or Path(config.data_root).resolve() / "plagiarism" / "store")
+
+
+def get_archive(project_id, commit_id, save_path: Path):
+    client.download_archive(project_id, commit_id, save_path)
 
 
 def collect_and_copy_files(src_dir: Path, output_dir: Path, extensions, separator="_"):
@@ -98,57 +128,159 @@ def collect_and_copy_files(src_dir: Path, output_dir: Path, extensions, separato
             # print(f"已拷贝: {filepath} -> {dest_path}")
 
 
-def process_student(teacher, username, name, user_id, project_id):
-    if project_id == "Failed":
-        return
-    try:
-        commit_id = get_latest_commit_id(project_id, BRANCH)
-        archive_path = output_root / "archive" / f"{teacher}-{username}-{name}.zip"
-        get_archive(project_id, commit_id, archive_path)
-        # unzip to output_root / 'unzip' / f"{teacher}-{username}-{name}"
-        with zipfile.ZipFile(archive_path, "r") as zip_ref:
-            zip_ref.extractall(output_root / "unzip")
-        # mv output_root / 'unzip' / f"cp-{username}-{commit_id}-{commit_id}"
-        # to output_root / 'files' / f"{teacher}-{username}-{name}"
-        src_dir = output_root / "unzip" / f"cp-{username}-{commit_id}-{commit_id}"
-        dest_dir = output_root / "unzip" / f"{teacher}-{username}-{name}"
-        shutil.move(src_dir, dest_dir)
-        # collect_and_copy_files
-        # from output_root / 'unzip' / f"{teacher}-{username}-{name}"
-        # to output_root / 'files' / f"{teacher}-{username}-{name}"
-        collect_and_copy_files(
-            dest_dir, output_root / "files" / f"{teacher}-{username}-{name}", exts
-        )
-    except Exception as e:
+def is_collected(rel_path: str, extensions) -> bool:
+    """文件是否参与查重：扩展名在 extensions 中，且路径不含 skip_keywords"""
+    file_name = rel_path.rsplit("/", 1)[-1]
+    if "." not in file_name or file_name.rsplit(".", 1)[1] not in extensions:
+        return False
+    return not any(keyword in rel_path for keyword in config.plagiarism.skip_keywords)
+
+
+def extract_sources(archive_path: Path, output_dir: Path, extensions, separator="_"):
+    """只解压需要查重的文件，直接写为 output_dir 下以 separator 连接路径的文件名
+
+    压缩包内的文件都位于 cp-<username>-<commit>-<commit>/ 目录下，这一层会被去掉。
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(archive_path, "r") as zip_ref:
+        for member in zip_ref.infolist():
+            if member.is_dir() or "/" not in member.filename:
+                continue
+            rel_path = member.filename.split("/", 1)[1]
+            if not is_collected(rel_path, extensions):
+                continue
+            dest_path = output_dir / rel_path.replace("/", separator).replace("\\", separator)
+            assert not dest_path.exists(), f"目标文件 {dest_path} 已存在，源文件: {member.filename}"
+            with zip_ref.open(member) as src, open(dest_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+
+def collected_blobs(project_id, username, commit_id, extensions):
+    """通过目录树得到需要查重的文件，返回 路径 -> blob id 与按一组 blob id 读取内容（blob id -> 内容）的函数
+
+    镜像一次读取全部 blob，部分克隆中缺少的合并为一次 git fetch。
+    """
+    if mirror is not None and username not in mirror_failures:
+        tree = mirror.list_tree(username, commit_id, recursive=True)
+        read_blobs = lambda blob_ids: mirror.read_blobs(username, commit_id, blob_ids)
+    else:
+        tree = client.list_tree(project_id, commit_id, recursive=True)
+        read_blobs = lambda blob_ids: {blob_id: client.get_raw_blob(project_id, blob_id) for blob_id in blob_ids}
+    files = {item['path']: item['id'] for item in tree
+             if item['type'] == 'blob' and is_collected(item['path'], extensions)}
+    return files, read_blobs
+
+
+def fetch_store_blobs(project_id, username, commit_id, key, extensions):
+    """只下载存储中没有的 blob，并记录 (学生, 分支) 的 manifest"""
+    stored = blob_store.get_manifest(BRANCH, key)
+    if stored is not None and stored["commit_id"] == commit_id and stored["project_id"] == str(project_id):
         return
-        print(f"Failed to get repo for {username}: {e}")
+    files, read_blobs = collected_blobs(project_id, username, commit_id, extensions)
+    missing = [blob_id for blob_id in set(files.values()) if not blob_store.has(blob_id)]
+    for blob_id, content in read_blobs(missing).items():
+        blob_store.put(blob_id, content)
+    blob_store.set_manifest(BRANCH, key, project_id, commit_id, files)
 
-if args.download:
-    classes = sorted(data_root.glob("*.csv"))
-    for class_file in classes:
-        teacher, group_id = class_file.stem.split("-")
-        print(teacher, group_id)
-        results = []
-        with class_file.open() as f:
-            lines = f.readlines()
-        total = len(lines)
-        with ThreadPoolExecutor() as executor:
-            future_to_index = {
-                executor.submit(
-                    process_student, teacher2name[teacher], *line.strip().split(",")
-                ): i
-                for i, line in enumerate(lines)
-            }
-            for future in tqdm(as_completed(future_to_index), total=total):
-                i = future_to_index[future]
-                future.result()
-    
-    # collect github repos
-    github_repos_root = Path(config.plagiarism.previous_path).resolve()
-    for repo in github_repos_root.iterdir():
-        collect_and_copy_files(
-            repo, output_root / "files" / repo.name, exts
-        )
+
+def mirror_sources(username, commit_id, files_dir: Path, extensions, separator="_"):
+    """从本地镜像读取需要查重的文件，文件名与 extract_sources 相同"""
+    files, read_blobs = collected_blobs(None, username, commit_id, extensions)
+    blobs = read_blobs(files.values())
+    files_dir.mkdir(parents=True, exist_ok=True)
+    for rel_path, blob_id in files.items():
+        dest_path = files_dir / rel_path.replace("/", separator).replace("\\", separator)
+        assert not dest_path.exists(), f"目标文件 {dest_path} 已存在，源文件: {rel_path}"
+        dest_path.write_bytes(blobs[blob_id])
+
+
+class StageCheckpoints:
+    """流水线各阶段的检查点，保存在 stages.json 中
+
+    阶段完成后记录其结果，之后的运行可以直接使用，从任一阶段继续；
+    重新运行某个阶段时，其后各阶段的检查点随之作废。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.stages = json.loads(path.read_text()) if path.exists() else {}
+
+    def done(self, stage):
+        with self._lock:
+            return self.stages.get(stage, {}).get("done", False)
+
+    def get(self, stage):
+        with self._lock:
+            return dict(self.stages.get(stage, {}).get("data", {}))
+
+    def save(self, stage, data, done=True):
+        with self._lock:
+            self.stages[stage] = {"done": done, "data": data, "updated_at": time.time()}
+            self._write()
+
+    def reset_from(self, stage, keep_partial=False):
+        """作废 stage 及之后各阶段的检查点；keep_partial 时保留 stage 未完成的部分结果"""
+        with self._lock:
+            for later in STAGES[STAGES.index(stage):]:
+                if keep_partial and later == stage and not self.stages.get(stage, {}).get("done", False):
+                    continue
+                self.stages.pop(later, None)
+            self._write()
+
+    def _write(self):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.stages, ensure_ascii=False, indent=2))
+        tmp.replace(self.path)
+
+
+checkpoints = StageCheckpoints(output_root / "stages.json")
+
+
+def fetch_student(teacher, username, name, user_id, project_id):
+    """fetch 阶段：获取分支 head，下载压缩包或缺少的 blob
+
+    返回 (key, 学生信息, 是否需要重新解压)；没有仓库的学生返回 None。
+    """
+    if project_id == "Failed":
+        return None
+    use_mirror = mirror is not None and username not in mirror_failures
+    if use_mirror:
+        commit_id = mirror.resolve(username, BRANCH)
+    else:
+        commit_id = client.get_latest_commit_id(project_id, BRANCH)
+    key = f"{teacher}-{username}-{name}"
+    student = {"username": username, "project_id": str(project_id), "commit_id": commit_id, "mirror": use_mirror}
+    files_dir = output_root / "files" / key
+    if not args.force and manifest.unchanged(key, project_id, commit_id) and files_dir.exists():
+        return key, student, False
+    if blob_store is not None:
+        fetch_store_blobs(project_id, username, commit_id, key, exts)
+    elif not use_mirror:
+        get_archive(project_id, commit_id, output_root / "archive" / f"{key}.zip")
+    return key, student, True
+
+
+def extract_student(key, student):
+    """extract 阶段：把需要查重的文件写入 files/<key>"""
+    files_dir = output_root / "files" / key
+    # head 变化后重新解压，先清理上次（可能未完成）的结果
+    shutil.rmtree(files_dir, ignore_errors=True)
+    if blob_store is not None:
+        blob_store.materialize(blob_store.get_manifest(BRANCH, key)["files"], files_dir)
+    elif student["mirror"]:
+        mirror_sources(student["username"], student["commit_id"], files_dir, exts)
+    else:
+        extract_sources(output_root / "archive" / f"{key}.zip", files_dir, exts)
+    manifest.update(key, student["project_id"], student["commit_id"])
+
+
+def extract_previous(repo: Path):
+    """extract 阶段：拷贝往届仓库；使用 --previous-index 时往届仓库通过指纹索引比较，不再拷贝"""
+    # 重复运行时覆盖上次拷贝的文件
+    shutil.rmtree(output_root / "files" / repo.name, ignore_errors=True)
+    if not args.previous_index:
+        collect_and_copy_files(repo, output_root / "files" / repo.name, exts)
 
 
 def collect_source_files(directory, extensions):
@@ -159,49 +291,372 @@ def collect_source_files(directory, extensions):
     return [str(f) for f in files]
 
 
-base_files = collect_source_files(config.plagiarism.template_path, exts)
-for bf in base_files:
-    moss.addBaseFile(bf)
-
-all_files = collect_source_files(output_root / "files", exts)
-files = []
-for file in tqdm(all_files, desc="Processing files"):
-    if not Path(file).stat().st_size > 0:
-        continue
-    if any(keyword in file for keyword in config.plagiarism.skip_keywords):
+previous_root = Path(config.plagiarism.previous_path).resolve()
+index_path = config.plagiarism.index_path or Path(config.data_root).resolve() / "plagiarism" / "previous.sqlite3"
+
+
+def prefilter_submissions(files_root: Path, top: int | None):
+    """用本地指纹引擎给提交对排序，返回前 top 对中出现的提交名；top 为 None 时只生成报告
+
+    指纹计算使用进程池，放在子进程中运行，避免进程池重新导入本脚本。
+    往届仓库之间的比对结果被忽略。使用 --previous-index 时往届仓库来自持久索引，
+    名称带 previous/ 前缀，与往届文件完全相同的文件另外写入 previous_copies.csv。
+    """
+    report_path = output_root / "fingerprint.csv"
+    cmd = [
+        sys.executable, str(Path(__file__).resolve().parent / "fingerprint.py"),
+        str(files_root),
+        "--base", config.plagiarism.template_path,
+        "--exts", ",".join(exts),
+        "--top", "0",
+        "--output", str(report_path),
+    ]
+    if args.previous_index:
+        cmd += ["--index", str(index_path), "--corpus", str(previous_root),
+                "--copies", str(output_root / "previous_copies.csv")]
+        for keyword in config.plagiarism.skip_keywords:
+            cmd += ["--skip", keyword]
+    subprocess.run(cmd, check=True)
+    if top is None:
+        return None
+    previous = {repo.name for repo in previous_root.iterdir()}
+    suspects = set()
+    pairs = 0
+    with report_path.open() as f:
+        for row in csv.DictReader(f):
+            if row["first"] in previous and row["second"] in previous:
+                continue
+            suspects.update((row["first"], row["second"]))
+            pairs += 1
+            if pairs >= top:
+                break
+    print(f"Prefilter: {len(suspects)} submissions in the top {pairs} pairs, full ranking in {report_path}")
+    return suspects
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_files(files, view_root: Path):
+    """在 view_root/<提交>/ 下建立指向去重后文件的符号链接，供 JPlag 使用"""
+    for file in files:
+        rel_path = Path(file).relative_to(output_root / "files")
+        link = view_root / rel_path
+        link.parent.mkdir(parents=True, exist_ok=True)
+        os.symlink(file, link)
+
+
+def submission_dir(name):
+    """提交名对应的目录，带 previous/ 前缀的是索引中的往届仓库"""
+    if name.startswith(PREVIOUS_PREFIX):
+        return previous_root / name[len(PREVIOUS_PREFIX):]
+    return output_root / "files" / name
+
+
+def link_submissions(names, view_root: Path):
+    """在 view_root 下建立指向所选提交目录的符号链接，供 JPlag 使用"""
+    shutil.rmtree(view_root, ignore_errors=True)
+    view_root.mkdir(parents=True)
+    for name in names:
+        os.symlink(submission_dir(name), view_root / name.replace("/", "-"), target_is_directory=True)
+
+
+def filter_submission(key, base_hashes):
+    """filter 阶段：去掉空文件、路径含 skip_keywords 的文件与模板原样文件，返回 [[文件, sha256]]"""
+    candidates = []
+    for file in sorted(collect_source_files(output_root / "files" / key, exts)):
+        if not Path(file).stat().st_size > 0:
+            continue
+        if any(keyword in file for keyword in config.plagiarism.skip_keywords):
+            continue
+        if not Path(file).name.startswith("src"):
+            print(file)
+        digest = file_sha256(file)
+        if not args.keep_duplicates and digest in base_hashes:
+            continue
+        candidates.append([file, digest])
+    return candidates
+
+
+def shared_counts(candidates):
+    """sha256 -> 含有该内容的提交数"""
+    counts = {}
+    for key in candidates:
+        for digest in {digest for _, digest in candidates[key]}:
+            counts[digest] = counts.get(digest, 0) + 1
+    return counts
+
+
+def is_kept(digest, seen, counts):
+    """提交内重复的文件只保留一份；超过 MOSS_IGNORE_LIMIT 份提交共有的文件视为公共代码，整组去掉
+
+    少数几份提交之间完全相同的文件正是抄袭最直接的证据，每份提交各保留一份，照常出现在 MOSS/JPlag 报告中。
+    """
+    return digest not in seen and counts[digest] <= MOSS_IGNORE_LIMIT
+
+
+def write_duplicates(candidates):
+    """内容相同的文件按 sha256 分组写入 duplicates.csv，完整抄袭的文件在这里就能看到"""
+    counts = shared_counts(candidates)
+    groups = {}
+    for key in sorted(candidates):
+        for file, digest in candidates[key]:
+            groups.setdefault(digest, []).append((key, file))
+    report_path = output_root / "duplicates.csv"
+    dropped = 0
+    with report_path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sha256", "count", "submissions", "kept", "file"])
+        for digest, group in groups.items():
+            if len(group) < 2:
+                continue
+            seen = {}
+            for key, file in group:
+                kept = is_kept(digest, seen.setdefault(key, set()), counts)
+                seen[key].add(digest)
+                dropped += not kept
+                writer.writerow([digest, len(group), counts[digest], int(kept),
+                                 str(Path(file).relative_to(output_root / "files"))])
+    print(f"Filter: {sum(map(len, candidates.values()))} files, {dropped} repeated or widely shared files dropped, "
+          f"groups listed in {report_path}")
+
+
+def select_files(candidates, suspects):
+    """预筛选后剩下的文件，按 is_kept 去掉提交内的重复文件与公共代码（--keep-duplicates 时全部保留）"""
+    counts = shared_counts(candidates)
+    files = []
+    for key in sorted(candidates):
+        if suspects is not None and key not in suspects:
+            continue
+        seen = set()
+        for file, digest in candidates[key]:
+            if not args.keep_duplicates and not is_kept(digest, seen, counts):
+                continue
+            seen.add(digest)
+            files.append(file)
+    return files
+
+
+def run_moss(files, suspects):
+    """上传到 MOSS 并下载报告，返回报告地址"""
+    moss = mosspy.Moss(MOSS_USER_ID, "cc")
+    base_files = collect_source_files(config.plagiarism.template_path, exts)
+    for bf in base_files:
+        moss.addBaseFile(bf)
+    uploads = list(files)
+    for file in files:
+        moss.addFile(file, display_name=str(Path(file).relative_to(output_root / "files")))
+    # 预筛选选中的往届仓库直接从 previous_path 上传
+    for name in sorted(suspects or ()):
+        if not name.startswith(PREVIOUS_PREFIX):
+            continue
+        for file in collect_source_files(submission_dir(name), exts):
+            if any(keyword in file for keyword in config.plagiarism.skip_keywords) or not Path(file).stat().st_size > 0:
+                continue
+            moss.addFile(file, display_name=f"{name}/{Path(file).relative_to(submission_dir(name))}")
+            uploads.append(file)
+
+    moss.setDirectoryMode(1)
+    moss.setIgnoreLimit(MOSS_IGNORE_LIMIT)
+    bar = tqdm(total=len(uploads) + len(base_files), desc="Uploading files")
+    url = moss.send(lambda file_path, display_name: bar.update(1))
+    bar.close()
+    print(f"Report Url: {url}")
+
+    # send 返回时报告已经生成，可以直接下载
+    moss.saveWebPage(url, output_root / "moss.html")
+    mosspy.download_report(url, output_root / "moss_report", connections=8, log_level=10, on_read=lambda url: print('*', end='', flush=True))
+    return url
+
+
+def run_jplag(files, suspects):
+    """在与 MOSS 相同的文件上运行 JPlag，返回结果路径"""
+    jplag_root = output_root / "files"
+    if not args.keep_duplicates:
+        # JPlag 与 MOSS 使用相同的去重结果，预筛选选中的往届仓库整体链接
+        jplag_root = output_root / "unique"
+        link_submissions([name for name in suspects or () if name.startswith(PREVIOUS_PREFIX)], jplag_root)
+        link_files(files, jplag_root)
+    elif suspects is not None:
+        jplag_root = output_root / "suspects"
+        link_submissions(suspects, jplag_root)
+
+    result_path = output_root / "jplag.zip"
+    cmd = [
+        "java", "-jar", config.plagiarism.jplag_path,
+        "-l", "cpp",
+        "-r", str(result_path),
+        '-bc', config.plagiarism.template_path,
+        str(jplag_root),
+    ]
+    subprocess.run(cmd, check=True)
+    return str(result_path)
+
+
+def load_students():
+    """读取 data_root/repo/*.csv，返回 [(老师姓名, username, name, user_id, project_id)]"""
+    students = []
+    for class_file in sorted(data_root.glob("*.csv")):
+        teacher, group_id = class_file.stem.split("-")
+        with class_file.open() as f:
+            rows = [fill_roster_line(identity_cache, line, f"{config.repo.group}/{teacher}") for line in f if line.strip()]
+        if mirror is not None:
+            # 镜像更新失败的学生回退到 REST
+            failures = mirror.update_all(
+                [(row[0], f"{config.repo.group}/{teacher}/cp-{row[0]}", row[3]) for row in rows if row[3] != "Failed"],
+                config.mirror.workers or DEFAULT_WORKERS)
+            for username, error in failures.items():
+                print(f"Failed to update mirror of cp-{username}, using REST: {error}")
+            mirror_failures.update(failures)
+        students.extend((teacher2name[teacher], *row) for row in rows)
+    return students
+
+
+def run_sources(start):
+    """fetch、extract、filter 三个阶段
+
+    三个阶段使用各自的线程池：一个学生下载完成后立即解压，解压完成后立即过滤，
+    不必等待其他学生，总耗时接近最慢的阶段。返回 key -> [[文件, sha256]]。
+    """
+    base_hashes = set()
+    if not args.keep_duplicates:
+        base_hashes = {file_sha256(file) for file in collect_source_files(config.plagiarism.template_path, exts)}
+    fetch_pool = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS)
+    extract_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    filter_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    tasks = {}
+    fetched = {}
+    candidates = {}
+    failures = 0
+
+    def submit(pool, stage, key, fn, *fn_args):
+        tasks[pool.submit(fn, *fn_args)] = (stage, key)
+
+    if start == "fetch":
+        for teacher, username, name, user_id, project_id in load_students():
+            submit(fetch_pool, "fetch", f"{teacher}-{username}-{name}", fetch_student,
+                   teacher, username, name, user_id, project_id)
+    elif start == "extract":
+        fetched = checkpoints.get("fetch")["students"]
+        for key, student in fetched.items():
+            submit(extract_pool, "extract", key, extract_student, key, student)
+    elif (output_root / "files").exists():
+        for directory in sorted((output_root / "files").iterdir()):
+            submit(filter_pool, "filter", directory.name, filter_submission, directory.name, base_hashes)
+    if start in ("fetch", "extract"):
+        for repo in sorted(previous_root.iterdir()):
+            submit(extract_pool, "extract", repo.name, extract_previous, repo)
+
+    bar = tqdm(total=len(tasks), desc="Fetching, extracting and filtering")
+    while tasks:
+        done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, key = tasks.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Failed to {stage} {key}: {e}")
+                failures += 1
+                if stage == "fetch" and (output_root / "files" / key).exists():
+                    # 使用上次下载的文件
+                    submit(filter_pool, "filter", key, filter_submission, key, base_hashes)
+                    continue
+                bar.update(1)
+                continue
+            if stage == "fetch":
+                if result is None:
+                    bar.update(1)
+                    continue
+                key, student, changed = result
+                fetched[key] = student
+                if changed:
+                    submit(extract_pool, "extract", key, extract_student, key, student)
+                    continue
+                stage = "extract"
+            if stage == "extract":
+                if not (output_root / "files" / key).exists():
+                    bar.update(1)
+                    continue
+                submit(filter_pool, "filter", key, filter_submission, key, base_hashes)
+                continue
+            candidates[key] = result
+            bar.update(1)
+    bar.close()
+    for pool in (fetch_pool, extract_pool, filter_pool):
+        pool.shutdown()
+
+    if start == "fetch":
+        checkpoints.save("fetch", {"students": fetched})
+    if start in ("fetch", "extract"):
+        checkpoints.save("extract", {})
+    if failures:
+        print(f"{failures} submissions failed, rerun to retry them")
+    write_duplicates(candidates)
+    checkpoints.save("filter", {"candidates": candidates})
+    return candidates
+
+
+def run_fingerprint():
+    """fingerprint 阶段：使用 --prefilter 或 --previous-index 时运行本地指纹引擎，返回预筛选选中的提交名"""
+    suspects = None
+    if args.prefilter or args.previous_index:
+        suspects = prefilter_submissions(output_root / "files", args.prefilter)
+    suspects = sorted(suspects) if suspects is not None else None
+    checkpoints.save("fingerprint", {"suspects": suspects})
+    return suspects
+
+
+def run_compare(candidates, suspects):
+    """compare 阶段：MOSS 与 JPlag 同时运行，已完成的一方在重试时跳过"""
+    results = checkpoints.get("compare")
+    suspects = set(suspects) if suspects is not None else None
+    files = select_files(candidates, suspects)
+    tools = {"moss": run_moss, "jplag": run_jplag}
+    with ThreadPoolExecutor(max_workers=len(tools)) as executor:
+        futures = {executor.submit(fn, files, suspects): tool for tool, fn in tools.items() if tool not in results}
+        for future in as_completed(futures):
+            tool = futures[future]
+            try:
+                results[tool] = future.result()
+            except Exception as e:
+                print(f"{tool} failed: {e!r}")
+            checkpoints.save("compare", results, done=len(results) == len(tools))
+    for tool, result in results.items():
+        print(f"{tool}: {result}")
+    return results
+
+
+def first_pending_stage():
+    """未指定 --from-stage 时：-d 从 fetch 开始，否则从已有文件之后第一个未完成的阶段继续"""
+    if args.download:
+        return "fetch"
+    for stage in STAGES[STAGES.index("filter"):]:
+        if not checkpoints.done(stage):
+            return stage
+    return "filter"
+
+
+start = args.from_stage or first_pending_stage()
+for stage in STAGES[:STAGES.index(start)]:
+    if stage in ("fetch", "extract") and start != "extract":
         continue
-    if not Path(file).name.startswith("src"):
-        print(file)
-    
-    files.append(file)
-    
-# files = [f for f in files if Path(f).stat().st_size > 0 and ".tab" not in f]
-# files = [str(Path(f).relative_to(output_root / "files")) for f in files if Path(f).stat().st_size > 0]
-for file in files:
-    moss.addFile(file, display_name=str(Path(file).relative_to(output_root / "files")))
-
-moss.setDirectoryMode(1)
-moss.setIgnoreLimit(20)
-bar = tqdm(total=len(files) + len(base_files), desc="Uploading files")
-url = moss.send(lambda file_path, display_name: bar.update(1))
-bar.close()
-print()
-
-print(f"Report Url: {url}")
-
-wait = input("Press Enter to continue...")
-
-moss.saveWebPage(url, output_root / "moss.html")
-
-mosspy.download_report(url, output_root / "moss_report", connections=8, log_level=10, on_read=lambda url: print('*', end='', flush=True)) 
-
-wait = input("Press Enter to continue...")
-
-cmd = [
-    "java", "-jar", config.plagiarism.jplag_path,
-    "-l", "cpp",
-    "-r", str(output_root / "jplag.zip"),
-    '-bc', config.plagiarism.template_path,
-    str(output_root / "unzip"),
-]
-subprocess.run(cmd, check=True)
\ No newline at end of file
+    assert checkpoints.done(stage), f"Stage {stage} has not finished yet, run with --from-stage {stage}"
+checkpoints.reset_from(start, keep_partial=args.from_stage is None)
+print(f"Starting from stage {start}")
+
+if STAGES.index(start) <= STAGES.index("filter"):
+    candidates = run_sources(start)
+else:
+    candidates = checkpoints.get("filter")["candidates"]
+
+if STAGES.index(start) <= STAGES.index("fingerprint"):
+    suspects = run_fingerprint()
+else:
+    suspects = checkpoints.get("fingerprint")["suspects"]
+
+run_compare(candidates, suspects)
@@ -1,148 +1,294 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta
 from pathlib import Path
+import threading
 import time
-import requests
-import re
 from tqdm import tqdm
 from argparse import ArgumentParser
 import yaml
 from addict import Dict
+from identity_cache import IdentityCache, fill_roster_line
+from gitlab_client import GitLabClient, DEFAULT_WORKERS
+from grading_cache import GradingCache
+from scoring import TEST_MARKER, extract_score_from_trace, is_timeout
 
 parser = ArgumentParser()
 parser.add_argument("branch", type=str, help="The branch name to retry jobs from")
 parser.add_argument("start_time", type=str, help="The start time to filter jobs (format: YYYY-MM-DD HH:MM:SS UTC+8)")
 parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
+parser.add_argument("--poll-interval", type=float, default=5, help="Seconds between status checks of retried jobs")
+parser.add_argument("--poll-batch", type=int, default=50, help="Number of retried jobs checked per GraphQL query")
+parser.add_argument("--queue-depth", type=int, help="Max pending/running jobs on the runners at once (default: ci.queue_depth)")
+parser.add_argument("--queue-refresh", type=float,
+                    help="Seconds between full scans of the group's and runners' jobs (default: ci.queue_refresh, or 6 poll intervals)")
 args = parser.parse_args()
 
 with open(args.config, "r") as f:
     config = Dict(yaml.safe_load(f))
 
-GITLAB_URL = config.gitlab.url
-PRIVATE_TOKEN = config.gitlab.token
-
 BRANCH = args.branch
 START_TIME = datetime.strptime(args.start_time, "%Y-%m-%d %H:%M:%S")    # 2021-06-01 00:00:00 UTC+8
 
+identity_cache = IdentityCache.from_settings(config.identity_cache)
+grading_cache = GradingCache.from_settings(
+    config.grading_cache, Path(config.data_root).resolve() / "grading.sqlite3")
+
+client = GitLabClient.from_config(config, pool_size=DEFAULT_WORKERS)
+
+# 同时在 Runner 上排队或运行的 Job 数上限，以及用来读取负载的 Runner
+QUEUE_DEPTH = args.queue_depth or config.ci.queue_depth or 8
+RUNNER_IDS = config.ci.runner_ids or []
+# 统计排队中的 Job 的组，默认为学生仓库所在的组
+QUEUE_GROUP = config.ci.queue_group or config.repo.group
+# 扫描整个组需要按 20 个项目一页翻页，结果缓存若干个轮询周期
+QUEUE_REFRESH = args.queue_refresh or config.ci.queue_refresh or 6 * args.poll_interval
+
 # 获取项目ID
 def get_project_id(project_path):
-    url = f"{GITLAB_URL}/projects/{requests.utils.quote(project_path, safe='')}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get project information: {response.status_code}"
-    project_info = response.json()
+    project_id = identity_cache.get_project_id(project_path)
+    if project_id is not None:
+        return project_id
+
+    project_info = client.get_project(project_path)
+    identity_cache.set_project(project_path, project_info['id'], project_info.get('default_branch'))
     return project_info['id']
 
+# Job 进入这些状态后不会再变化
+FINISHED_STATUSES = ('success', 'failed', 'canceled', 'skipped')
+
+
+class JobPoller:
+    """集中轮询所有重跑中的 Job
+
+    后台线程每隔 interval 秒用一次 GraphQL 查询（每个 Job 一个别名）检查最多 batch_size 个 Job，
+    Job 结束时完成 watch() 返回的 Future；GraphQL 查询失败时改为逐个调用 get_job。
+    """
+
+    def __init__(self, interval=5, batch_size=50):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._jobs = {}  # job_id -> (project_id, project_path, Future)
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def watching(self):
+        """返回尚未结束的 Job id 集合"""
+        with self._cond:
+            return set(self._jobs)
+
+    def watch(self, project_id, project_path, job_id):
+        """登记一个 Job，返回在 Job 结束时以其状态为结果的 Future"""
+        future = Future()
+        with self._cond:
+            self._jobs[job_id] = (project_id, project_path, future)
+            self._cond.notify()
+        return future
 
-# 获取仓库分支的最新 commit id
-def get_latest_commit_id(project_id, branch):
-    url = f"{GITLAB_URL}/projects/{project_id}/repository/branches/{branch}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get branch information: {response.status_code}"
-    branch_info = response.json()
-    return branch_info['commit']['id']
-
-
-# 获取某个提交关联的最新 Pipeline
-def get_latest_pipeline(project_id, commit_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/pipelines"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    params = {"sha": commit_id, "ref": BRANCH}
-    
-    response = requests.get(url, headers=headers, params=params)
-    assert response.status_code == 200 and response.json(), f"Failed to get pipelines: {response.status_code}"
-    pipeline_info = response.json()[0]  # 获取最新的pipeline
-    return pipeline_info['id'], pipeline_info['status']
-
-
-# 获取 Pipeline 对应的 Jobs 状态
-def get_pipeline_jobs(project_id, pipeline_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/pipelines/{pipeline_id}/jobs"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get jobs information: {response.status_code}"
-    return response.json()
-
-def retry_pipeline_job(project_id, job_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/jobs/{job_id}/retry"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.post(url, headers=headers)
-    assert response.status_code == 201, f"Failed to retry job: {response.status_code}"
-    return response.json()
-
-def get_job(project_id, job_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/jobs/{job_id}"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-    
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get job information: {response.status_code}"
-    return response.json()
-
-
-
-def get_job_trace(project_id, job_id):
-    url = f"{GITLAB_URL}/projects/{project_id}/jobs/{job_id}/trace"
-    headers = {"PRIVATE-TOKEN": PRIVATE_TOKEN}
-
-    response = requests.get(url, headers=headers)
-    assert response.status_code == 200, f"Failed to get job trace: {response.status_code}"
-    return response.text
-
-def extract_score_from_trace(trace):
-    trace = trace.split("$ python3 sp25-tests/test.py $CI_COMMIT_REF_NAME .")[-1]
-    # print(trace)
-
-    assert f"Running {BRANCH} test..." in trace, "No test found"
-    
-    # ... Test score: 100.00 ...
-    score = re.search(r"Test score: (\d+\.\d+)", trace)
-    assert score, "No score found"
-    
-    return float(score.group(1))
-
-def retry(username, name, user_id, project_id):
-    commit_id = get_latest_commit_id(project_id, BRANCH)
-    pipeline_id, pipeline_status = get_latest_pipeline(project_id, commit_id)
-    jobs = get_pipeline_jobs(project_id, pipeline_id)
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+            # 与逐个轮询时相同，先等待一个间隔再检查
+            time.sleep(self.interval)
+            with self._cond:
+                items = list(self._jobs.items())
+            for i in range(0, len(items), self.batch_size):
+                batch = items[i:i + self.batch_size]
+                try:
+                    statuses = self._poll_graphql(batch)
+                except Exception as e:
+                    print(f"Failed to poll jobs via GraphQL, falling back to REST: {e}")
+                    statuses = {}
+                for job_id, (project_id, project_path, future) in batch:
+                    try:
+                        status = statuses.get(job_id) or client.get_job(project_id, job_id)['status']
+                    except Exception as e:
+                        print(f"Failed to poll job {job_id}: {e}")
+                        continue
+                    if status in FINISHED_STATUSES:
+                        with self._cond:
+                            self._jobs.pop(job_id, None)
+                        future.set_result(status)
+
+    def _poll_graphql(self, batch):
+        """返回 job_id -> 小写状态，查不到的 Job 不出现在结果中"""
+        params = []
+        fields = []
+        variables = {}
+        for i, (job_id, (project_id, project_path, future)) in enumerate(batch):
+            params.append(f"$p{i}: ID!, $j{i}: JobID!")
+            fields.append(f"j{i}: project(fullPath: $p{i}) {{ job(id: $j{i}) {{ status }} }}")
+            variables[f"p{i}"] = project_path
+            variables[f"j{i}"] = f"gid://gitlab/Ci::Build/{job_id}"
+        data = client.graphql(f"query({', '.join(params)}) {{ {' '.join(fields)} }}", variables)
+        statuses = {}
+        for i, (job_id, _) in enumerate(batch):
+            job = (data.get(f"j{i}") or {}).get("job")
+            if job and job.get("status"):
+                statuses[job_id] = job["status"].lower()
+        return statuses
+
+
+poller = JobPoller(interval=args.poll_interval, batch_size=args.poll_batch)
+
+
+def check_retry(username, name, user_id, project_id, project_path):
+    """判断学生最新的 Job 是否需要重跑，需要时返回重跑所需的信息，否则返回 None"""
+    commit_id = client.get_latest_commit_id(project_id, BRANCH)
+    pipeline = client.get_latest_pipeline(project_id, commit_id, BRANCH)
+    jobs = client.get_pipeline_jobs(project_id, pipeline['id'])
     assert jobs, "No jobs found"
     job = jobs[0]
-    origin_trace = get_job_trace(project_id, job["id"])
-    origin_score = extract_score_from_trace(origin_trace)
+    origin_trace = client.get_job_trace_tail(project_id, job["id"], TEST_MARKER)
+    origin_score = extract_score_from_trace(origin_trace, BRANCH)
     if origin_score != 100:
         print(f"Score is not 100, skip retry for {username} {name}")
-        return
+        return None
     job_created_at = datetime.strptime(job['created_at'], "%Y-%m-%dT%H:%M:%S.%fZ")  # UTC+00:00
     if job_created_at < START_TIME - timedelta(hours=8) or job['status'] not in ['success', 'failed']:
-        # retry job
-        retried_job = retry_pipeline_job(project_id, job['id'])
-        print(f"Retried job {retried_job['id']} for {username} {name}")
-        
-        # wait for job to finish
-        while True:
-            new_job = get_job(project_id, retried_job['id'])
-            if new_job['status'] in ['success', 'failed']:
-                break
-            time.sleep(5)
-        
-        new_trace = get_job_trace(project_id, retried_job['id'])
-        new_score = extract_score_from_trace(new_trace)
-        
-        print(f"Score changed from {origin_score} to {new_score} for {username} {name}")
-
-def process_student(username, name, user_id, project_id):
+        return {
+            'username': username,
+            'name': name,
+            'project_id': project_id,
+            'project_path': project_path,
+            'job_id': job['id'],
+            'job_created_at': job_created_at,
+            'origin_score': origin_score,
+            'timeout': is_timeout(job, origin_trace),
+        }
+    return None
+
+def retry(candidate):
+    """重跑 Job 并交给 poller 等待，返回 Job 结束时完成的 Future"""
+    retried_job = client.retry_job(candidate['project_id'], candidate['job_id'])
+    # 重跑后同一提交的成绩可能变化，get_score.py 需要重新评分
+    grading_cache.invalidate(candidate['project_id'], BRANCH)
+    print(f"Retried job {retried_job['id']} for {candidate['username']} {candidate['name']}")
+    candidate['retried_job_id'] = retried_job['id']
+    return poller.watch(candidate['project_id'], candidate['project_path'], retried_job['id'])
+
+def report_retried_job(candidate):
+    username, name = candidate['username'], candidate['name']
+    try:
+        new_trace = client.get_job_trace_tail(candidate['project_id'], candidate['retried_job_id'], TEST_MARKER)
+        new_score = extract_score_from_trace(new_trace, BRANCH)
+        print(f"Score changed from {candidate['origin_score']} to {new_score} for {username} {name}")
+    except Exception as e:
+        print(f"Failed to process {username} {name}: {e}")
+
+def process_student(username, name, user_id, project_id, namespace):
     try:
-        retry(username, name, user_id, project_id)
+        return check_retry(username, name, user_id, project_id, f"{namespace}/cp-{username}")
     except Exception as e:
         print(f"Failed to process {username} {name}: {e}")
-    
-data_root = Path("/Users/peipei/Documents/3-春夏/CP/sp25/scripts/repo")
+        return None
+
+
+ACTIVE_JOBS_QUERY = """
+query($group: ID!, $after: String) {
+  group(fullPath: $group) {
+    projects(includeSubgroups: true, first: 20, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { jobs(statuses: [PENDING, RUNNING], first: 100) { nodes { id } } }
+    }
+  }
+}
+"""
+
+
+def group_active_jobs():
+    """课程组所有项目中排队（pending）与运行中的 Job，翻页取完全部项目
+
+    Runner 的接口看不到尚未分配的 pending Job，排队的 Job 只能从项目一侧读取。
+    """
+    jobs = set()
+    after = None
+    while True:
+        data = client.graphql(ACTIVE_JOBS_QUERY, {"group": QUEUE_GROUP, "after": after})
+        projects = data["group"]["projects"]
+        for project in projects["nodes"]:
+            jobs.update(int(job["id"].rsplit("/", 1)[-1]) for job in project["jobs"]["nodes"])
+        if not projects["pageInfo"]["hasNextPage"]:
+            return jobs
+        after = projects["pageInfo"]["endCursor"]
+
+
+class ExternalLoad:
+    """课程组中排队或运行中的 Job，以及 ci.runner_ids 中 Runner 正在运行的 Job
+
+    每次扫描要翻遍组内所有项目，结果缓存 ttl 秒；本脚本重跑的 Job 由 JobPoller 实时跟踪，不依赖这里。
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._jobs = set()
+        self._expires = 0.0
+
+    def jobs(self):
+        if time.monotonic() >= self._expires:
+            self._jobs = self._scan()
+            self._expires = time.monotonic() + self.ttl
+        return self._jobs
+
+    def _scan(self):
+        jobs = set()
+        try:
+            jobs |= group_active_jobs()
+        except Exception as e:
+            print(f"Failed to get pending jobs of {QUEUE_GROUP}: {e}")
+        for runner_id in RUNNER_IDS:
+            try:
+                jobs.update(job['id'] for job in client.list_runner_jobs(runner_id, status='running'))
+            except Exception as e:
+                print(f"Failed to get jobs of runner {runner_id}: {e}")
+        return jobs
+
+
+external_load = ExternalLoad(QUEUE_REFRESH)
+
+
+def queue_depth():
+    """Runner 的排队深度：本脚本重跑后尚未结束的 Job 与缓存的其他 Job，按 Job ID 去重"""
+    return len(poller.watching() | external_load.jobs())
+
+def retry_priority(candidate):
+    # 超时（failure_reason 或日志中的 Timeout）的最可能是被挤占导致的，优先重跑；其余按 Job 创建时间从早到晚
+    return (not candidate['timeout'], candidate['job_created_at'])
+
+def schedule_retries(candidates):
+    """按优先级逐步放出重跑，保持 Runner 排队深度不超过 QUEUE_DEPTH；Job 结束一个处理一个"""
+    pending = sorted(candidates, key=retry_priority)
+    waiting = {}  # Future -> candidate
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor, tqdm(total=len(pending)) as progress:
+        reports = []
+        while pending or waiting:
+            for future in [future for future in waiting if future.done()]:
+                reports.append(executor.submit(report_retried_job, waiting.pop(future)))
+                progress.update()
+            if pending:
+                free = QUEUE_DEPTH - queue_depth()
+                while pending and free > 0:
+                    candidate = pending.pop(0)
+                    try:
+                        waiting[retry(candidate)] = candidate
+                        free -= 1
+                    except Exception as e:
+                        print(f"Failed to retry job for {candidate['username']} {candidate['name']}: {e}")
+                        progress.update()
+            if waiting:
+                wait(waiting, timeout=args.poll_interval, return_when=FIRST_COMPLETED)
+            elif pending:
+                time.sleep(args.poll_interval)
+        for report in reports:
+            report.result()
+
+
+data_root = Path(config.data_root).resolve() / "repo"
 
 classes = sorted(data_root.glob("*.csv"))
+candidates = []
 for class_file in classes:
     teacher, group_id = class_file.stem.split("-")
     print(teacher, group_id)
@@ -151,10 +297,16 @@ for class_file in classes:
         lines = f.readlines()
     total = len(lines)
     failed = 0
-    with ThreadPoolExecutor() as executor:
-        future_to_index = {executor.submit(process_student, *line.strip().split(",")): i for i, line in enumerate(lines)}
-        results_indexed = {}
-        for future in tqdm(as_completed(future_to_index), total=total):
-            i = future_to_index[future]
-            results_indexed[i] = future.result()
-    print(f"Total: {total}, Failed: {failed} ({failed/total:.2%})")
\ No newline at end of file
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor:
+        namespace = f"{config.repo.group}/{teacher}"
+        futures = [executor.submit(process_student, *fill_roster_line(identity_cache, line, namespace), namespace)
+                   for line in lines]
+        for future in tqdm(as_completed(futures), total=total):
+            candidate = future.result()
+            if candidate is not None:
+                candidates.append(candidate)
+    print(f"Total: {total}, Failed: {failed} ({failed/total:.2%})")
+
+# 所有学生检查完之后再按 Runner 的负载逐步重跑
+print(f"Retrying {len(candidates)} jobs, {sum(c['timeout'] for c in candidates)} with Timeout, queue depth {QUEUE_DEPTH}")
+schedule_retries(candidates)
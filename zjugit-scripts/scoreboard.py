@@ -0,0 +1,304 @@
+"""实时成绩榜
+
+接收课程组的 Pipeline / Job Webhook（Settings -> Webhooks，勾选 Pipeline events 与 Job events，
+URL 填 http://<host>:<port>/hook，Secret token 与 scoreboard.secret_token 一致），
+在 Job 结束后用与 get_score.py 相同的规则从日志中提取成绩，维护每个实验的成绩表。
+
+    python scoreboard.py                          # 启动服务
+    python scoreboard.py --record hooks.jsonl     # 启动服务并记录收到的 Webhook
+    python scoreboard.py --replay hooks.jsonl     # 把记录的 Webhook 重放到正在运行的服务
+
+查询：
+    GET /scores              各实验已记录的成绩数
+    GET /scores/<lab>        JSON，username -> 成绩记录
+    GET /scores/<lab>.csv    与 get_score.py 输出相同格式的 CSV
+
+Webhook 的处理逻辑在 HookProcessor 中，只通过 client 的 get_job_trace_tail / get_pipeline 访问 GitLab，
+tests/test_scoreboard.py 用记录的 Webhook 与日志替换 client 进行测试。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import hmac
+import json
+import threading
+import time
+from argparse import ArgumentParser
+import requests
+import yaml
+from addict import Dict
+from identity_cache import IdentityCache, fill_roster_line
+from gitlab_client import GitLabClient, DEFAULT_WORKERS
+from scoring import TEST_MARKER, extract_score_from_trace, late_score
+
+# 只有结束的 Job 才有完整日志
+FINISHED_STATUSES = ('success', 'failed')
+
+
+def replay(path, url, secret_token=None):
+    """按顺序重放记录的 Webhook"""
+    with open(path) as f:
+        hooks = [json.loads(line) for line in f if line.strip()]
+    headers = {"X-Gitlab-Token": secret_token} if secret_token else {}
+    for hook in hooks:
+        response = requests.post(f"{url}/hook", json=hook["payload"],
+                                 headers={**headers, "X-Gitlab-Event": hook["event"]})
+        print(f"{hook['event']}: {response.status_code} {response.text}")
+
+
+def load_roster(config, identity_cache):
+    """读取 data_root/repo/*.csv，返回 [(username, name, user_id, project_id)]，保持文件中的顺序"""
+    roster = []
+    for class_file in sorted((Path(config.data_root).resolve() / "repo").glob("*.csv")):
+        teacher, group_id = class_file.stem.split("-")
+        with class_file.open() as f:
+            roster.extend(fill_roster_line(identity_cache, line, f"{config.repo.group}/{teacher}")
+                          for line in f if line.strip())
+    return roster
+
+
+class Scoreboard:
+    """每个实验一张成绩表，每个学生只保留最新 Pipeline 中最新 Job 的成绩
+
+    成绩表保存在 JSON 文件中，服务重启后继续使用。
+    """
+
+    def __init__(self, path, ddl):
+        self.path = Path(path)
+        self.ddl = ddl
+        self._lock = threading.Lock()
+        self.labs = {}
+        if self.path.exists():
+            self.labs = json.loads(self.path.read_text())
+
+    def has_job(self, lab, username, job_id):
+        with self._lock:
+            record = self.labs.get(lab, {}).get(username)
+            return record is not None and record['job_id'] == job_id
+
+    def update(self, lab, username, record):
+        """记录成绩；比已有记录旧的 Pipeline / Job 被忽略，返回是否更新"""
+        with self._lock:
+            table = self.labs.setdefault(lab, {})
+            current = table.get(username)
+            if current is not None and (current['pipeline_id'], current['job_id']) > (record['pipeline_id'], record['job_id']):
+                return False
+            table[username] = record
+            self._save()
+            return True
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.labs, ensure_ascii=False, indent=2))
+        tmp.replace(self.path)
+
+    def summary(self):
+        with self._lock:
+            return {lab: len(table) for lab, table in self.labs.items()}
+
+    def table(self, lab):
+        """返回 username -> 成绩记录，result 为按当前 ddl 计算迟交扣分后的成绩"""
+        with self._lock:
+            table = {username: dict(record) for username, record in self.labs.get(lab, {}).items()}
+        for record in table.values():
+            if record['score'] is None:
+                record['result'] = "Failed"
+            else:
+                record['result'] = late_score(record['score'], record['created_at'], self.ddl[lab])
+        return table
+
+
+class HookProcessor:
+    """把 Pipeline / Job Webhook 转换为成绩记录
+
+    client 只需提供 get_job_trace_tail 与 get_pipeline，测试时可以用记录的日志代替 GitLab。
+    """
+
+    def __init__(self, config, board, client):
+        self.config = config
+        self.board = board
+        self.client = client
+        self.handlers = {
+            'build': self.handle_job_hook,
+            'pipeline': self.handle_pipeline_hook,
+        }
+
+    def student_of(self, project_path):
+        """由仓库路径 <group>/<teacher>/cp-<username> 得到学号，不是学生仓库时返回 None"""
+        if not project_path or not project_path.startswith(f"{self.config.repo.group}/"):
+            return None
+        repo_name = project_path.rsplit("/", 1)[-1]
+        if not repo_name.startswith("cp-"):
+            return None
+        return repo_name[len("cp-"):]
+
+    def score_job(self, project_id, project_path, lab, pipeline_id, job_id, commit_id, created_at=None):
+        username = self.student_of(project_path)
+        if username is None or self.board.has_job(lab, username, job_id):
+            return
+        if created_at is None:
+            # 迟交按 Pipeline 创建时间计算，与 get_score.py 一致；Job Webhook 中没有这一项
+            created_at = self.client.get_pipeline(project_id, pipeline_id)['created_at']
+        record = {
+            'project_id': project_id,
+            'pipeline_id': pipeline_id,
+            'job_id': job_id,
+            'commit_id': commit_id,
+            'created_at': created_at,
+            'score': None,
+            'error': None,
+            'updated_at': time.time(),
+        }
+        try:
+            trace = self.client.get_job_trace_tail(project_id, job_id, TEST_MARKER)
+            record['score'] = extract_score_from_trace(trace, lab)
+        except Exception as e:
+            record['error'] = str(e)
+        if self.board.update(lab, username, record):
+            result = record['score'] if record['error'] is None else f"Failed ({record['error']})"
+            print(f"{lab} cp-{username}: {result} (job {job_id})")
+
+    def handle_job_hook(self, payload):
+        lab = payload['ref']
+        if lab not in self.config.ddl or payload['build_status'] not in FINISHED_STATUSES:
+            return
+        self.score_job(payload['project_id'], payload['project']['path_with_namespace'], lab,
+                       payload['pipeline_id'], payload['build_id'], payload['sha'])
+
+    def handle_pipeline_hook(self, payload):
+        pipeline = payload['object_attributes']
+        lab = pipeline['ref']
+        if lab not in self.config.ddl:
+            return
+        builds = [build for build in payload.get('builds') or [] if build['status'] in FINISHED_STATUSES]
+        if not builds:
+            return
+        # 与 get_score.py 相同，取 Pipeline 中最新的 Job
+        build = max(builds, key=lambda build: build['id'])
+        self.score_job(payload['project']['id'], payload['project']['path_with_namespace'], lab,
+                       pipeline['id'], build['id'], pipeline['sha'], pipeline['created_at'])
+
+    def accepts(self, payload):
+        return payload.get('object_kind') in self.handlers
+
+    def handle(self, payload):
+        try:
+            self.handlers[payload['object_kind']](payload)
+        except Exception as e:
+            print(f"Failed to handle {payload.get('object_kind')} hook: {e!r}")
+
+
+class ScoreboardServer(ThreadingHTTPServer):
+    """请求处理器通过 self.server 访问这些共享对象"""
+
+    def __init__(self, address, processor, roster, secret_token=None, record_path=None):
+        super().__init__(address, ScoreboardHandler)
+        self.processor = processor
+        self.roster = roster
+        self.secret_token = secret_token
+        self.record_path = record_path
+        self.record_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+
+class ScoreboardHandler(BaseHTTPRequestHandler):
+    def send_body(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/hook":
+            return self.send_body(404, {"error": "not found"})
+        secret_token = self.server.secret_token
+        if secret_token and not hmac.compare_digest(
+                self.headers.get("X-Gitlab-Token", "").encode(), secret_token.encode()):
+            return self.send_body(401, {"error": "invalid token"})
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self.send_body(400, {"error": "invalid json"})
+        if not self.server.processor.accepts(payload):
+            return self.send_body(200, {"status": "ignored"})
+        if self.server.record_path:
+            with self.server.record_lock, open(self.server.record_path, "a") as f:
+                f.write(json.dumps({"event": self.headers.get("X-Gitlab-Event"), "payload": payload},
+                                   ensure_ascii=False) + "\n")
+        # GitLab 要求 Webhook 尽快响应，拉取日志放到后台线程
+        self.server.executor.submit(self.server.processor.handle, payload)
+        self.send_body(200, {"status": "accepted"})
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/scores":
+            return self.send_body(200, self.server.processor.board.summary())
+        if not path.startswith("/scores/"):
+            return self.send_body(404, {"error": "not found"})
+        lab = path[len("/scores/"):]
+        csv = lab.endswith(".csv")
+        lab = lab.removesuffix(".csv")
+        if lab not in self.server.processor.config.ddl:
+            return self.send_body(404, {"error": f"unknown lab {lab}"})
+        table = self.server.processor.board.table(lab)
+        if not csv:
+            return self.send_body(200, table)
+        lines = []
+        for username, name, user_id, project_id in self.server.roster():
+            result = table[username]['result'] if username in table else "Failed"
+            lines.append(f"{username},{name},{user_id},{project_id},{result}")
+        self.send_body(200, "\n".join(lines).encode(), "text/csv")
+
+    def log_message(self, format, *log_args):
+        pass
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
+    parser.add_argument("--host", type=str, help="Address to listen on (default: scoreboard.host)")
+    parser.add_argument("--port", type=int, help="Port to listen on (default: scoreboard.port)")
+    parser.add_argument("--record", type=str, help="Append every received webhook to this JSON lines file")
+    parser.add_argument("--replay", type=str, help="POST webhooks recorded with --record to a running scoreboard and exit")
+    parser.add_argument("--url", type=str, help="Scoreboard URL used by --replay (default: http://<host>:<port>)")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = Dict(yaml.safe_load(f))
+
+    host = args.host or config.scoreboard.host or "127.0.0.1"
+    port = args.port or config.scoreboard.port or 8765
+    secret_token = config.scoreboard.secret_token or None
+
+    if args.replay:
+        replay(args.replay, args.url or f"http://{host}:{port}", secret_token)
+        return
+
+    identity_cache = IdentityCache.from_settings(config.identity_cache)
+    client = GitLabClient.from_config(config, pool_size=DEFAULT_WORKERS)
+    board = Scoreboard(config.scoreboard.state_path or Path(config.data_root).resolve() / "scoreboard.json",
+                       config.ddl)
+    processor = HookProcessor(config, board, client)
+
+    server = ScoreboardServer((host, port), processor, lambda: load_roster(config, identity_cache),
+                              secret_token, args.record)
+    print(f"Scoreboard listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
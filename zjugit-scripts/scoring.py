@@ -0,0 +1,56 @@
+"""评分规则
+
+get_score.py、retry_job.py 与 scoreboard.py 共用的成绩提取和迟交扣分逻辑。
+"""
+import re
+from datetime import datetime, timedelta
+
+# 测试脚本在日志中的起始行，成绩只从最后一次出现之后的部分提取
+TEST_MARKER = "$ python3 sp25-tests/test.py $CI_COMMIT_REF_NAME ."
+
+# GitLab 记录的 Job 因超时失败的原因（REST 的 failure_reason）
+TIMEOUT_FAILURE_REASONS = ('job_execution_timeout', 'stuck_or_timeout_failure')
+
+
+def extract_score_from_trace(trace, branch):
+    trace = trace.split(TEST_MARKER)[-1]
+    # print(trace)
+
+    assert f"Running {branch} test..." in trace, "No test found"
+
+    # ... Test score: 100.00 ...
+    score = re.search(r"Test score: (\d+\.\d+)", trace)
+    assert score, "No score found"
+
+    return float(score.group(1))
+
+
+def is_timeout(job, trace):
+    """Job 是否超时
+
+    在测试开始前（准备环境、构建阶段）超时的 Job 日志中没有 TEST_MARKER，只能由 failure_reason 判断；
+    测试中的超时由测试脚本在 TEST_MARKER 之后输出 Timeout。
+    """
+    return job.get('failure_reason') in TIMEOUT_FAILURE_REASONS or "Timeout" in trace
+
+
+def parse_gitlab_time(value):
+    """解析 GitLab 返回的 UTC 时间，返回不含时区的 UTC 时间
+
+    支持 REST（带毫秒）、GraphQL（不带毫秒）与 Webhook（以 " UTC" 结尾）三种格式。
+    """
+    # UTC, 2024-02-26T14:32:00.000Z / 2024-02-26T14:32:00Z / 2024-02-26 14:32:00 UTC
+    value = value.removesuffix(" UTC").replace("Z", "+00:00")
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+
+def late_score(score, created_at, ddl):
+    """按 Pipeline 创建时间计算迟交扣分，ddl 为 UTC+8 时间"""
+    submit_time = parse_gitlab_time(created_at)    # UTC
+    submit_time = submit_time + timedelta(hours=8)    # UTC+8
+    # 10% punishment for each day late
+    if submit_time > ddl:
+        days_late = (submit_time - ddl).days + 1
+        punish = max(0, 100 - days_late * 10)
+        return f"{score}*{punish}%"
+    return score
@@ -1,95 +1,82 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
 from pathlib import Path
-import requests
-from tqdm import tqdm
 from argparse import ArgumentParser
 import yaml
 from addict import Dict
+from identity_cache import IdentityCache, fill_roster_line
+from gitlab_client import GitLabClient, DEFAULT_WORKERS
+from branch_protection import (BranchProtectionReconciler, Protection, NO_ACCESS,
+                               CREATED, UPDATED, REPLACED, UNCHANGED)
 
 parser = ArgumentParser()
 parser.add_argument("branch", type=str, help="The branch name to set as protected")
+parser.add_argument("--from-group", action="store_true", help="Protect the branch in every cp-* project under repo.group (including subgroups) instead of the roster")
 parser.add_argument("--config", "-c", type=str, default="config.yaml", help="Path to the configuration file")
 args = parser.parse_args()
 
 with open(args.config, "r") as f:
     config = Dict(yaml.safe_load(f))
 
-GITLAB_URL = config.gitlab.url
-ACCESS_TOKEN = config.gitlab.token
-
 BRANCH_NAME = args.branch
 
-HEADERS = {
-    "Private-Token": ACCESS_TOKEN
-}
+client = GitLabClient.from_config(config, pool_size=DEFAULT_WORKERS)
+
+identity_cache = IdentityCache.from_settings(config.identity_cache)
 
 def get_group_projects(group_id):
-    """获取 group 下的所有项目"""
-    url = f"{GITLAB_URL}/groups/{group_id}/projects"
-    projects = []
-    page = 1
+    """逐个产出 group 及其子 group 下的所有项目，各页并发获取"""
+    try:
+        yield from client.iter_group_projects(group_id, include_subgroups=True)
+    except Exception as e:
+        print(f"获取项目列表失败: {e}")
 
-    while True:
-        response = requests.get(url, headers=HEADERS, params={"per_page": 100, "page": page})
-        if response.status_code != 200:
-            print(f"获取项目列表失败: {response.json()}")
-            return []
-        
-        data = response.json()
-        if not data:
-            break
-        
-        projects.extend(data)
-        page += 1
+def report(results, failures, names):
+    """打印失败的学生与各类结果的数量"""
+    for project_id, error in failures.items():
+        print(f"Failed to set protected branch for {names[project_id]}: {error}")
+    counts = Counter(results.values())
+    print(f"Total: {len(names)}, Created: {counts[CREATED]}, Updated: {counts[UPDATED]}, "
+          f"Replaced: {counts[REPLACED]}, Unchanged: {counts[UNCHANGED]}, Failed: {len(failures)}")
 
-    return projects
 
-def set_protected_branch(project_id, branch):
-    """设置指定项目的 protected branch 规则为 no one 可 push/merge"""
-    url = f"{GITLAB_URL}/projects/{project_id}/protected_branches/{branch}"
+# 期望的规则：no one 可 push/merge
+reconciler = BranchProtectionReconciler(client, BRANCH_NAME, Protection.of(NO_ACCESS, NO_ACCESS),
+                                        workers=DEFAULT_WORKERS)
 
-    # 先检查该分支是否已被保护
-    response = requests.get(url, headers=HEADERS)
-    
-    if response.status_code == 200:
-        # 如果分支已受保护，先解除保护
-        response = requests.delete(url, headers=HEADERS)
-        assert response.status_code == 204, f"解除分支保护失败: {response.json() if response.content else 'No content'}"
-    
-    # 创建新的保护分支
-    create_url = f"{GITLAB_URL}/projects/{project_id}/protected_branches"
-    response = requests.post(create_url, headers=HEADERS, json={
-        "name": branch,
-        "push_access_level": 0,
-        "merge_access_level": 0
-    })
-    
-    assert response.status_code == 201, f"创建受保护分支失败: {response.json()}"
+if args.from_group:
+    # 项目列表边获取边对账，不必等待全部页面返回
+    names = {}
 
-def process_student(username, name, user_id, project_id):
-    if project_id == "Failed":
-        print(f"Failed to find project for {username}")
-    try:
-        set_protected_branch(project_id, BRANCH_NAME)
-    except Exception as e:
-        print(f"Failed to set protected branch for cp-{username} {name}: {e}")
+    def student_projects():
+        for project in get_group_projects(config.repo.group):
+            if project['path'].startswith("cp-"):
+                names[str(project['id'])] = project['path_with_namespace']
+                yield project['id']
 
+    report(*reconciler.reconcile(student_projects()), names)
+    raise SystemExit
 
 data_root = Path(config.data_root).resolve() / "repo"
 
-classes = sorted(data_root.glob("*.csv"))
-for class_file in classes:
+# 整届学生一起批量读取与对账，再按班级汇总
+classes = []
+for class_file in sorted(data_root.glob("*.csv")):
     teacher, group_id = class_file.stem.split("-")
-    print(teacher, group_id)
-    results = []
+    names = {}
     with class_file.open() as f:
-        lines = f.readlines()
-    total = len(lines)
-    failed = 0
-    with ThreadPoolExecutor() as executor:
-        future_to_index = {executor.submit(process_student, *line.strip().split(",")): i for i, line in enumerate(lines)}
-        results_indexed = {}
-        for future in tqdm(as_completed(future_to_index), total=total):
-            i = future_to_index[future]
-            results_indexed[i] = future.result()
-    print(f"Total: {total}, Failed: {failed} ({failed/total:.2%})")
\ No newline at end of file
+        for line in f:
+            if not line.strip():
+                continue
+            username, name, user_id, project_id = fill_roster_line(identity_cache, line, f"{config.repo.group}/{teacher}")
+            if project_id == "Failed":
+                print(f"Failed to find project for {username}")
+                continue
+            names[str(project_id)] = f"cp-{username} {name}"
+    classes.append((teacher, group_id, names))
+
+results, failures = reconciler.reconcile(
+    project_id for teacher, group_id, names in classes for project_id in names)
+for teacher, group_id, names in classes:
+    print(teacher, group_id)
+    report({k: v for k, v in results.items() if k in names},
+           {k: v for k, v in failures.items() if k in names}, names)
@@ -0,0 +1,77 @@
+"""GitLabClient 与共享 RateLimiter 的交互，使用本地 HTTP 服务器模拟 GitLab
+
+    python -m unittest discover -s tests       # 在 zjugit-scripts 目录下运行
+"""
+import json
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from gitlab_client import GitLabClient, RateLimiter  # noqa: E402
+
+
+class ScriptedServer(ThreadingHTTPServer):
+    """按顺序返回预先给定的 (状态码, 响应头) 并记录请求次数，用完后返回 200"""
+
+    def __init__(self, responses):
+        super().__init__(("127.0.0.1", 0), ScriptedHandler)
+        self.responses = list(responses)
+        self.hits = 0
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits += 1
+        status, headers = self.server.responses.pop(0) if self.server.responses else (200, {})
+        body = json.dumps({"status": status}).encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RateLimitTest(unittest.TestCase):
+    def serve(self, responses):
+        server = ScriptedServer(responses)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        limiter = RateLimiter(rate=50, max_concurrency=8)
+        client = GitLabClient(f"http://127.0.0.1:{server.server_port}/api/v4", "token",
+                              backoff_factor=0, limiter=limiter)
+        return server, limiter, client
+
+    def test_429_reaches_limiter(self):
+        server, limiter, client = self.serve([(429, {"Retry-After": "1"})])
+
+        response = client.request("GET", "/projects")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.hits, 2)
+        # 429 没有被 urllib3 吞掉：全体暂停，并发与速率减半
+        self.assertEqual(limiter.concurrency, 4)
+        self.assertLess(limiter.rate, 50)
+        self.assertGreater(limiter._paused_until, 0.0)
+
+    def test_server_errors_retried_by_adapter(self):
+        server, limiter, client = self.serve([(503, {}), (502, {})])
+
+        response = client.request("GET", "/projects")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.hits, 3)
+        self.assertEqual(limiter.concurrency, 8)
+        self.assertEqual(limiter._paused_until, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
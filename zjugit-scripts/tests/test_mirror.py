@@ -0,0 +1,98 @@
+"""用本地裸仓库代替 GitLab 测试 mirror.py，不访问网络
+
+    python -m unittest discover -s tests       # 在 zjugit-scripts 目录下运行
+"""
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mirror import MirrorManager  # noqa: E402
+
+PATH = "Compiler/2025/alice/cp-3220100001"
+
+
+def git(*args, cwd=None):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True).stdout.decode().strip()
+
+
+class MirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        # 远端：允许部分克隆与按 id 获取对象的裸仓库
+        remote = root / "remotes" / f"{PATH}.git"
+        remote.parent.mkdir(parents=True)
+        git("init", "--quiet", "--bare", str(remote))
+        git("config", "uploadpack.allowFilter", "true", cwd=remote)
+        git("config", "uploadpack.allowAnySHA1InWant", "true", cwd=remote)
+
+        self.work = root / "work"
+        git("init", "--quiet", str(self.work))
+        self.commit({"src/main.c": b"int main() { return 0; }\n", "README.md": b"# lab\n"})
+        self.first = git("rev-parse", "HEAD", cwd=self.work)
+        self.commit({"src/main.c": b"int main() { return 1; }\n", "src/util.h": b"#define X 1\n"})
+        git("push", "--quiet", str(remote), "HEAD:refs/heads/lab1", cwd=self.work)
+
+        self.mirror = MirrorManager(root / "mirror", remote=f"file://{root}/remotes/{{path}}.git")
+        self.assertEqual(self.mirror.update("3220100001", PATH, 1), "cloned")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def commit(self, files):
+        for path, content in files.items():
+            (self.work / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.work / path).write_bytes(content)
+        git("add", "--all", cwd=self.work)
+        git("-c", "user.name=TA", "-c", "user.email=ta@example.com", "commit", "--quiet", "-m", "update", cwd=self.work)
+
+    def missing_objects(self, ref):
+        output = git("--git-dir", str(self.mirror.git_dir("3220100001")),
+                     "rev-list", "--objects", "--no-walk", "--missing=print", ref)
+        return {line[1:] for line in output.splitlines() if line.startswith("?")}
+
+    def test_resolve_and_list_tree(self):
+        head = git("rev-parse", "HEAD", cwd=self.work)
+        self.assertEqual(self.mirror.resolve("3220100001", "lab1"), head)
+        self.assertEqual(self.mirror.resolve("3220100001", self.first), self.first)
+
+        tree = self.mirror.list_tree("3220100001", "lab1", recursive=True)
+        self.assertEqual(sorted(item["path"] for item in tree), ["README.md", "src/main.c", "src/util.h"])
+        self.assertTrue(all(item["type"] == "blob" for item in tree))
+        src = self.mirror.list_tree("3220100001", "lab1", "src")
+        self.assertEqual([(item["name"], item["path"]) for item in src],
+                         [("main.c", "src/main.c"), ("util.h", "src/util.h")])
+
+    def test_read_file_and_blob(self):
+        self.assertEqual(self.mirror.read_file("3220100001", "lab1", "src/main.c"), b"int main() { return 1; }\n")
+        self.assertEqual(self.mirror.read_file("3220100001", self.first, "src/main.c"), b"int main() { return 0; }\n")
+        blob_id = git("rev-parse", "HEAD:src/util.h", cwd=self.work)
+        self.assertEqual(self.mirror.read_blob("3220100001", blob_id), b"#define X 1\n")
+
+    def test_read_blobs_fetches_missing_blobs_at_once(self):
+        tree = self.mirror.list_tree("3220100001", "lab1", recursive=True)
+        blob_ids = {item["id"] for item in tree}
+        # 部分克隆中还没有任何文件内容
+        self.assertEqual(self.missing_objects("lab1"), blob_ids)
+
+        blobs = self.mirror.read_blobs("3220100001", "lab1", blob_ids)
+
+        self.assertEqual(self.missing_objects("lab1"), set())
+        contents = {item["path"]: blobs[item["id"]] for item in tree}
+        self.assertEqual(contents, {"README.md": b"# lab\n", "src/main.c": b"int main() { return 1; }\n",
+                                    "src/util.h": b"#define X 1\n"})
+
+    def test_fetch_updates_mirror(self):
+        self.commit({"src/main.c": b"int main() { return 2; }\n"})
+        git("push", "--quiet", str(Path(self.tmp.name) / "remotes" / f"{PATH}.git"), "HEAD:refs/heads/lab1", cwd=self.work)
+
+        self.assertEqual(self.mirror.update("3220100001", PATH, 1), "fetched")
+        self.assertEqual(self.mirror.resolve("3220100001", "lab1"), git("rev-parse", "HEAD", cwd=self.work))
+        self.assertEqual(self.mirror.read_file("3220100001", "lab1", "src/main.c"), b"int main() { return 2; }\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
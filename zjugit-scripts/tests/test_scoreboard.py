@@ -0,0 +1,115 @@
+"""用记录的 Webhook 与 Job 日志重放 scoreboard.py 的处理流程，不访问 GitLab
+
+    python -m unittest discover -s tests       # 在 zjugit-scripts 目录下运行
+"""
+import json
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+import requests
+from addict import Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from scoreboard import HookProcessor, Scoreboard, ScoreboardServer  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "scoreboard"
+
+
+class RecordedClient:
+    """从 fixtures 读取 Job 日志与 Pipeline，记录被请求的日志"""
+
+    def __init__(self):
+        self.pipelines = json.loads((FIXTURES / "pipelines.json").read_text())
+        self.traces = []
+
+    def get_job_trace_tail(self, project_id, job_id, marker):
+        self.traces.append(job_id)
+        return (FIXTURES / "traces" / f"{job_id}.log").read_text()
+
+    def get_pipeline(self, project_id, pipeline_id):
+        return self.pipelines[str(pipeline_id)]
+
+
+def load_hooks():
+    with open(FIXTURES / "hooks.jsonl") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ScoreboardReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = Dict({
+            "repo": {"group": "Compiler/2025"},
+            "ddl": {"lab4": datetime(2025, 6, 9, 5, 0, 0)},
+        })
+        self.state_path = Path(self.tmp.name) / "scoreboard.json"
+        self.board = Scoreboard(self.state_path, self.config.ddl)
+        self.client = RecordedClient()
+        self.processor = HookProcessor(self.config, self.board, self.client)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def replay(self):
+        for hook in load_hooks():
+            if self.processor.accepts(hook["payload"]):
+                self.processor.handle(hook["payload"])
+
+    def test_replay_builds_scoreboard(self):
+        self.replay()
+
+        table = self.board.table("lab4")
+        self.assertEqual(sorted(table), ["3220100001", "3220100003", "3220100004"])
+
+        on_time = table["3220100001"]
+        self.assertEqual((on_time["pipeline_id"], on_time["job_id"]), (501, 1001))
+        self.assertEqual(on_time["created_at"], "2025-06-01T11:59:58.123Z")
+        self.assertEqual(on_time["result"], 100.0)
+
+        # Pipeline Webhook 取最新的 Job，迟交按 Pipeline 创建时间扣分
+        late = table["3220100003"]
+        self.assertEqual(late["job_id"], 1004)
+        self.assertEqual(late["result"], "60.0*80%")
+
+        failed = table["3220100004"]
+        self.assertIsNone(failed["score"])
+        self.assertEqual(failed["error"], "No test found")
+        self.assertEqual(failed["result"], "Failed")
+
+        # 运行中、非实验分支、非学生仓库的事件不拉取日志；旧 Job 拉取后被忽略
+        self.assertEqual(self.client.traces, [1001, 1004, 990, 1007])
+        self.assertEqual(self.board.summary(), {"lab4": 3})
+
+    def test_replay_is_idempotent_and_persisted(self):
+        self.replay()
+        self.client.traces.clear()
+        self.replay()
+        # 已记录的 Job 不再拉取日志
+        self.assertEqual(self.client.traces, [990])
+
+        reloaded = Scoreboard(self.state_path, self.config.ddl)
+        self.assertEqual(reloaded.table("lab4"), self.board.table("lab4"))
+
+    def test_hook_endpoint_checks_token(self):
+        server = ScoreboardServer(("127.0.0.1", 0), self.processor, lambda: [], secret_token="s3cret")
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/hook"
+            payload = load_hooks()[0]["payload"]
+            self.assertEqual(requests.post(url, json=payload).status_code, 401)
+            self.assertEqual(requests.post(url, json=payload, headers={"X-Gitlab-Token": "wrong"}).status_code, 401)
+            response = requests.post(url, json=payload, headers={"X-Gitlab-Token": "s3cret"})
+            self.assertEqual(response.json(), {"status": "accepted"})
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(self.board.table("lab4")["3220100001"]["result"], 100.0)
+
+
+if __name__ == "__main__":
+    unittest.main()